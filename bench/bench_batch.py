@@ -0,0 +1,66 @@
+"""
+bench_batch.py
+--------------
+
+Overhead per run of a cheap element-wise experiment, run one call per
+parameter set or stacked in batches with @experiment(batch=True).
+
+Both variants write one result file per run, so the difference is the
+cost of dispatching each run to the pool and back. The consolidated
+variant writes a single file per batch (batch_output = one).
+
+Usage:
+    python bench/bench_batch.py
+
+"""
+
+import os
+from time import perf_counter
+from tempfile import TemporaryDirectory
+import numpy as np
+from decu import Script, experiment, config, parallel, run_parallel
+
+RUNS = 2000
+DATA = np.arange(100)
+
+
+class BenchScript(Script):
+    @experiment(data_param='data')
+    def single(self, data, param, param2):
+        return np.power(data, param) + param2
+
+    @experiment(data_param='data', batch=True)
+    def batched(self, data, param, param2):
+        return np.power(data, param[:, None]) + param2[:, None]
+
+
+def _time(method_name, output='each'):
+    params = [(DATA, p % 5, p) for p in range(RUNS)]
+    cwd = os.getcwd()
+    option = config['experiment']['batch_output']
+    config['experiment']['batch_output'] = output
+    with TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            script = BenchScript(tmp, 'bench')
+            run_parallel(getattr(script, method_name), params[:10])
+            start = perf_counter()
+            run_parallel(getattr(script, method_name), params)
+            elapsed = perf_counter() - start
+        finally:
+            os.chdir(cwd)
+            config['experiment']['batch_output'] = option
+            parallel.shutdown()
+    return elapsed / RUNS * 1e6
+
+
+def bench_batch_overhead():
+    """Microseconds per run, one call per run or in batches."""
+    return {'single_us_per_run': _time('single'),
+            'batch_us_per_run': _time('batched'),
+            'batch_one_file_us_per_run': _time('batched', 'one')}
+
+
+if __name__ == '__main__':
+    for name, value in sorted(bench_batch_overhead().items()):
+        print('{:<30} {:>10.2f}'.format(name, value))
@@ -0,0 +1,94 @@
+"""
+bench_experiment.py
+-------------------
+
+Bookkeeping overhead of each call to @experiment and @figure methods.
+
+The experiment does nothing and returns None, so that only the work done
+by the decorator is measured: allocating a run identifier, binding the
+parameters, timing the call, and building the log messages. It is
+measured with the log of the Script disabled, which is the overhead
+before the logger, and enabled, which adds formatting and writing each
+record. Exits with status 1 if the former exceeds BUDGET_US.
+
+The figure draws nothing and is not saved, so that only the decorator and
+fetching the current figure from pyplot are measured.
+
+Usage:
+    python bench/bench_experiment.py
+
+"""
+
+import os
+import sys
+import logging
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from decu import Script, experiment, figure
+
+CALLS = 20000
+FIGURE_CALLS = 2000
+BUDGET_US = 20
+
+
+class BenchScript(Script):
+    @experiment(data_param='data')
+    def exp(self, data, param, param2=0):
+        return None
+
+    @figure(save=False)
+    def plot(self):
+        pass
+
+
+def _time(script):
+    for _ in range(100):
+        script.exp(None, 1, param2=2)
+    start = perf_counter()
+    for _ in range(CALLS):
+        script.exp(None, 1, param2=2)
+    return (perf_counter() - start) / CALLS * 1e6
+
+
+def bench_experiment_overhead():
+    """Microseconds per call, with the log disabled and enabled."""
+    cwd = os.getcwd()
+    with TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            script = BenchScript(tmp, 'bench')
+            logger = script.log._logger()
+            logger.setLevel(logging.CRITICAL + 1)
+            silent = _time(script)
+            logger.setLevel(logging.INFO)
+            logged = _time(script)
+        finally:
+            os.chdir(cwd)
+    return {'no_log_us_per_call': silent, 'log_us_per_call': logged}
+
+
+def bench_figure_overhead():
+    """Microseconds per call of a @figure method that is not saved."""
+    cwd = os.getcwd()
+    with TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            script = BenchScript(tmp, 'bench')
+            script.plot()
+            start = perf_counter()
+            for _ in range(FIGURE_CALLS):
+                script.plot()
+            elapsed = perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    return {'figure_us_per_call': elapsed / FIGURE_CALLS * 1e6}
+
+
+if __name__ == '__main__':
+    for name, value in sorted(bench_figure_overhead().items()):
+        print('{:<30} {:>10.2f}'.format(name, value))
+    results = bench_experiment_overhead()
+    for name, value in sorted(results.items()):
+        print('{:<30} {:>10.2f}'.format(name, value))
+    if results['no_log_us_per_call'] > BUDGET_US:
+        sys.exit('@experiment overhead exceeds {}us'.format(BUDGET_US))
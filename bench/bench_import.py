@@ -0,0 +1,78 @@
+"""
+bench_import.py
+---------------
+
+Time it takes to `import decu` in a fresh interpreter, and to run a script
+that does nothing with `decu exec`.
+
+Every `decu exec`, `decu inspect` and worker process pays the import once.
+The time of starting an interpreter that imports nothing is subtracted.
+Exits with status 1 if the import takes longer than THRESHOLD_S, or if it
+imports any of the HEAVY libraries, which decu must only load when needed.
+
+Usage:
+    python bench/bench_import.py
+
+"""
+
+import os
+import sys
+import subprocess
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from statistics import median
+
+REPEAT = 7
+THRESHOLD_S = 0.3
+HEAVY = ['matplotlib', 'pandas', 'numpy', 'networkx']
+
+SCRIPT = """
+import decu
+
+
+class EmptyScript(decu.Script):
+    def main(self):
+        pass
+"""
+
+
+def _time(*args, cwd=None):
+    times = []
+    for _ in range(REPEAT):
+        start = perf_counter()
+        subprocess.check_call([sys.executable] + list(args), cwd=cwd)
+        times.append(perf_counter() - start)
+    return median(times)
+
+
+def heavy_imports():
+    """Return the HEAVY libraries imported by `import decu`."""
+    code = 'import sys, decu; print(" ".join(sys.modules))'
+    modules = subprocess.check_output([sys.executable, '-c', code])
+    return sorted(set(modules.decode().split()) & set(HEAVY))
+
+
+def bench_import():
+    """Seconds to import decu, beyond starting the interpreter."""
+    return {'import_decu_s': _time('-c', 'import decu') - _time('-c', 'pass')}
+
+
+def bench_exec():
+    """Seconds for `decu exec` to run a script that does nothing."""
+    with TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'src'))
+        with open(os.path.join(tmp, 'src', 'empty.py'), 'w') as file:
+            file.write(SCRIPT)
+        return {'exec_empty_script_s': _time('-m', 'decu', 'exec',
+                                             'src/empty.py', cwd=tmp)}
+
+
+if __name__ == '__main__':
+    results = bench_import()
+    for name, value in sorted(dict(results, **bench_exec()).items()):
+        print('{:<30} {:>10.6f}'.format(name, value))
+    heavy = heavy_imports()
+    if heavy:
+        sys.exit('import decu imported {}'.format(', '.join(heavy)))
+    if results['import_decu_s'] > THRESHOLD_S:
+        sys.exit('import decu took longer than {}s'.format(THRESHOLD_S))
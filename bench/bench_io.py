@@ -0,0 +1,138 @@
+"""
+bench_io.py
+-----------
+
+Time to write and read a result of each type supported by decu.io, and
+time and size of each format that can be chosen for arrays and frames,
+and time to load many files with read_many.
+
+Types and formats whose library is not installed are left out.
+
+Usage:
+    python bench/bench_io.py
+
+"""
+
+import os
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from decu import config
+from decu.io import write, read, read_many
+
+REPEAT = 20
+
+
+def _samples():
+    """Return a dict of name: result, one for each available type."""
+    samples = {'int': 123456789, 'float': 3.14159, 'str': 'x' * 10000,
+               'dict': {str(i): i for i in range(1000)}}
+    try:
+        import numpy as np
+        samples['ndarray'] = np.random.random((1000, 100))
+    except ImportError:
+        return samples
+    try:
+        import pandas as pd
+        samples['DataFrame'] = pd.DataFrame(np.random.random((1000, 10)))
+        samples['Series'] = pd.Series(np.random.random(10000))
+    except ImportError:
+        pass
+    try:
+        import networkx as nx
+        samples['Graph'] = nx.gnm_random_graph(500, 2000, seed=0)
+    except ImportError:
+        pass
+    return samples
+
+
+def bench_io():
+    """Milliseconds to write and to read each type of result."""
+    metrics = {}
+    with TemporaryDirectory() as tmp:
+        basename = os.path.join(tmp, 'result')
+        for name, result in _samples().items():
+            start = perf_counter()
+            for _ in range(REPEAT):
+                filename = write(result, basename)
+            metrics['write_ms_' + name] = \
+                (perf_counter() - start) / REPEAT * 1e3
+            start = perf_counter()
+            for _ in range(REPEAT):
+                read(filename)
+            metrics['read_ms_' + name] = \
+                (perf_counter() - start) / REPEAT * 1e3
+            os.remove(filename)
+    return metrics
+
+
+# The formats to compare for each type, keyed by its option in section io.
+FORMATS = {
+    'ndarray_format': ('ndarray', ['npy', 'npz', 'pickle']),
+    'dataframe_format': ('DataFrame', ['csv', 'pickle', 'parquet',
+                                       'feather'])
+}
+
+
+def bench_formats():
+    """Milliseconds to write and read, and kilobytes on disk, per format."""
+    metrics = {}
+    samples = _samples()
+    with TemporaryDirectory() as tmp:
+        basename = os.path.join(tmp, 'result')
+        for option, (name, formats) in FORMATS.items():
+            if name not in samples:
+                continue
+            result = samples[name]
+            default = config['io'][option]
+            for fmt in formats:
+                config['io'][option] = fmt
+                key = '{}_{}'.format(name, fmt)
+                try:
+                    start = perf_counter()
+                    for _ in range(REPEAT):
+                        filename = write(result, basename)
+                    metrics['write_ms_' + key] = \
+                        (perf_counter() - start) / REPEAT * 1e3
+                except ImportError:
+                    # E.g., parquet and feather without pyarrow.
+                    continue
+                finally:
+                    config['io'][option] = default
+                start = perf_counter()
+                for _ in range(REPEAT):
+                    read(filename)
+                metrics['read_ms_' + key] = \
+                    (perf_counter() - start) / REPEAT * 1e3
+                metrics['size_kb_' + key] = os.path.getsize(filename) / 1e3
+                os.remove(filename)
+    return metrics
+
+
+def bench_read_many(count=200):
+    """Milliseconds to load count array files serially and with read_many."""
+    import numpy as np
+    metrics = {}
+    with TemporaryDirectory() as tmp:
+        paths = [write(np.random.random((100, 100)),
+                       os.path.join(tmp, 'result{}'.format(index)))
+                 for index in range(count)]
+        start = perf_counter()
+        [read(path) for path in paths]
+        metrics['serial_ms'] = (perf_counter() - start) * 1e3
+        for backend in ['thread', 'process']:
+            start = perf_counter()
+            read_many(paths, backend=backend)
+            metrics['read_many_{}_ms'.format(backend)] = \
+                (perf_counter() - start) * 1e3
+        start = perf_counter()
+        read_many(paths, stack=True)
+        metrics['read_many_stack_ms'] = (perf_counter() - start) * 1e3
+    return metrics
+
+
+if __name__ == '__main__':
+    metrics = bench_io()
+    metrics.update(bench_formats())
+    metrics.update(bench_read_many())
+    for name, value in sorted(metrics.items()):
+        print('{:<30} {:>10.3f}'.format(name, value))
@@ -0,0 +1,58 @@
+"""
+bench_logging.py
+----------------
+
+Cost of logging from inside experiments run by worker processes.
+
+Each run of the experiment logs RECORDS records through self.log, as an
+experiment that reports its progress would. The time per record includes
+sending it to the process that writes the logfile, and writing it there,
+since run_parallel only returns once the logfile holds every record.
+
+Usage:
+    python bench/bench_logging.py
+
+"""
+
+import os
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from decu import Script, experiment, run_parallel
+from decu import parallel
+
+RUNS = 8
+RECORDS = 5000
+
+
+class BenchScript(Script):
+    @experiment()
+    def exp(self, records):
+        for index in range(records):
+            self.log.info('Step {} of {}.'.format(index, records))
+        return None
+
+
+def bench_worker_logging():
+    """Microseconds per record logged by the workers of a process pool."""
+    cwd = os.getcwd()
+    with TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            script = BenchScript(tmp, 'bench')
+            parallel.get_pool('process')
+            run_parallel(script.exp, [(1,)] * RUNS, backend='process')
+            start = perf_counter()
+            run_parallel(script.exp, [(RECORDS,)] * RUNS, backend='process')
+            elapsed = perf_counter() - start
+            with open(script.log.logfile) as file:
+                written = sum(1 for line in file if 'Step' in line)
+        finally:
+            parallel.shutdown()
+            os.chdir(cwd)
+    assert written == RUNS * (RECORDS + 1)
+    return {'us_per_record': elapsed / (RUNS * RECORDS) * 1e6}
+
+
+if __name__ == '__main__':
+    for name, value in sorted(bench_worker_logging().items()):
+        print('{:<30} {:>10.2f}'.format(name, value))
@@ -0,0 +1,55 @@
+"""
+bench_parallel.py
+-----------------
+
+Throughput of run_parallel, by number of workers and size of the payload.
+
+Each task receives an array of the given size and returns a number, so
+the measure includes sending the arguments to the workers. The largest
+payloads stay below share_min_bytes, so that they are copied with every
+task rather than published once (see section parallel in decu.cfg).
+
+Usage:
+    python bench/bench_parallel.py
+
+"""
+
+from time import perf_counter
+import numpy as np
+from decu import config, parallel, run_parallel
+
+TASKS = 400
+WORKERS = [1, 2, 4]
+PAYLOADS = [8, 8 * 1024, 256 * 1024]
+
+
+def _total(payload):
+    return float(payload.sum())
+
+
+def _time(workers, payload_bytes):
+    option = config['parallel']['workers']
+    config['parallel']['workers'] = str(workers)
+    parallel.shutdown()
+    try:
+        # Distinct arrays, or pickle would send each one only once per chunk.
+        params = [(np.ones(payload_bytes // 8),) for _ in range(TASKS)]
+        run_parallel(_total, params[:workers])
+        start = perf_counter()
+        run_parallel(_total, params)
+        return perf_counter() - start
+    finally:
+        parallel.shutdown()
+        config['parallel']['workers'] = option
+
+
+def bench_parallel_throughput():
+    """Tasks per second, by number of workers and payload bytes."""
+    return {'tasks_per_s_{}w_{}b'.format(workers, payload):
+            TASKS / _time(workers, payload)
+            for workers in WORKERS for payload in PAYLOADS}
+
+
+if __name__ == '__main__':
+    for name, value in sorted(bench_parallel_throughput().items()):
+        print('{:<30} {:>12,.0f}'.format(name, value))
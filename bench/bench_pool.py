@@ -0,0 +1,54 @@
+"""
+bench_pool.py
+-------------
+
+Latency of many short sweeps, with and without reusing the worker pool.
+
+Each sweep runs a trivial experiment over a handful of parameters, as a
+main() running many small sweeps back to back would. The baseline starts
+and stops a new Pool for every sweep, as run_parallel used to.
+
+Usage:
+    python bench/bench_pool.py
+
+"""
+
+from time import perf_counter
+from multiprocessing import Pool
+from decu import parallel, run_parallel
+
+SWEEPS = 20
+PARAMS = [(p,) for p in range(8)]
+
+
+def _square(x):
+    return x * x
+
+
+def _time_fresh_pools():
+    start = perf_counter()
+    for _ in range(SWEEPS):
+        with Pool(parallel.num_workers()) as pool:
+            pool.starmap(_square, PARAMS)
+    return perf_counter() - start
+
+
+def _time_shared_pool():
+    parallel.shutdown()
+    start = perf_counter()
+    for _ in range(SWEEPS):
+        run_parallel(_square, PARAMS)
+    elapsed = perf_counter() - start
+    parallel.shutdown()
+    return elapsed
+
+
+def bench_short_sweeps():
+    """Seconds per short sweep, starting fresh pools or reusing one."""
+    return {'fresh_pool_s_per_sweep': _time_fresh_pools() / SWEEPS,
+            'shared_pool_s_per_sweep': _time_shared_pool() / SWEEPS}
+
+
+if __name__ == '__main__':
+    for name, value in sorted(bench_short_sweeps().items()):
+        print('{:<30} {:>10.6f}'.format(name, value))
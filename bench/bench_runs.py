@@ -0,0 +1,74 @@
+"""
+bench_runs.py
+-------------
+
+Contention benchmark for the allocation of run identifiers.
+
+Compare decu.runs.RunAllocator against a single counter guarded by a
+multiprocessing.Lock, as decu used before, when several processes allocate
+identifiers at the same time.
+
+Usage:
+    python bench/bench_runs.py
+
+"""
+
+import os
+import tempfile
+from time import perf_counter
+from multiprocessing import Pool, Lock, Value
+from decu.runs import next_run
+
+IDS_PER_TASK = 20000
+WORKERS = [1, 2, 4, 8]
+
+
+def _init_locked(*args):
+    global lock, counter
+    lock, counter = args
+
+
+def _take_locked(n):
+    for _ in range(n):
+        with lock:
+            counter.value += 1
+
+
+def _take_allocated(args):
+    filename, n = args
+    for _ in range(n):
+        next_run(filename, 64)
+
+
+def _time_locked(workers):
+    args = (Lock(), Value('i', 0))
+    with Pool(workers, initializer=_init_locked, initargs=args) as pool:
+        start = perf_counter()
+        pool.map(_take_locked, [IDS_PER_TASK] * workers)
+        return perf_counter() - start
+
+
+def _time_allocated(workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'counter')
+        with Pool(workers) as pool:
+            start = perf_counter()
+            pool.map(_take_allocated, [(filename, IDS_PER_TASK)] * workers)
+            return perf_counter() - start
+
+
+def bench_run_allocation():
+    """Identifiers allocated per second, by scheme and number of workers."""
+    metrics = {}
+    for workers in WORKERS:
+        total = IDS_PER_TASK * workers
+        metrics['locked_ids_per_s_{}'.format(workers)] = \
+            total / _time_locked(workers)
+        metrics['allocator_ids_per_s_{}'.format(workers)] = \
+            total / _time_allocated(workers)
+    return metrics
+
+
+if __name__ == '__main__':
+    for name, value in sorted(bench_run_allocation().items()):
+        print('{:<30} {:>14,.0f}'.format(name, value))
@@ -0,0 +1,156 @@
+"""
+run.py
+------
+
+Run decu's benchmark suite and write the results as JSON.
+
+Every bench_*() function of every bench/bench_*.py module is run, in a
+separate process so that benchmarks do not affect each other. Each
+returns a dict of metrics, which are collected as
+
+    {"commit": ..., "python": ..., "results": {"module.function": {...}}}
+
+With --compare, the suite is run against the decu package of each of two
+commits, checked out with `git worktree`, and the metrics are printed
+side by side. The benchmarks themselves are always those of the working
+tree, so that both commits are measured in the same way. Benchmarks that
+fail, e.g., because they use a feature missing from one of the commits,
+are recorded with their error instead of their metrics.
+
+Usage:
+    python bench/run.py [-o results.json] [-k pattern]
+    python bench/run.py --compare base_commit new_commit [-o results.json]
+
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from glob import glob
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def discover(pattern=None):
+    """Return the names 'module.function' of every benchmark."""
+    import ast
+    names = []
+    for path in sorted(glob(os.path.join(BENCH_DIR, 'bench_*.py'))):
+        module = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as file:
+            tree = ast.parse(file.read())
+        for node in tree.body:
+            if isinstance(node, ast.FunctionDef) and \
+               node.name.startswith('bench_'):
+                name = '{}.{}'.format(module, node.name)
+                if pattern is None or pattern in name:
+                    names.append(name)
+    return names
+
+
+def run_one(name, decu_dir=ROOT_DIR):
+    """Run the benchmark name against the decu package in decu_dir."""
+    code = ('import json, sys, importlib\n'
+            'module, function = sys.argv[1].split(".")\n'
+            'metrics = getattr(importlib.import_module(module), function)()\n'
+            'print(json.dumps(metrics))')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [decu_dir, BENCH_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    proc = subprocess.run([sys.executable, '-c', code, name], env=env,
+                          cwd=decu_dir, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def commit_of(directory):
+    """Return the commit checked out in directory, or None."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=directory,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(pattern=None, decu_dir=ROOT_DIR):
+    """Run every benchmark against the decu package in decu_dir."""
+    results = {}
+    for name in discover(pattern):
+        print('running {}'.format(name), file=sys.stderr)
+        results[name] = run_one(name, decu_dir)
+    return {'commit': commit_of(decu_dir),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'results': results}
+
+
+def compare(base, new, pattern=None):
+    """Run the suite against the commits base and new."""
+    runs = {}
+    tmp = tempfile.mkdtemp()
+    try:
+        for commit in [base, new]:
+            worktree = os.path.join(tmp, commit.replace('/', '_'))
+            subprocess.check_call(['git', 'worktree', 'add', '--detach',
+                                   worktree, commit], cwd=ROOT_DIR)
+            try:
+                runs[commit] = run_suite(pattern, worktree)
+            finally:
+                subprocess.check_call(['git', 'worktree', 'remove', '--force',
+                                       worktree], cwd=ROOT_DIR)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return runs
+
+
+def print_comparison(base, new):
+    """Print the metrics of the suite runs base and new side by side."""
+    print('{:<60} {:>12} {:>12} {:>8}'.format('metric', 'base', 'new',
+                                              'new/base'))
+    for name, metrics in sorted(base['results'].items()):
+        other = new['results'].get(name, {})
+        for metric, value in sorted(metrics.items()):
+            if metric == 'error' or not isinstance(other.get(metric),
+                                                   (int, float)):
+                continue
+            ratio = other[metric] / value if value else float('nan')
+            print('{:<60} {:>12.4g} {:>12.4g} {:>8.2f}'.format(
+                '{}.{}'.format(name, metric), value, other[metric], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the decu benchmarks.')
+    parser.add_argument('-o', dest='output', help='file to write the JSON '
+                        'results to, instead of standard output')
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks '
+                        'whose name contains this string')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='run the suite against two commits')
+    args = parser.parse_args()
+
+    if args.compare:
+        base, new = args.compare
+        results = compare(base, new, args.pattern)
+        print_comparison(results[base], results[new])
+    else:
+        results = run_suite(args.pattern)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,10 +20,61 @@ def _extract_script_class(module):
             return obj
 
 
-def exec_script(files):
-    """Execute the main function inside each file."""
+def exec_script(files, jobs=1):
+    """Execute the main function inside each file.
+
+    With jobs > 1, run up to jobs files at the same time, each in its own
+    process. See _exec_concurrently.
+
+    """
+    if jobs > 1 and len(files) > 1:
+        return _exec_concurrently(files, jobs)
+    try:
+        return _exec_files(files)
+    finally:
+        decu.parallel.shutdown()
+        decu.logging.flush()
+
+
+def _exec_concurrently(files, jobs):
+    """Execute each file in a `decu exec` subprocess, jobs at a time.
+
+    The workers available to run_parallel (see workers in section parallel
+    of decu.cfg) are split evenly among the files running at the same time,
+    through the DECU_WORKERS environment variable, so that the scripts do
+    not compete for the same CPUs. Print how long each file took, and
+    return 0 if all of them succeeded, or 1 otherwise.
+
+    """
+    import subprocess
+    from time import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    jobs = min(jobs, len(files))
+    env = dict(os.environ)
+    env['DECU_WORKERS'] = str(max(1, decu.parallel.num_workers() // jobs))
+
+    def run(file):
+        start = time()
+        code = subprocess.call([sys.executable, '-m', 'decu', 'exec', file],
+                               env=env)
+        return code, time() - start
+
+    with ThreadPoolExecutor(jobs) as executor:
+        outcomes = list(executor.map(run, files))
+
+    width = max(len(file) for file in files)
+    print('{:<{}}  {:>4}  {:>10}'.format('script', width, 'exit', 'wall time'))
+    for file, (code, elapsed) in zip(files, outcomes):
+        print('{:<{}}  {:>4}  {:>9.2f}s'.format(file, width, code, elapsed))
+    return 0 if all(code == 0 for code, _ in outcomes) else 1
+
+
+def _exec_files(files):
+    """Execute the main function inside each file, one after the other."""
     import logging
 
+    failed = []
     for file in files:
         module_path, module_file = os.path.split(file)
         module_name, _ = os.path.splitext(module_file)
@@ -36,14 +87,69 @@ def exec_script(files):
 
         script = _extract_script_class(module)()
         script.main()
+        # The workers of the next script need its sys.path and config. The
+        # coordinator of decu serve keeps its workers for every script.
+        decu.parallel.shutdown(decu.parallel.copying_backends)
+        errors = decu.writer.flush()
+        if errors or decu.writer.worker_failures():
+            failed.append(module_file)
+        decu.logging.flush()
         logger = logging.getLogger()
         for handler in logger.handlers[:]:
             handler.flush()
             logger.removeHandler(handler)
 
+    if failed:
+        return 'Could not write some results of {}. See the logs.'.format(
+            ', '.join(failed))
     return 0
 
 
+def serve(files, address=None):
+    """Execute each file, running its experiments on a cluster.
+
+    Every call to run_parallel made by the scripts is handed to the workers
+    connected to this coordinator. See decu.cluster.
+
+    """
+    from decu.cluster import configured_authkey
+    from binascii import hexlify
+
+    if address is not None:
+        decu.config.set('cluster', 'address', address)
+    generated = not configured_authkey()
+    if generated:
+        decu.config.set('cluster', 'authkey', hexlify(os.urandom(16)).decode())
+    decu.config.set('parallel', 'backend', 'cluster')
+    coordinator = decu.parallel.get_pool('cluster')
+    print('Waiting for workers on {}'.format(coordinator.address))
+    if generated:
+        print('Start them with: DECU_AUTHKEY={} decu worker --connect '
+              '{}'.format(decu.config['cluster']['authkey'],
+                          coordinator.address))
+    return exec_script(files)
+
+
+def worker(address=None, processes=1):
+    """Run experiments for the coordinator at address."""
+    from multiprocessing import Process
+    from decu.cluster import work, configured_authkey
+
+    if not configured_authkey():
+        return ('No secret key for the cluster. Set DECU_AUTHKEY to the one '
+                'printed by decu serve.')
+    address = address or decu.config['cluster']['address']
+    if processes == 1:
+        return work(address)
+    workers = [Process(target=work, args=(address,))
+               for _ in range(processes)]
+    for proc in workers:
+        proc.start()
+    for proc in workers:
+        proc.join()
+    return max(proc.exitcode for proc in workers)
+
+
 def init(directory):
     """Initialize the directory for a decu project."""
     cfg = decu.config['Script']
@@ -54,6 +160,17 @@ def init(directory):
     return 0
 
 
+def reindex():
+    """Rebuild the catalog of the project in this directory."""
+    from decu.catalog import get_catalog, reindex as rebuild
+    cfg = decu.config['Script']
+    catalog = get_catalog(os.path.join(cfg['state_dir'], cfg['catalog_file']))
+    count = rebuild(catalog, cfg['results_dir'], cfg['figures_dir'],
+                    decu.config['logging']['logs_dir'])
+    print('Indexed {} files in {}'.format(count, catalog.filename))
+    return 0
+
+
 def _parse_inspect_opts(opts):
     """Parse the remainder of the options given to decu inspect."""
     if len(opts) % 2 != 0:
@@ -111,11 +228,59 @@ def _make_py_script(script, files, command, kwargs):
     return cmd_full, cmd_show
 
 
-def inspect(files, command=None, **kwargs):
+def _lazy_namespace(script, files, kwargs):
+    """Return the namespace of a lazy inspect session. See inspect."""
+    from decu.lazy import LazyResults, LazyNamespace
+    namespace = LazyNamespace({}, decu=decu)
+    lazy = namespace.lazy
+    if script is not None:
+        scripts_dir = decu.config['Script']['scripts_dir']
+
+        def load_script():
+            sys.path.append(scripts_dir)
+            module = import_module(script)
+            return _extract_script_class(module)()
+        lazy['script'] = load_script
+    if len(files) == 1:
+        lazy['result'] = lambda: decu.io.read(files[0], mmap=True)
+    else:
+        namespace['result'] = LazyResults(files)
+    for name, path in kwargs.items():
+        lazy[name] = lambda path=path: decu.io.read(path, mmap=True)
+    return namespace
+
+
+def _inspect_lazily(script, files, command, kwargs):
+    """Run an inspect session in this process, reading files lazily."""
+    namespace = _lazy_namespace(script, files, kwargs)
+    cfg = decu.config['inspect']
+    names = ['script'] if script is not None else []
+    print('\n'.join(cfg.subs('lazy_replace', var=name)
+                    for name in names + ['result'] + list(kwargs)))
+    if command is not None:
+        exec(command, namespace)
+        return 0
+    try:
+        from IPython import start_ipython
+    except ImportError:
+        import code
+        code.interact(local=namespace)
+    else:
+        start_ipython(argv=['--no-banner'], user_ns=namespace)
+    return 0
+
+
+def inspect(files, command=None, lazy=None, **kwargs):
     """Load files into ipython.
 
     All files loaded must have been generated by the same script.
 
+    With lazy, or if lazy is None and the lazy option of section inspect is
+    set, the session runs in this process instead, and nothing is read
+    until it is used: the results are exposed as a decu.lazy.LazyResults,
+    npy files are read as memory maps, and the additional variables are
+    read with decu.io.read.
+
     """
     from subprocess import call
     from tempfile import NamedTemporaryFile
@@ -123,6 +288,8 @@ def inspect(files, command=None, **kwargs):
     for file in files:
         if not os.path.exists(file):
             return 'File {} not found.'.format(file)
+    if lazy is None:
+        lazy = decu.config['inspect'].getboolean('lazy')
 
     try:
         script_name = _get_script_name(files)
@@ -131,10 +298,13 @@ def inspect(files, command=None, **kwargs):
         script_fullname += '.py'
         if not os.path.exists(script_fullname):
             return 'File {} not found.'.format(script_fullname)
-        cmd, cmd_show = _make_py_script(script_name, files, command, kwargs)
 
     except decu.DecuException:
-        cmd, cmd_show = _make_py_script(None, files, command, kwargs)
+        script_name = None
+
+    if lazy:
+        return _inspect_lazily(script_name, files, command, kwargs)
+    cmd, cmd_show = _make_py_script(script_name, files, command, kwargs)
 
     print(cmd_show)
 
@@ -162,12 +332,35 @@ def setup_parser():
     parser_exec = subparsers.add_parser('exec', help='run a script with decu')
     parser_exec.add_argument('files', nargs='+', help='the script(s) '
                              'to be run')
+    parser_exec.add_argument('-j', dest='jobs', type=int, default=1,
+                             help='number of scripts to run at the same '
+                             'time, each in its own process')
+
+    parser_serve = subparsers.add_parser('serve', help='run a script with '
+                                         'decu, on a cluster of workers')
+    parser_serve.add_argument('files', nargs='+', help='the script(s) '
+                              'to be run')
+    parser_serve.add_argument('--bind', dest='address', help='host:port to '
+                              'listen on for workers')
+
+    parser_worker = subparsers.add_parser('worker', help='run experiments '
+                                          'for a decu serve coordinator')
+    parser_worker.add_argument('--connect', dest='address', help='host:port '
+                               'of the coordinator')
+    parser_worker.add_argument('-n', dest='processes', type=int, default=1,
+                               help='number of worker processes to start')
+
+    parser_reindex = subparsers.add_parser('reindex', help='rebuild the '
+                                           'catalog of results and figures')
 
     parser_inspect = subparsers.add_parser('inspect', help='inspect results')
     parser_inspect.add_argument('files', nargs='+', help='files to be'
                                 'loaded as result')
     parser_inspect.add_argument('-c', dest='inspect_command',
                                 help='Execute the given command string')
+    parser_inspect.add_argument('--lazy', action='store_true', default=None,
+                                help='read the files only when they are '
+                                'used, in this process')
     parser_inspect.add_argument('opts', nargs=argparse.REMAINDER,
                                 help='pairs of name and file paths to read '
                                 'as additional variables')
@@ -185,14 +378,23 @@ def main():
         sys.exit(0)
 
     elif args.command == 'exec':
-        sys.exit(exec_script(args.files))
+        sys.exit(exec_script(args.files, args.jobs))
+
+    elif args.command == 'serve':
+        sys.exit(serve(args.files, args.address))
+
+    elif args.command == 'worker':
+        sys.exit(worker(args.address, args.processes))
 
     elif args.command == 'init':
         sys.exit(init(os.getcwd()))
 
+    elif args.command == 'reindex':
+        sys.exit(reindex())
+
     elif args.command == 'inspect':
         sys.exit(inspect(args.files, command=args.inspect_command,
-                         **_parse_inspect_opts(args.opts)))
+                         lazy=args.lazy, **_parse_inspect_opts(args.opts)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+"""
+cache.py
+--------
+
+Content-addressed cache of experiment results.
+
+"""
+
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+__all__ = ['ResultCache', 'get_cache']
+
+
+# ResultCache objects of this process, keyed by their directory.
+caches = {}
+
+# Suffix of the file that holds the extension of each cached result.
+ENTRY = '.entry'
+
+
+def _place(src, dst):
+    """Make dst a copy of src, hard-linking it if possible."""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache():
+    """Directory of result files named after the key that produced them.
+
+    The result of each key is kept in a file named after the key, next to
+    an entry file that holds its extension, so that finding a key does not
+    depend on the size of the cache.
+
+    The cache keeps at most max_bytes bytes of results. When a new result
+    does not fit, the least recently used results are evicted first, down
+    to 90% of max_bytes. A result is used whenever it is stored or found in
+    the cache. The size and order of use of the results are kept in memory,
+    and read from the directory only when the cache is first used and when
+    it seems full, so that the results stored by other processes are taken
+    into account then.
+
+    Args:
+        cache_dir (str): The directory of the cache. It is created if
+            necessary.
+        max_bytes (int): Maximum size of the cache.
+
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sizes = None
+        self.total = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _find(self, key):
+        """Return the file of the cache with the given key and its
+        extension, or None."""
+        try:
+            with open(self._path(key) + ENTRY) as file:
+                return self._path(key), file.read()
+        except FileNotFoundError:
+            return None
+
+    def get(self, key, basename):
+        """Copy the result with the given key to basename plus extension.
+
+        Returns:
+            str: The name of the copied file, or None if the key is not in
+            the cache.
+
+        """
+        found = self._find(key)
+        if found is None:
+            return None
+        cached, ext = found
+        outfile = basename + ext
+        try:
+            os.utime(cached)
+            _place(cached, outfile)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime.
+            return None
+        self._used(key)
+        return outfile
+
+    def put(self, key, filename):
+        """Store a copy of the result file filename under key."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cached = self._path(key)
+        if os.path.exists(cached + ENTRY):
+            os.utime(cached)
+            self._used(key)
+            return
+        _, ext = os.path.splitext(filename)
+        try:
+            _place(filename, cached)
+        except FileExistsError:
+            # Being stored by another process.
+            return
+        os.utime(cached)
+        # The entry is written last, and at once, so that the result is
+        # complete when the key is found.
+        partial = '{}{}.{}-{}'.format(cached, ENTRY, os.getpid(),
+                                      threading.get_ident())
+        with open(partial, 'w') as file:
+            file.write(ext)
+        os.replace(partial, cached + ENTRY)
+        self._used(key, os.path.getsize(cached))
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def _used(self, key, size=None):
+        """Mark key as the most recently used result, of size bytes."""
+        with self.lock:
+            if self.sizes is None:
+                self._scan()
+            if key not in self.sizes and size is not None:
+                self.sizes[key] = size
+                self.total += size
+            if key in self.sizes:
+                self.sizes.move_to_end(key)
+
+    def _scan(self):
+        """Read the size and time of use of each result in the directory."""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith(ENTRY):
+                continue
+            key = name[:-len(ENTRY)]
+            try:
+                stat = os.stat(self._path(key))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, key, stat.st_size))
+        self.sizes = OrderedDict(
+            (key, size) for _, key, size in sorted(entries))
+        self.total = sum(self.sizes.values())
+
+    def evict(self):
+        """Remove least recently used results until the cache fits."""
+        with self.lock:
+            # Other processes may have stored or evicted results.
+            self._scan()
+            if self.total <= self.max_bytes:
+                return
+            while self.sizes and self.total > 0.9 * self.max_bytes:
+                key, size = self.sizes.popitem(last=False)
+                for path in [self._path(key) + ENTRY, self._path(key)]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self.total -= size
+
+
+def get_cache(cache_dir, max_bytes):
+    """Return the ResultCache of this process for cache_dir."""
+    if cache_dir not in caches:
+        caches[cache_dir] = ResultCache(cache_dir, max_bytes)
+    return caches[cache_dir]
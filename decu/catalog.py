@@ -0,0 +1,307 @@
+"""
+catalog.py
+----------
+
+Indexed catalog of the files written by a project.
+
+When the catalog option of section io in decu.cfg is set, every result
+written by an @experiment, and every figure written by a @figure, is
+recorded in a SQLite file in state_dir (see catalog_file in section Script
+of decu.cfg), along with the time and module of the script that wrote it,
+its run identifier, parameters, elapsed time, size and type. Files can
+then be found without globbing results_dir, e.g.,
+
+    catalog = get_catalog('.decu/catalog.sqlite')
+    catalog.find(name='experiment', exponent=2)
+
+returns every result of the method experiment called with exponent=2.
+`decu reindex` rebuilds the catalog from the files and logs of the
+project. See reindex.
+
+"""
+
+import os
+import ast
+import json
+import threading
+from .config import config, pattern
+from .io import split_address
+from .shared import PerProcess, plain, connect
+
+__all__ = ['Catalog', 'get_catalog', 'reindex']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    kind TEXT,
+    time TEXT,
+    module TEXT,
+    name TEXT,
+    run TEXT,
+    params TEXT,
+    elapsed REAL,
+    path TEXT UNIQUE,
+    size INTEGER,
+    type TEXT
+);
+CREATE INDEX IF NOT EXISTS files_name ON files (name, module);
+CREATE TABLE IF NOT EXISTS params (
+    file INTEGER,
+    name TEXT,
+    value
+);
+CREATE INDEX IF NOT EXISTS params_value ON params (name, value, file);
+CREATE INDEX IF NOT EXISTS params_file ON params (file);
+'''
+
+COLUMNS = ('kind', 'time', 'module', 'name', 'run', 'params', 'elapsed',
+           'path', 'size', 'type')
+
+
+def _value(value):
+    """Return value as stored in the params table."""
+    if hasattr(value, 'tolist'):
+        # numpy scalars and arrays.
+        value = value.tolist()
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return json.dumps(value, default=plain)
+
+
+class Catalog():
+    """SQLite file recording the files written by a project.
+
+    Several threads and processes can record files in the same catalog at
+    the same time. If the file of the catalog is deleted, a new one is
+    started the next time a file is recorded.
+
+    Args:
+        filename (str): The file of the catalog. It is created if necessary.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        """Return the connection to the file, opening it if necessary."""
+        if self.connection is not None and \
+           not os.path.exists(self.filename):
+            self.connection.close()
+            self.connection = None
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+            self.connection = connect(self.filename, SCHEMA)
+        return self.connection
+
+    def record(self, kind, time, module, name, run, params, elapsed, path,
+               size=None):
+        """Add the file path to the catalog, replacing any previous entry.
+
+        Args:
+            kind (str): 'result' or 'figure'.
+            time (datetime): Start time of the script that wrote the file.
+            module (str): Module of the script that wrote the file.
+            name (str): Name of the method that wrote the file.
+            run (int): Run identifier, or None.
+            params (dict): Parameters of the method.
+            elapsed (float): Seconds the method took, or None.
+            path (str): The file, or the address of a result in a store.
+            size (int): Size in bytes. If None, the size of path, if any.
+
+        The type of the entry is the extension of the file.
+
+        """
+        filename, _ = split_address(path)
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                # A result in a store.
+                pass
+        row = (kind, str(time), module, name,
+               None if run is None else str(run),
+               json.dumps(params, default=plain), elapsed, path, size,
+               os.path.splitext(filename)[1].strip('.'))
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    'DELETE FROM params WHERE file IN '
+                    '(SELECT id FROM files WHERE path = ?)', (path,))
+                cursor = connection.execute(
+                    'INSERT OR REPLACE INTO files ({}) VALUES ({})'.format(
+                        ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                    row)
+                connection.executemany(
+                    'INSERT INTO params VALUES (?, ?, ?)',
+                    [(cursor.lastrowid, key, _value(value))
+                     for key, value in (params or {}).items()])
+
+    def find(self, name=None, module=None, kind=None, **params):
+        """Return the entries that match every argument given.
+
+        Args:
+            name (str): Name of the method that wrote the files.
+            module (str): Module of the script that wrote the files.
+            kind (str): 'result' or 'figure'.
+            params (dict): Values of the parameters of the method.
+
+        Returns:
+            list: A dict per entry, keyed by column, in the order in which
+            they were recorded. The params of each entry are a dict.
+
+        """
+        clauses, args = [], []
+        for column, value in [('name', name), ('module', module),
+                              ('kind', kind)]:
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                args.append(value)
+        for key, value in params.items():
+            clauses.append('id IN (SELECT file FROM params '
+                           'WHERE name = ? AND value = ?)')
+            args.extend([key, _value(value)])
+        sql = 'SELECT {} FROM files'.format(', '.join(COLUMNS))
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        with self.lock:
+            rows = self._connect().execute(sql + ' ORDER BY id',
+                                           args).fetchall()
+        entries = [dict(zip(COLUMNS, row)) for row in rows]
+        for entry in entries:
+            entry['params'] = json.loads(entry['params'])
+        return entries
+
+    def clear(self):
+        """Remove every entry."""
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('DELETE FROM params')
+                connection.execute('DELETE FROM files')
+
+    def close(self):
+        """Close the connection to the file, if open."""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+# Catalog objects of this process, keyed by their file.
+catalogs = PerProcess(Catalog, Catalog.close)
+
+
+def get_catalog(filename):
+    """Return the Catalog of this process for filename."""
+    return catalogs.get(filename)
+
+
+def _params(string):
+    """Parse the params of a log record, or return them as a string."""
+    try:
+        return ast.literal_eval(string)
+    except (ValueError, SyntaxError):
+        return string
+
+
+def _listdir(directory):
+    """Return the sorted names of the files in directory, if it exists."""
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def _read_logs(logs_dir):
+    """Return the params and elapsed time of each run found in logs_dir.
+
+    Returns:
+        dict: Keyed by (time, module, exp_name, run), the dict with keys
+        params and elapsed of each run.
+
+    """
+    cfg = config['experiment']
+    log_file = pattern(config['logging']['log_file'])
+    start = pattern(cfg['start_msg'], '$')
+    end = pattern(cfg['end_msg'], '$')
+    runs = {}
+    for name in _listdir(logs_dir):
+        match = log_file.fullmatch(name)
+        if match is None:
+            continue
+        time, module = match.group('time'), match.group('module_name')
+        with open(os.path.join(logs_dir, name)) as file:
+            for line in file:
+                line = line.rstrip('\n')
+                for regex, field in [(start, 'params'), (end, 'elapsed')]:
+                    found = regex.search(line)
+                    if found is None:
+                        continue
+                    run = runs.setdefault(
+                        (time, module, found.group('exp_name'),
+                         found.group('run')),
+                        {'params': {}, 'elapsed': None})
+                    if field == 'params':
+                        run['params'] = _params(found.group('params'))
+                    else:
+                        run['elapsed'] = float(found.group('elapsed'))
+                    break
+    return runs
+
+
+def reindex(catalog, results_dir, figures_dir, logs_dir):
+    """Rebuild catalog from the files of a project.
+
+    Results and figures are found by matching their names against the
+    result_file, store_file and figure_*_file options of section Script.
+    The params and elapsed time of each result come from the start_msg and
+    end_msg records of the logs, or from the store that holds it.
+
+    Returns:
+        int: The number of entries in the rebuilt catalog.
+
+    """
+    from .store import get_store, address
+    cfg = config['Script']
+    runs = _read_logs(logs_dir)
+    result_file = pattern(cfg['result_file'])
+    store_file = pattern(cfg['store_file'])
+    figure_files = [pattern(cfg['figure_w_suffix_file']),
+                    pattern(cfg['figure_wo_suffix_file'])]
+    catalog.clear()
+    count = 0
+
+    for name in _listdir(results_dir):
+        path = os.path.join(results_dir, name)
+        match = store_file.fullmatch(name)
+        if match is not None:
+            store = get_store(path)
+            for run in store.runs():
+                params, elapsed = store.info(run)
+                catalog.record('result', match.group('time'),
+                               match.group('module_name'),
+                               match.group('exp_name'), run, params, elapsed,
+                               address(path, run))
+                count += 1
+            continue
+        basename, _ = os.path.splitext(name)
+        match = result_file.fullmatch(basename)
+        if match is None:
+            continue
+        key = tuple(match.group(group) for group in
+                    ['time', 'module_name', 'exp_name', 'run'])
+        info = runs.get(key, {'params': {}, 'elapsed': None})
+        catalog.record('result', *key, info['params'], info['elapsed'], path)
+        count += 1
+
+    for name in _listdir(figures_dir):
+        for regex in figure_files:
+            match = regex.fullmatch(name)
+            if match is not None:
+                catalog.record('figure', match.group('time'),
+                               match.group('module_name'),
+                               match.group('fig_name'), None, {}, None,
+                               os.path.join(figures_dir, name))
+                count += 1
+                break
+    return count
@@ -0,0 +1,351 @@
+"""
+cluster.py
+----------
+
+Run experiments on several machines with a coordinator and workers.
+
+A Coordinator has the interface of multiprocessing.Pool, so that it can be
+used as the 'cluster' backend of run_parallel (see decu.parallel). Instead
+of running the tasks itself, it hands them to worker processes that connect
+to it over TCP, started with `decu worker --connect host:port`. Idle
+workers pull the next pending task, so that faster workers end up running
+more tasks. Busy workers send a heartbeat every few seconds. When a worker
+disconnects, or its heartbeat stops, its task goes back to the queue to be
+picked up by another worker.
+
+The coordinator and its workers share a secret key, and refuse to talk
+to anyone who does not know it. Since tasks and results are pickles, which
+can run arbitrary code when loaded, there is no default key: set one in
+the DECU_AUTHKEY environment variable, or in the authkey option of section
+cluster in decu.cfg. `decu serve` generates a random key when none is set,
+and prints it.
+
+Tasks are pickled, so workers must be able to import the script that
+defines the experiments. Workers add the coordinator's sys.path to their
+own and move to the coordinator's working directory (if it exists on their
+machine), so it is enough that the project lives on a file system shared
+by all machines.
+
+"""
+
+import os
+import sys
+import pickle
+import threading
+from time import sleep, time
+from functools import partial
+from collections import deque
+from multiprocessing import TimeoutError
+from concurrent import futures
+from multiprocessing.connection import Listener, Client
+from .config import config
+
+__all__ = ['Coordinator', 'work']
+
+
+def parse_address(address):
+    """Return the pair (host, port) from a 'host:port' string."""
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def configured_authkey():
+    """Return the key in DECU_AUTHKEY, or else the one in the config."""
+    return os.environ.get('DECU_AUTHKEY') or config['cluster']['authkey']
+
+
+def _authkey(authkey=None):
+    """Return authkey as bytes, or the configured one. Raise DecuException
+    if it is empty."""
+    authkey = configured_authkey() if authkey is None else authkey
+    if not authkey:
+        from .core import DecuException
+        raise DecuException('the cluster needs a secret key: set the '
+                            'DECU_AUTHKEY environment variable, or the '
+                            'authkey option of section cluster')
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+class WorkerLost(Exception):
+    """Raised when a worker disconnects or misses its heartbeats."""
+    pass
+
+
+class ClusterAsyncResult():
+    """The interface of multiprocessing.pool.AsyncResult, over a Future."""
+
+    def __init__(self, future):
+        self.future = future
+
+    def ready(self):
+        return self.future.done()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError('result is not ready')
+        return self.future.exception() is None
+
+    def wait(self, timeout=None):
+        futures.wait([self.future], timeout)
+
+    def get(self, timeout=None):
+        try:
+            return self.future.result(timeout)
+        except futures.TimeoutError:
+            raise TimeoutError
+
+
+class Coordinator():
+    """Pool look-alike that hands its tasks to remote workers.
+
+    Args:
+        address (str): 'host:port' to listen on. Port 0 picks a free port,
+            which can be read from the address attribute afterwards.
+        authkey (str): Shared secret of the coordinator and its workers. If
+            None, use the configured one. See the docstring of this module.
+
+    Attributes:
+        workers (int): Number of workers connected at the moment.
+
+    """
+    def __init__(self, address, authkey=None):
+        cfg = config['cluster']
+        self.heartbeat = float(cfg['heartbeat'])
+        self.heartbeat_timeout = float(cfg['heartbeat_timeout'])
+        self.listener = Listener(parse_address(address),
+                                 authkey=_authkey(authkey))
+        self.address = '{}:{}'.format(*self.listener.address)
+
+        self.cond = threading.Condition()
+        self.pending = deque()
+        self.tasks = {}
+        self.next_id = 0
+        self.closed = False
+        self.stopped = False
+        self.handlers = []
+        self.workers = 0
+
+        accept = threading.Thread(target=self._accept, daemon=True)
+        accept.start()
+
+    def _accept(self):
+        """Serve every worker that connects, each in its own thread."""
+        while not self.stopped:
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                continue
+            handler = threading.Thread(target=self._serve, args=(conn,),
+                                       daemon=True)
+            handler.start()
+            self.handlers.append(handler)
+
+    def _serve(self, conn):
+        """Send tasks to one worker until there are no more tasks."""
+        task_id = None
+        with self.cond:
+            self.workers += 1
+        try:
+            conn.send(('init', sys.path, os.getcwd(), self.heartbeat))
+            while True:
+                task_id = self._next_task()
+                if task_id is None:
+                    conn.send(('stop',))
+                    return
+                func, args, _ = self.tasks[task_id]
+                # sys.path grows with each script run by decu serve.
+                conn.send(('task', task_id, sys.path,
+                           pickle.dumps((func, args))))
+                self._wait_done(conn)
+                task_id = None
+        except (OSError, EOFError, WorkerLost):
+            if task_id is not None:
+                self._requeue(task_id)
+        finally:
+            with self.cond:
+                self.workers -= 1
+            conn.close()
+
+    def _next_task(self):
+        """Return the next pending task, or None if all tasks are done."""
+        with self.cond:
+            while not self.pending:
+                if self.closed and not self.tasks:
+                    return None
+                self.cond.wait()
+            return self.pending.popleft()
+
+    def _wait_done(self, conn):
+        """Wait for the result of the task being run by conn's worker."""
+        while True:
+            if not conn.poll(self.heartbeat_timeout):
+                raise WorkerLost
+            msg = conn.recv()
+            if msg[0] == 'done':
+                self._finish(*msg[1:])
+                return
+
+    def _finish(self, task_id, ok, value):
+        """Record the outcome of a task."""
+        with self.cond:
+            entry = self.tasks.pop(task_id, None)
+            self.cond.notify_all()
+        if entry is not None:
+            future = entry[2]
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _requeue(self, task_id):
+        """Put a task back at the front of the queue."""
+        with self.cond:
+            if task_id in self.tasks:
+                self.pending.appendleft(task_id)
+                self.cond.notify_all()
+
+    def apply_async(self, func, args=(), kwds={}, callback=None,
+                    error_callback=None):
+        if kwds:
+            func = partial(func, **kwds)
+        future = futures.Future()
+        if callback is not None or error_callback is not None:
+            def done(fut):
+                if fut.exception() is None:
+                    if callback is not None:
+                        callback(fut.result())
+                elif error_callback is not None:
+                    error_callback(fut.exception())
+            future.add_done_callback(done)
+        with self.cond:
+            if self.closed:
+                raise ValueError('Pool not running')
+            self.tasks[self.next_id] = (func, args, future)
+            self.pending.append(self.next_id)
+            self.next_id += 1
+            self.cond.notify_all()
+        return ClusterAsyncResult(future)
+
+    def map(self, func, iterable, chunksize=None):
+        return [res.get() for res in
+                [self.apply_async(func, (arg,)) for arg in iterable]]
+
+    def starmap(self, func, iterable, chunksize=None):
+        return [res.get() for res in
+                [self.apply_async(func, args) for args in iterable]]
+
+    def imap(self, func, iterable, chunksize=1):
+        results = [self.apply_async(func, (arg,)) for arg in iterable]
+        for res in results:
+            yield res.get()
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        results = [self.apply_async(func, (arg,)).future for arg in iterable]
+        for future in futures.as_completed(results):
+            yield future.result()
+
+    def close(self):
+        """Accept no more tasks. Workers stop when every task is done."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def join(self):
+        """Wait for every task to finish and the workers to be stopped."""
+        with self.cond:
+            while self.tasks:
+                self.cond.wait()
+        for handler in self.handlers:
+            handler.join(self.heartbeat_timeout)
+        self.stopped = True
+        self.listener.close()
+
+    def terminate(self):
+        """Stop now, failing every unfinished task."""
+        with self.cond:
+            self.closed = True
+            unfinished = list(self.tasks.values())
+            self.tasks.clear()
+            self.pending.clear()
+            self.cond.notify_all()
+        for _, _, future in unfinished:
+            future.set_exception(WorkerLost('coordinator terminated'))
+        self.stopped = True
+        self.listener.close()
+
+
+def _connect(address, authkey, retry):
+    """Connect to the coordinator, retrying for up to retry seconds."""
+    deadline = time() + retry
+    while True:
+        try:
+            return Client(parse_address(address), authkey=authkey)
+        except ConnectionRefusedError:
+            if time() > deadline:
+                raise
+            sleep(0.5)
+
+
+def _send_done(conn, task_id, ok, value):
+    """Send the outcome of a task, even if it cannot be pickled."""
+    try:
+        conn.send(('done', task_id, ok, value))
+    except (pickle.PicklingError, TypeError, AttributeError) as exc:
+        conn.send(('done', task_id, False,
+                   RuntimeError('could not send result: {!r}'.format(exc))))
+
+
+def work(address, authkey=None, retry=30):
+    """Run tasks from the coordinator at address until told to stop.
+
+    Args:
+        address (str): 'host:port' of the coordinator.
+        authkey (str): Shared secret of the coordinator and its workers. If
+            None, use the configured one. See the docstring of this module.
+        retry (float): Seconds to keep trying to connect to the coordinator.
+
+    Returns:
+        int: 0, to be used as exit code.
+
+    """
+    conn = _connect(address, _authkey(authkey), retry)
+    _, path, cwd, heartbeat = conn.recv()
+    sys.path.extend(p for p in path if p not in sys.path)
+    if os.path.isdir(cwd):
+        os.chdir(cwd)
+
+    send_lock = threading.Lock()
+    busy = threading.Event()
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(heartbeat):
+            if busy.is_set():
+                with send_lock:
+                    try:
+                        conn.send(('heartbeat',))
+                    except OSError:
+                        return
+
+    threading.Thread(target=beat, daemon=True).start()
+    try:
+        while True:
+            msg = conn.recv()
+            if msg[0] == 'stop':
+                return 0
+            _, task_id, path, task = msg
+            sys.path.extend(p for p in path if p not in sys.path)
+            busy.set()
+            try:
+                func, args = pickle.loads(task)
+                value, ok = func(*args), True
+            except Exception as exc:
+                value, ok = exc, False
+            busy.clear()
+            with send_lock:
+                _send_done(conn, task_id, ok, value)
+    except (EOFError, OSError):
+        return 0
+    finally:
+        stop.set()
+        conn.close()
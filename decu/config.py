@@ -6,14 +6,41 @@ Custom configuration parsing for decu, based on configparser.
 
 """
 import os
+import re
 import configparser
 from string import Template
+from functools import lru_cache
 
 __all__ = ['config', 'DecuParser']
 
 config_filename = 'decu.cfg'
 
 
+@lru_cache(maxsize=256)
+def _template(string):
+    """Return the Template of string, compiled once per distinct string."""
+    return Template(string)
+
+
+def pattern(template, end=''):
+    """Return a regex matching the strings made from an option template.
+
+    Each named substitution of the template becomes a group of the same
+    name. The regex end is appended as is.
+
+    """
+    parts = re.split(r'\$\{(\w+)\}|\$(\w+)', template)
+    regex, seen = '', set()
+    for index in range(0, len(parts), 3):
+        regex += re.escape(parts[index])
+        if index + 1 < len(parts):
+            name = parts[index + 1] or parts[index + 2]
+            regex += '(?P={})'.format(name) if name in seen else \
+                '(?P<{}>.*?)'.format(name)
+            seen.add(name)
+    return re.compile(regex + end)
+
+
 class DecuParser(configparser.ConfigParser):
     """ConfigParser subclass for decu.
 
@@ -42,7 +69,7 @@ class DecuParser(configparser.ConfigParser):
             str: the option template with the named strings substituted in.
 
         """
-        return Template(self.get(section, option)).safe_substitute(**kwargs)
+        return _template(self.get(section, option)).safe_substitute(**kwargs)
 
 
 class DecuSectionProxy(configparser.SectionProxy):
@@ -58,7 +85,7 @@ class DecuSectionProxy(configparser.SectionProxy):
             DecuParser.subs.
 
         """
-        return Template(self.get(option)).safe_substitute(**kwargs)
+        return _template(self.get(option)).safe_substitute(**kwargs)
 
 
 configparser.SectionProxy = DecuSectionProxy
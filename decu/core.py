@@ -7,30 +7,46 @@ Main decu classes and decorators.
 """
 
 import os
-import logging
+import sys
+from logging import INFO, WARNING
+import threading
 from .config import config
-from .logging import DecuLogger
-from .io import write
-from functools import wraps
+from .logging import DecuLogger, flush as flush_logs
+from .io import write, read, make_fullname, open_memmap
+from .writer import get_writer
+from .store import get_store
+from .catalog import get_catalog
+from .cache import get_cache
+from .hashing import digest
+from .runs import next_run, next_runs
+from .journal import Journal, TimingHistory
+from . import parallel
+from functools import wraps, partial
+from collections import deque
+from contextlib import contextmanager
+from inspect import iscoroutinefunction
 from datetime import datetime
-from collections import defaultdict
-from multiprocessing import Pool, Value, Lock
-if 'DISPLAY' not in os.environ:
-    import matplotlib
-    matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
-__all__ = ['Script', 'experiment', 'figure', 'run_parallel', 'DecuException']
+__all__ = ['Script', 'experiment', 'figure', 'run_parallel',
+           'run_parallel_iter', 'gather_experiments', 'DecuException']
 
 
-lock = Lock()
-runs = defaultdict(lambda: Value('i', 0))
+# Without a display, matplotlib must draw figures with Agg, also in scripts
+# that import pyplot before decu. The environment variable is set instead of
+# calling matplotlib.use, so as not to import matplotlib here.
+if 'DISPLAY' not in os.environ:
+    os.environ.setdefault('MPLBACKEND', 'Agg')
 
 
 class DecuException(Exception):
     pass
 
 
+# The run identifier, result file and elapsed time of the last experiment
+# run by each thread, for run_parallel to keep track of.
+last_run = threading.local()
+
+
 class Script():
     """Base class for experimental computation scripts."""
 
@@ -39,6 +55,8 @@ class Script():
     figures_dir = config['Script']['figures_dir']
     scripts_dir = config['Script']['scripts_dir']
     gendata_dir = config['Script']['gendata_dir']
+    state_dir = config['Script']['state_dir']
+    cache_dir = config['cache']['cache_dir']
     figure_fmt = config['Script']['figure_fmt']
 
     def __init__(self, project_dir="", module=None):
@@ -46,12 +64,87 @@ class Script():
         self.project_dir = os.getcwd() if project_dir is None else project_dir
         self.module = self.__module__ if module is None else module
         self.log = DecuLogger(self.start_time, project_dir, self.module)
+        self.made_dirs = set()
+        self.run_counters = {}
+        self.store_names = {}
+
+    def make_dirs(self, directory):
+        """Create directory, unless this Script already did."""
+        if directory not in self.made_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.made_dirs.add(directory)
 
     def make_result_basename(self, exp_name, run):
         return os.path.join(self.results_dir, config['Script'].subs(
             'result_file', time=self.start_time, module_name=self.module,
             exp_name=exp_name, run=run))
 
+    def open_memmap(self, shape, dtype=float):
+        """Return an array to fill and return as the result of an experiment.
+
+        The array is a memory map of a file in results_dir, so it can be
+        larger than memory. See decu.io.open_memmap.
+
+        """
+        return open_memmap(shape, dtype, self.results_dir)
+
+    def record(self, kind, name, run, params, elapsed, path):
+        """Add a file written by this Script to the catalog of the project.
+
+        Does nothing unless the catalog option of section io is set. See
+        decu.catalog.Catalog.record.
+
+        """
+        if config['io'].getboolean('catalog'):
+            get_catalog(os.path.join(
+                self.state_dir, config['Script']['catalog_file'])).record(
+                    kind, self.start_time, self.module, name, run, params,
+                    elapsed, path)
+
+    def result_store(self, exp_name):
+        """Return the store of the results of exp_name. See decu.store."""
+        if exp_name not in self.store_names:
+            self.store_names[exp_name] = os.path.join(
+                self.results_dir, config['Script'].subs(
+                    'store_file', time=self.start_time,
+                    module_name=self.module, exp_name=exp_name))
+        return get_store(self.store_names[exp_name])
+
+    def _run_counter(self, exp_name):
+        """Return the counter file and block size of exp_name."""
+        if exp_name not in self.run_counters:
+            self.run_counters[exp_name] = (
+                os.path.join(self.state_dir, config['Script'].subs(
+                    'run_file', module_name=self.module, exp_name=exp_name)),
+                int(config['experiment']['run_block']))
+        return self.run_counters[exp_name]
+
+    def next_run(self, exp_name):
+        """Return a new run identifier for the experiment exp_name.
+
+        Identifiers are unique among all scripts that share the state_dir,
+        even when they run concurrently. See decu.runs.RunAllocator.
+
+        """
+        return next_run(*self._run_counter(exp_name))
+
+    def next_runs(self, exp_name, count):
+        """Return a range of count consecutive new run identifiers for the
+        experiment exp_name. See next_run."""
+        return next_runs(*self._run_counter(exp_name), count)
+
+    def result_cache(self):
+        """Return the cache of results used by experiments with cache=True."""
+        return get_cache(self.cache_dir, int(config['cache']['max_bytes']))
+
+    def make_journal_name(self, exp_name):
+        return os.path.join(self.state_dir, config['Script'].subs(
+            'journal_file', module_name=self.module, exp_name=exp_name))
+
+    def make_timings_name(self, exp_name):
+        return os.path.join(self.state_dir, config['Script'].subs(
+            'timings_file', module_name=self.module, exp_name=exp_name))
+
     def make_figure_basename(self, fig_name, suffix=None):
         opt = 'figure_wo_suffix_file' if suffix is None \
               else 'figure_w_suffix_file'
@@ -61,49 +154,674 @@ class Script():
         return os.path.join(self.figures_dir, outfile)
 
 
-def run_parallel(exp, params):
+class _SharedArray():
+    """Stand-in for an array published to the workers through a file.
+
+    Instances are what actually travels to the workers in place of the
+    published array. They are resolved in the worker to a read-only view of
+    the file, which is opened once per worker process.
+
+    """
+    def __init__(self, filename, array=None):
+        self.filename = filename
+        self.array = array
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'array': None}
+
+
+# Arrays opened by this process, keyed by the file they were published to.
+shared_arrays = {}
+
+
+def _resolve(arg):
+    """Return the array published under arg, or arg itself."""
+    if not isinstance(arg, _SharedArray):
+        return arg
+    if arg.filename not in shared_arrays:
+        import numpy as np
+        shared_arrays.clear()
+        shared_arrays[arg.filename] = np.load(arg.filename, mmap_mode='r')
+    return shared_arrays[arg.filename]
+
+
+def _call(exp, params):
+    """Call exp(*params), resolving any published array first."""
+    return exp(*[_resolve(p) for p in params])
+
+
+def _call_with_params(exp, params):
+    """Call exp(*params) and return the pair (params, result)."""
+    return params, _call(exp, params)
+
+
+def _call_indexed(exp, indexed):
+    """Call exp(*params), where indexed is the pair (index, params).
+
+    Return the index, the result, and the run identifier, result file and
+    elapsed time of the call.
+
+    """
+    index, params = indexed
+    last_run.info = (None, None, None)
+    result = _call(exp, params)
+    return index, result, last_run.info
+
+
+def _call_batch(exp, param_sets):
+    """Call the batch experiment exp once, over param_sets stacked.
+
+    Every parameter set must hold the same data. Return the list of the
+    results of each parameter set.
+
+    """
+    import numpy as np
+    param_sets = [[_resolve(p) for p in param_set]
+                  for param_set in param_sets]
+    data_index = _data_index(exp)
+    args = []
+    for position, column in enumerate(zip(*param_sets)):
+        if position == data_index:
+            if any(value is not column[0] for value in column):
+                raise DecuException('every parameter set of a batch must '
+                                    'hold the same data')
+            args.append(column[0])
+        else:
+            args.append(np.asarray(column))
+    result = exp(*args)
+    return [None] * len(param_sets) if result is None else list(result)
+
+
+def _reorder(indexed):
+    """Yield the items of the pairs (index, item) in order of index."""
+    buffer, expected = {}, 0
+    for index, item in indexed:
+        buffer[index] = item
+        while expected in buffer:
+            yield buffer.pop(expected)
+            expected += 1
+
+
+def _data_index(exp):
+    """Return the position of the data_param of exp in its parameter sets."""
+    from inspect import getfullargspec
+    func = getattr(exp, '__func__', exp)
+    data_param = getattr(func, 'data_param', None)
+    if data_param is None:
+        return None
+    args = getfullargspec(getattr(func, '__wrapped__', func)).args
+    if data_param not in args:
+        return None
+    return args.index(data_param) - (1 if hasattr(exp, '__self__') else 0)
+
+
+def _is_shareable(obj):
+    """Whether obj is an array worth publishing to the workers."""
+    np = sys.modules.get('numpy')
+    min_bytes = int(config['parallel']['share_min_bytes'])
+    return np is not None and isinstance(obj, np.ndarray) and \
+        not obj.dtype.hasobject and obj.nbytes >= min_bytes
+
+
+def _find_shared(exp, params, shared):
+    """Return the object to publish to the workers, and the params.
+
+    If shared is None, look for it at the data_param position of the first
+    parameter set. Since params may be an iterator, the returned params
+    must be used in place of the original ones.
+
+    """
+    from itertools import chain
+    if shared is not None:
+        return (None if shared is False else shared), params
+    index = _data_index(exp)
+    if index is None:
+        return None, params
+    params = iter(params)
+    try:
+        first = next(params)
+    except StopIteration:
+        return None, ()
+    params = chain([first], params)
+    if len(first) > index and _is_shareable(first[index]):
+        return first[index], params
+    return None, params
+
+
+@contextmanager
+def _published(shared):
+    """Publish shared to a memory-mapped file for the workers to read."""
+    import numpy as np
+    from tempfile import mkstemp
+    handle, filename = mkstemp(suffix='.npy',
+                               dir=config['parallel']['share_dir'] or None)
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            np.save(file, shared)
+        yield _SharedArray(filename, shared)
+    finally:
+        os.remove(filename)
+
+
+def _swap(params, old, new):
+    """Replace every occurrence of old in each parameter set with new."""
+    for param_set in params:
+        yield tuple(new if p is old else p for p in param_set)
+
+
+def _unswap(param_set, placeholder):
+    """Undo _swap on a parameter set sent back by a worker."""
+    for p in param_set:
+        if isinstance(p, _SharedArray) and \
+           p.filename == placeholder.filename:
+            yield placeholder.array
+        else:
+            yield p
+
+
+def _get_pool(backend):
+    """Return the pool of backend, or raise DecuException if unknown."""
+    name = parallel.backend_name(backend)
+    if name not in parallel.backends:
+        raise DecuException('unknown backend \'{}\''.format(name))
+    return parallel.get_pool(name)
+
+
+@contextmanager
+def _sharing(exp, params, shared, backend):
+    """Yield params with the shared data replaced by its published file."""
+    if parallel.backend_name(backend) not in parallel.copying_backends:
+        shared = False
+    shared, params = _find_shared(exp, params, shared)
+    if shared is None:
+        yield params, None
+        return
+    with _published(shared) as placeholder:
+        yield _swap(params, shared, placeholder), placeholder
+
+
+def _check_bookkeeping(exp, feature):
+    """Raise DecuException if exp does not keep track of its runs."""
+    func = getattr(exp, '__func__', exp)
+    if not hasattr(func, 'data_param') or not hasattr(exp, '__self__'):
+        raise DecuException('only methods decorated with @experiment can be '
+                            'run with {}'.format(feature))
+
+
+def _get_journal(exp, journal):
+    """Return the Journal to use for exp."""
+    _check_bookkeeping(exp, 'a journal')
+    if journal is True:
+        journal = exp.__self__.make_journal_name(exp.__func__.__name__)
+    return Journal(journal)
+
+
+def _get_history(exp):
+    """Return the TimingHistory of exp."""
+    _check_bookkeeping(exp, 'schedule=\'longest\'')
+    return TimingHistory(
+        exp.__self__.make_timings_name(exp.__func__.__name__))
+
+
+def _schedule_name(schedule):
+    """Return schedule, or the default schedule from the config."""
+    schedule = schedule or config['parallel']['schedule']
+    if schedule not in ('fifo', 'longest'):
+        raise DecuException('unknown schedule \'{}\''.format(schedule))
+    return schedule
+
+
+def _supervision(timeout, deadline, speculate):
+    """Return the options of parallel.supervise, or None if not needed."""
+    cfg = config['parallel']
+    timeout = cfg['timeout'] if timeout is None else timeout
+    deadline = cfg['deadline'] if deadline is None else deadline
+    if speculate is None:
+        speculate = cfg.getboolean('speculate')
+    if not (timeout or deadline or speculate):
+        return None
+    factor = cfg['straggler_factor']
+    return {'timeout': float(timeout) if timeout else None,
+            'deadline': float(deadline) if deadline else None,
+            'factor': float(factor) if factor else None,
+            'speculate': speculate}
+
+
+def _describe(exp, param_set):
+    """Return the experimental parameters of exp in param_set, by name."""
+    func = getattr(exp, '__func__', exp)
+    names = _parameter_names(getattr(func, '__wrapped__', func),
+                             1 if hasattr(exp, '__self__') else 0)
+    return _get_parameters(names, getattr(func, 'data_param', None),
+                           param_set, {})
+
+
+def _notifier(exp, factor):
+    """Return the function that logs the events of parallel.supervise."""
+    log = getattr(getattr(exp, '__self__', None), 'log', None)
+    if log is None:
+        return None
+    exp_name = getattr(exp, '__func__', exp).__name__
+    cfg = config['experiment']
+
+    def notify(event, index, indexed, elapsed):
+        if event == 'deadline':
+            log.warning(cfg.subs('deadline_msg', exp_name=exp_name,
+                                 deadline=elapsed, todo=index))
+            return
+        msg = cfg.subs(event + '_msg', exp_name=exp_name,
+                       params=_describe(exp, indexed[1]),
+                       elapsed=round(elapsed, 5), factor=factor)
+        if event == 'duplicate':
+            log.info(msg)
+        else:
+            log.warning(msg)
+
+    return notify
+
+
+def _slots(count, backend):
+    """Return count(backend), the number of slots for parallel.supervise.
+
+    The workers of the cluster backend come and go, so for it, return a
+    function that counts them each time instead.
+
+    """
+    if parallel.backend_name(backend) == 'cluster':
+        return partial(count, backend)
+    return count(backend)
+
+
+def _supervised(exp, pool, tasks, backend, supervision, slots):
+    """Run exp over the pairs (index, params) in tasks, under supervision.
+
+    Yield the index, the result, and the run identifier, result file and
+    elapsed time of each call, like _call_indexed. Calls given up on yield
+    None as their result, and None instead of the last three. At most
+    slots tasks are taken from tasks ahead of their results. Only calls
+    that may be duplicated or given up on claim their outcome, in the
+    state_dir of their Script.
+
+    """
+    claims = None
+    if supervision:
+        from tempfile import gettempdir
+        claims = getattr(getattr(exp, '__self__', None), 'state_dir',
+                         None) or gettempdir()
+    for index, value in parallel.supervise(
+            pool, partial(_call_indexed, exp),
+            ((task[0], task) for task in tasks), slots,
+            notify=_notifier(exp, supervision.get('factor')),
+            restart=partial(parallel.restart, backend),
+            claims=claims, **supervision):
+        if isinstance(value, parallel.TimedOut):
+            yield index, None, None
+        else:
+            yield value
+
+
+def _log_sweep(exp, params):
+    """Log the size of params, if it is a decu.sweep.Sweep."""
+    from .sweep import Sweep
+    log = getattr(getattr(exp, '__self__', None), 'log', None)
+    if log is not None and isinstance(params, Sweep):
+        log.info(config['experiment'].subs(
+            'sweep_msg', exp_name=getattr(exp, '__func__', exp).__name__,
+            total=len(params), names=', '.join(params.names)))
+
+
+def _is_batch(exp):
+    """Whether exp was decorated with @experiment(batch=True)."""
+    return getattr(getattr(exp, '__func__', exp), 'batch', False)
+
+
+def _batches(params, size):
+    """Yield lists of size consecutive elements of params."""
+    from itertools import islice
+    params = iter(params)
+    while True:
+        chunk = list(islice(params, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_batches(exp, params, shared, backend, options):
+    """Run the batch experiment exp over params, a batch at a time.
+
+    Yield the pairs (p, result) for each element p of params, in order.
+    options holds the other arguments of run_parallel, none of which can
+    be used with batch experiments.
+
+    """
+    if any(options):
+        raise DecuException('batch experiments cannot be run with a '
+                            'journal, a schedule, or a timeout')
+    size = int(config['parallel']['batch_size'])
+    if isinstance(params, (list, tuple)):
+        # Give every worker something to do.
+        slots = parallel.num_slots(backend)
+        size = max(1, min(size, -(-len(params) // slots)))
+    pool = _get_pool(backend)
+    originals = deque()
+
+    def param_sets():
+        for param_set in params:
+            originals.append(param_set)
+            yield param_set
+
+    with _sharing(exp, param_sets(), shared, backend) as (tasks, _):
+        for results in pool.imap(partial(_call_batch, exp),
+                                 _batches(tasks, size)):
+            for result in results:
+                yield originals.popleft(), result
+
+
+def _run_indexed(exp, params, shared, backend, journal=None,
+                 schedule='fifo', supervision=None):
+    """Run exp over params, keeping track of each run.
+
+    Yield the pairs (index, (p, result)) for each element p of params, as
+    they become available. Parameter sets found in the journal, if any,
+    are not run: their results are read from disk and come first. With
+    schedule='longest', the parameter sets that took the longest the last
+    time they were run are run first, and sets never run before come
+    before all others. With supervision (see _supervision), runs that are
+    given up on yield None as their result, and are not recorded.
+
+    Without a journal or a schedule, params is consumed lazily, and only a
+    bounded number of parameter sets are taken ahead of their results.
+    See the max_pending option in section parallel of decu.cfg.
+
+    """
+    exp_name = getattr(exp, '__func__', exp).__name__
+    journal = _get_journal(exp, journal) if journal else None
+    history = _get_history(exp) if schedule == 'longest' else None
+    if journal is None and history is None:
+        todo = enumerate(params)
+    else:
+        memo, todo, keys, total = {}, [], {}, 0
+        for index, param_set in enumerate(params):
+            total += 1
+            key = Journal.key(exp_name, param_set, memo)
+            entry = journal.get(key) if journal is not None else None
+            if entry is None:
+                todo.append((index, param_set))
+                keys[index] = key
+            else:
+                yield index, (param_set, journal.load(entry))
+
+        if journal is not None and len(todo) < total:
+            exp.__self__.log.info(config['experiment'].subs(
+                'resume_msg', exp_name=exp_name, total=total,
+                todo=len(todo), journal=journal.filename))
+
+        if history is not None:
+            def expected(item):
+                elapsed = history.predict(keys[item[0]])
+                return float('inf') if elapsed is None else elapsed
+            todo.sort(key=expected, reverse=True)
+
+    pool = _get_pool(backend)
+    originals, indices = {}, deque()
+
+    def param_sets():
+        for index, param_set in todo:
+            originals[index] = param_set
+            indices.append(index)
+            yield param_set
+
+    with _sharing(exp, param_sets(), shared, backend) as (tasks, _):
+        tasks = ((indices.popleft(), task) for task in tasks)
+        if supervision is not None:
+            results = _supervised(exp, pool, tasks, backend, supervision,
+                                  _slots(parallel.num_slots, backend))
+        elif isinstance(todo, list):
+            results = pool.imap_unordered(partial(_call_indexed, exp), tasks)
+        else:
+            results = _supervised(exp, pool, tasks, backend, {},
+                                  _slots(parallel.max_pending, backend))
+        for index, result, info in results:
+            if info is not None:
+                run, outfile, elapsed = info
+                if journal is not None:
+                    journal.record(keys[index], run, outfile)
+                if history is not None and elapsed is not None:
+                    history.record(keys[index], elapsed)
+            yield index, (originals.pop(index), result)
+
+
+def run_parallel(exp, params, shared=None, backend=None, journal=None,
+                 schedule=None, timeout=None, deadline=None, speculate=None):
     """Run an experiment in parallel.
 
     For each element `p` in `params`, call `exp(*p)`. These calls are made
-    in parallel using multiprocessing.
+    in parallel by the chosen backend: a pool of worker processes
+    ('process'), a pool of threads ('thread'), or one after the other in
+    the calling thread ('serial'). Threads avoid copying the arguments and
+    results, and are the better choice for experiments that spend most of
+    their time in code that releases the GIL, such as numpy. The serial
+    backend is meant for debugging.
+
+    When every parameter set holds the same large array as data, the
+    process backend writes it once to a memory-mapped file and each worker
+    reads it from there, instead of receiving its own copy with every
+    call. By default, the argument in the `data_param` position of an
+    @experiment-decorated method is published in this way whenever it is a
+    numpy array of at least `share_min_bytes` bytes (see section parallel
+    in decu.cfg).
+
+    Experiments decorated with @experiment(batch=True) are called once per
+    batch of batch_size parameter sets, stacked (see section parallel in
+    decu.cfg), and the batches are run in parallel instead.
+
+    Parameter sets that are not given as a list or a tuple, such as the
+    sweeps of decu.sweep or generators, are built as they are needed: only
+    max_pending of them are taken ahead of their results (see section
+    parallel in decu.cfg), so that large sweeps need not fit in memory.
 
     Args:
         exp (method): A @experiment-decorated method.
-        params (list): Each element is a set of arguments to call `exp` with.
+        params (iterable): Each element is a set of arguments to call `exp`
+            with.
+        shared (object): The argument to publish to the workers. It is
+            found by identity in every element of params. If False, do not
+            publish any argument. If None, find it from the data_param of
+            `exp`.
+        backend (str): 'process', 'thread' or 'serial'. If None, use the
+            backend option in section parallel of the config.
+        journal (str): File where each finished run is recorded, along
+            with its parameters and result file. When run_parallel is
+            called again with the same journal, the parameter sets already
+            in it are not run again: their results are read from disk. If
+            True, use the journal_file of `exp` (see section Script in
+            decu.cfg).
+        schedule (str): 'fifo' to run the parameter sets in the given
+            order, or 'longest' to run first those that took the longest
+            last time, according to the timings_file of `exp` (see section
+            Script in decu.cfg). Results are returned in the given order
+            either way. If None, use the schedule option in section
+            parallel of the config.
+        timeout (float): Seconds after which a run is given up on. Its
+            result is None, and it is not recorded in the journal. If
+            None, use the timeout option in section parallel of the
+            config.
+        deadline (float): Seconds after which every unfinished run is given
+            up on, including those not started yet. If None, use the
+            deadline option in section parallel of the config.
+        speculate (bool): Whether to start a duplicate of each straggler on
+            an idle worker, keeping whichever copy finishes first. A
+            straggler is a run that has taken straggler_factor times longer
+            than the median run so far (see section parallel in decu.cfg).
+            If None, use the speculate option in section parallel of the
+            config.
+
+    Only the process backend can stop runs that were given up on, which it
+    does by restarting its workers. Other backends let them finish in the
+    background. Stragglers are logged whenever timeout, deadline or
+    speculate are set.
 
     Returns:
         list: The result of calling `exp(*pi)` over each element of params.
 
     """
-    def init(*args):
-        global lock, runs
-        lock, runs = args
+    schedule = _schedule_name(schedule)
+    supervision = _supervision(timeout, deadline, speculate)
+    _log_sweep(exp, params)
+    try:
+        if _is_batch(exp):
+            return [res for _, res in _run_batches(
+                exp, params, shared, backend,
+                (journal, schedule != 'fifo', supervision))]
+        if journal or schedule != 'fifo' or supervision or \
+           not isinstance(params, (list, tuple)):
+            return [res for _, res in _reorder(_run_indexed(
+                exp, params, shared, backend, journal, schedule, supervision))]
+        pool = _get_pool(backend)
+        with _sharing(exp, params, shared, backend) as (params, _):
+            results = pool.map(partial(_call, exp), params)
+        return results
+    finally:
+        # Make the logs of the workers complete by the time this returns.
+        flush_logs()
+
+
+def run_parallel_iter(exp, params, ordered=False, chunksize=1, shared=None,
+                      backend=None, journal=None, schedule=None,
+                      timeout=None, deadline=None, speculate=None):
+    """Run an experiment in parallel, yielding results as they finish.
+
+    Like run_parallel, but instead of waiting for every call to finish and
+    returning all results at once, yield each result as soon as it is
+    available. `params` may be any iterable, including a generator, so the
+    parameter sets need not be built in advance.
+
+    Args:
+        exp (method): A @experiment-decorated method.
+        params (iterable): Each element is a set of arguments to call `exp`
+            with.
+        ordered (bool): If True, yield results in the same order as
+            `params`. Otherwise, yield them in order of completion.
+        chunksize (int): Number of parameter sets sent to a worker at once.
+            Only used when params is a list or a tuple.
+        shared (object): See run_parallel.
+        backend (str): See run_parallel.
+        journal (str): See run_parallel.
+        schedule (str): See run_parallel.
+        timeout (float): See run_parallel.
+        deadline (float): See run_parallel.
+        speculate (bool): See run_parallel.
+
+    Yields:
+        tuple: The pair `(p, exp(*p))` for each element `p` of params.
+
+    """
+    schedule = _schedule_name(schedule)
+    supervision = _supervision(timeout, deadline, speculate)
+    _log_sweep(exp, params)
+    try:
+        if _is_batch(exp):
+            yield from _run_batches(exp, params, shared, backend, (
+                journal, schedule != 'fifo', supervision))
+            return
+        if journal or schedule != 'fifo' or supervision or \
+           not isinstance(params, (list, tuple)):
+            pairs = _run_indexed(exp, params, shared, backend, journal,
+                                 schedule, supervision)
+            if ordered:
+                yield from _reorder(pairs)
+            else:
+                yield from (pair for _, pair in pairs)
+            return
+        pool = _get_pool(backend)
+        imap = pool.imap if ordered else pool.imap_unordered
+        with _sharing(exp, params, shared, backend) as (params, placeholder):
+            for param_set, result in imap(partial(_call_with_params, exp),
+                                          params, chunksize=chunksize):
+                if placeholder is not None:
+                    param_set = tuple(_unswap(param_set, placeholder))
+                yield param_set, result
+    finally:
+        flush_logs()
+
+
+async def gather_experiments(exp, params, limit=None):
+    """Run an asynchronous experiment concurrently on the event loop.
+
+    For each element `p` in `params`, await `exp(*p)`, with at most `limit`
+    of these calls running at the same time. This is the counterpart of
+    run_parallel for experiments defined with `async def`, which spend most
+    of their time waiting on I/O rather than computing.
+
+    Args:
+        exp (method): A @experiment-decorated coroutine method.
+        params (iterable): Each element is a set of arguments to call `exp`
+            with.
+        limit (int): Maximum number of concurrent calls. If None, make all
+            calls at once.
+
+    Returns:
+        list: The result of awaiting `exp(*pi)` for each element of params.
+
+    """
+    params = list(params)
+    results = [None] * len(params)
+    pending = iter(enumerate(params))
 
-    with Pool(initializer=init, initargs=(lock, runs),
-              maxtasksperchild=100) as pool:
-        results = pool.starmap(exp, params)
+    async def worker():
+        for index, param_set in pending:
+            results[index] = await exp(*param_set)
+
+    import asyncio
+    await asyncio.gather(*[worker() for _ in range(limit or len(params))])
     return results
 
 
-def _get_parameters(method, param_name, args, kwargs):
+def _parameter_names(method, skip=1):
+    """Return the names of the positional parameters of method.
+
+    The first skip parameters, such as self, are left out.
+
+    """
+    from inspect import signature, Parameter
+    kinds = (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD)
+    return tuple(param.name for param in signature(method).parameters.values()
+                 if param.kind in kinds)[skip:]
+
+
+def _get_parameters(names, param_name, args, kwargs):
     """Return the arguments passed to all experimental parameters.
 
     All method arguments that are not param_name are treated as
-    experimental parameters. method is assumed to have been called as
-    method(*args, **kwargs).
+    experimental parameters. The method is assumed to have been called as
+    method(self, *args, **kwargs), and names are the names of its
+    positional parameters after self (see _parameter_names).
 
     """
-    from inspect import getfullargspec
-    arg_values = kwargs.copy()
-    arg_values.update(dict(zip(getfullargspec(method).args, args)))
-    if param_name in arg_values:
-        del arg_values[param_name]
-    if 'self' in arg_values:
-        del arg_values['self']
+    arg_values = dict(zip(names, args))
+    if kwargs:
+        arg_values.update(kwargs)
+    arg_values.pop(param_name, None)
     return arg_values
 
 
-def experiment(data_param=None):
+def _item(value):
+    """Return value as a Python scalar, if it is a numpy scalar."""
+    return value.item() if hasattr(value, 'item') and \
+        getattr(value, 'ndim', None) == 0 else value
+
+
+def _source(method):
+    """Return the source code of method, or its bytecode if unavailable."""
+    from inspect import getsource
+    try:
+        return getsource(method)
+    except (OSError, TypeError):
+        code = method.__code__
+        return code.co_code, repr(code.co_consts)
+
+
+def experiment(data_param=None, cache=False, batch=False):
     """Decorator that adds logging functionality to experiment methods.
 
     Args:
@@ -111,6 +829,22 @@ def experiment(data_param=None):
         data_param (str): Parameter treated by the method as data
         input. All other parameters are treated as experimental parameters.
 
+        cache (bool): Whether to look up results in the cache of the
+        Script before running the method. Results are cached under a digest
+        of the method's source code and all of its arguments, so the method
+        runs again whenever any of them changes. See section cache in
+        decu.cfg.
+
+        batch (bool): Whether the method computes many runs in one call.
+        Each experimental parameter then holds one value per run, stacked
+        in a sequence such as an array, and the method must return one
+        result per run, stacked along the first axis. Every run gets its
+        own run identifier, and its own result file or a row in a file
+        shared by the whole batch (see batch_output in section experiment
+        of decu.cfg). run_parallel stacks the parameter sets of batch
+        experiments itself. Cannot be combined with cache, or with async
+        methods.
+
     Returns:
         func: A decorator that adds bookkeeping functionality to its
         argument.
@@ -132,7 +866,11 @@ def experiment(data_param=None):
 
         """
         exp_name = method.__name__
+        names = _parameter_names(method)
         cfg = config['experiment']
+        if batch and (cache or iscoroutinefunction(method)):
+            raise DecuException('batch experiments cannot be cached or '
+                                'asynchronous')
 
         def exp_start_msg(run, params):
             return cfg.subs('start_msg', exp_name=exp_name, run=run,
@@ -150,39 +888,235 @@ def experiment(data_param=None):
             return cfg.subs('no_result_msg', exp_name=exp_name, params=params,
                             run=run)
 
+        def lost(self, run):
+            """Whether another copy of the run, or run_parallel giving up on
+            it, claimed its outcome first. See decu.parallel.claim."""
+            if parallel.claim():
+                return False
+            self.log.info(cfg.subs('discard_msg', exp_name=exp_name, run=run))
+            self.log.flush()
+            return True
+
+        def cache_msg(option, run):
+            return cfg.subs(option, exp_name=exp_name, run=run,
+                            hits=decorated.cache_hits,
+                            misses=decorated.cache_misses)
+
+        source = []
+
+        def cache_key(args, kwargs):
+            if not source:
+                source.append(_source(method))
+            return digest((source[0], args, kwargs))
+
+        def lookup(self, run, values, key):
+            """Return the pair (found, result) for key in the cache."""
+            basename = self.make_result_basename(exp_name, run)
+            outfile = self.result_cache().get(key, basename)
+            verbose = self.log.isEnabledFor(INFO)
+            if outfile is None:
+                decorated.cache_misses += 1
+                if verbose:
+                    self.log.info(cache_msg('cache_miss_msg', run))
+                return False, None
+            decorated.cache_hits += 1
+            if verbose:
+                self.log.info(cache_msg('cache_hit_msg', run))
+                self.log.info(wrote_results_msg(run, basename, values))
+            self.record('result', exp_name, run, values, None, outfile)
+            last_run.info = (run, outfile, None)
+            self.log.flush()
+            return True, read(outfile)
+
         from time import time
 
-        @wraps(method)
-        def decorated(self, *args, **kwargs):
-            with lock:
-                decorated.run = runs[decorated].value
-                runs[decorated].value += 1
+        def begin(self, args, kwargs):
+            """Bookkeeping done before calling the method."""
+            # decorated.run is kept for the experiment to read, but it may
+            # be overwritten by concurrent calls from other threads.
+            run = decorated.run = self.next_run(exp_name)
 
             # Make sure the output dir exists
-            os.makedirs(self.results_dir, exist_ok=True)
-
-            values = _get_parameters(method, data_param, args, kwargs)
-            self.log.info(exp_start_msg(decorated.run, values))
-
-            start = time()
-            result = method(self, *args, **kwargs)
-            end = time()
-            self.log.info(exp_end_msg(decorated.run, values, end - start))
-
+            self.make_dirs(self.results_dir)
+
+            values = _get_parameters(names, data_param, args, kwargs)
+            if self.log.isEnabledFor(INFO):
+                self.log.info(exp_start_msg(run, values))
+            return run, values
+
+        def written(self, run, values, basename, key, elapsed, outfile,
+                    error):
+            """Bookkeeping done once a result is written, or failed to."""
+            if error is not None:
+                self.log.error(cfg.subs('write_error_msg', exp_name=exp_name,
+                                        run=run, error=repr(error)))
+                return
+            if self.log.isEnabledFor(INFO):
+                self.log.info(wrote_results_msg(run, basename, values))
+            self.record('result', exp_name, run, values, elapsed, outfile)
+            if key is not None:
+                self.result_cache().put(key, outfile)
+
+        def store(self, run, values, result, key=None, elapsed=None):
+            """Write result and return the name of its file.
+
+            With the background option of section io, the result is only
+            queued to be written. See decu.writer. With the store option,
+            the result goes to the store of the experiment, and the name
+            returned is its address in the store. See decu.store.
+
+            """
+            options = config['io']
+            kind = options['store']
+            if kind == 'sqlite' and key is None:
+                outfile = self.result_store(exp_name).put(
+                    run, values, elapsed, result)
+                if self.log.isEnabledFor(INFO):
+                    self.log.info(wrote_results_msg(run, outfile, values))
+                self.record('result', exp_name, run, values, elapsed, outfile)
+                return outfile
+            elif kind not in ('files', 'sqlite'):
+                raise DecuException('unknown store \'{}\''.format(kind))
+            basename = self.make_result_basename(exp_name, run)
+            if options.getboolean('background'):
+                get_writer().submit(result, basename, partial(
+                    written, self, run, values, basename, key, elapsed))
+                return make_fullname(basename, type(result))
+            outfile = write(result, basename)
+            written(self, run, values, basename, key, elapsed, outfile, None)
+            return outfile
+
+        def save(self, run, values, result, elapsed, key=None):
+            """Bookkeeping done after calling the method."""
+            outfile = None
             if result is not None:
-                basename = self.make_result_basename(exp_name, decorated.run)
-                write(result, basename)
-                self.log.info(wrote_results_msg(decorated.run, basename, values))
+                outfile = store(self, run, values, result, key, elapsed)
+            elif self.log.isEnabledFor(WARNING):
+                self.log.warning(no_result_msg(run, values))
+            last_run.info = (run, outfile, elapsed)
+            # Records logged by a worker reach the logfile before its result
+            # reaches the caller.
+            self.log.flush()
+
+        def batch_msg(option, runs, **kwargs):
+            return cfg.subs(option, exp_name=exp_name, first=runs[0],
+                            last=runs[-1], size=len(runs), **kwargs)
+
+        def save_batch(self, runs, stacked, result):
+            """Bookkeeping done after calling a batch method."""
+            if result is None:
+                self.log.warning(batch_msg('batch_no_result_msg', runs))
+                return
+            if len(result) != len(runs):
+                raise DecuException(
+                    '{} returned {} results for a batch of {} runs'.format(
+                        exp_name, len(result), len(runs)))
+            output = cfg['batch_output']
+            if output == 'one':
+                store(self, '{}-{}'.format(runs[0], runs[-1]), stacked,
+                      result)
+            elif output == 'each':
+                for row, run in enumerate(runs):
+                    values = {name: _item(column[row])
+                              for name, column in stacked.items()}
+                    if result[row] is None:
+                        self.log.warning(no_result_msg(run, values))
+                        continue
+                    store(self, run, values, _item(result[row]))
             else:
-                self.log.warning(no_result_msg(decorated.run, values))
-
-            return result
-
+                raise DecuException('unknown batch_output \'{}\''.format(
+                    output))
+
+        if batch:
+            @wraps(method)
+            def decorated(self, *args, **kwargs):
+                stacked = _get_parameters(names, data_param, args, kwargs)
+                sizes = set(len(column) for column in stacked.values())
+                if len(sizes) != 1:
+                    raise DecuException('the experimental parameters of a '
+                                        'batch must have the same length')
+                # Consecutive, so that first and last say which runs they are.
+                runs = list(self.next_runs(exp_name, sizes.pop()))
+                if not runs:
+                    return method(self, *args, **kwargs)
+                decorated.run = runs
+                self.make_dirs(self.results_dir)
+                self.log.info(batch_msg('batch_start_msg', runs))
+
+                start = time()
+                result = method(self, *args, **kwargs)
+                end = time()
+                self.log.info(batch_msg('batch_end_msg', runs,
+                                        elapsed=round(end - start, 5)))
+
+                save_batch(self, runs, stacked, result)
+                self.log.flush()
+                return result
+
+        elif iscoroutinefunction(method):
+            @wraps(method)
+            async def decorated(self, *args, **kwargs):
+                run, values = begin(self, args, kwargs)
+                key = cache_key(args, kwargs) if cache else None
+                if key is not None:
+                    found, result = lookup(self, run, values, key)
+                    if found:
+                        return result
+
+                start = time()
+                result = await method(self, *args, **kwargs)
+                end = time()
+                if lost(self, run):
+                    return result
+                self.log.info(exp_end_msg(run, values, end - start))
+
+                # Keep the event loop free while the result is written.
+                import asyncio
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, save, self, run, values,
+                                           result, end - start, key)
+                return result
+
+        else:
+            @wraps(method)
+            def decorated(self, *args, **kwargs):
+                run, values = begin(self, args, kwargs)
+                key = cache_key(args, kwargs) if cache else None
+                if key is not None:
+                    found, result = lookup(self, run, values, key)
+                    if found:
+                        return result
+
+                start = time()
+                result = method(self, *args, **kwargs)
+                end = time()
+                if lost(self, run):
+                    return result
+                if self.log.isEnabledFor(INFO):
+                    self.log.info(exp_end_msg(run, values, end - start))
+
+                save(self, run, values, result, end - start, key)
+                return result
+
+        decorated.data_param = data_param
+        decorated.batch = batch
+        decorated.cache_hits = decorated.cache_misses = 0
         return decorated
 
     return _experiment
 
 
+def _pyplot():
+    """Return matplotlib.pyplot, importing it the first time it is needed.
+
+    Importing pyplot takes a long time, so it is not done until the first
+    @figure-decorated method runs.
+
+    """
+    import matplotlib.pyplot as plt
+    return plt
+
+
 def figure(show=False, save=True):
     """Create the figure decorator.
 
@@ -220,6 +1154,7 @@ def figure(show=False, save=True):
         """
         from inspect import getfullargspec
         fig_name = method.__name__
+        names = _parameter_names(method)
         spec = getfullargspec(method)
         if 'suffix' in spec.args or 'suffix' in spec.kwonlyargs:
             raise DecuException('methods decorated with decu.experiment '
@@ -232,14 +1167,18 @@ def figure(show=False, save=True):
         @wraps(method)
         def decorated(self, *args, suffix=None, **kwargs):
             # Make sure the output dir exists
-            os.makedirs(self.figures_dir, exist_ok=True)
+            self.make_dirs(self.figures_dir)
 
             method(self, *args, **kwargs)
+            plt = _pyplot()
             fig = plt.gcf()
             if save:
                 outfile = self.make_figure_basename(fig_name, suffix)
                 fig.savefig(outfile)
                 self.log.info(wrote_fig_msg(outfile))
+                self.record('figure', fig_name, None,
+                            _get_parameters(names, None, args, kwargs), None,
+                            outfile)
             if show:
                 plt.show()
 
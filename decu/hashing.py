@@ -0,0 +1,103 @@
+"""
+hashing.py
+----------
+
+Stable digests of experiment arguments.
+
+Digests identify a set of arguments across runs of a script, e.g., to
+tell which parameter sets of a sweep have already been run. Unlike hash(),
+they do not change between interpreter sessions.
+
+"""
+
+import sys
+import pickle
+import weakref
+import hashlib
+
+__all__ = ['digest']
+
+
+def _update(hasher, obj, memo):
+    """Feed obj to hasher."""
+    np = sys.modules.get('numpy')
+    pd = sys.modules.get('pandas')
+    if isinstance(obj, (tuple, list)):
+        hasher.update('{}{}('.format(type(obj).__name__, len(obj)).encode())
+        for item in obj:
+            _update(hasher, item, memo)
+        hasher.update(b')')
+    elif isinstance(obj, dict):
+        hasher.update('dict{}('.format(len(obj)).encode())
+        for key in sorted(obj, key=repr):
+            _update(hasher, key, memo)
+            _update(hasher, obj[key], memo)
+        hasher.update(b')')
+    elif np is not None and isinstance(obj, np.generic) and \
+            not isinstance(obj, np.void):
+        _update(hasher, obj.item(), memo)
+    elif isinstance(obj, (str, bytes, int, float, complex, bool)) or \
+            obj is None:
+        hasher.update('{}:{!r};'.format(type(obj).__name__, obj).encode())
+    elif np is not None and isinstance(obj, np.ndarray) and \
+            not obj.dtype.hasobject:
+        hasher.update(_memoized(obj, memo, _array_digest))
+    elif pd is not None and isinstance(obj, (pd.DataFrame, pd.Series)):
+        hasher.update(_memoized(obj, memo, _pandas_digest))
+    else:
+        hasher.update(pickle.dumps(obj, protocol=2))
+
+
+def _memoized(obj, memo, compute):
+    """Return compute(obj), computed only once while obj is alive.
+
+    memo is keyed by id, and ids are reused once their object is freed, so
+    each entry keeps a weak reference to its object to tell them apart.
+
+    """
+    entry = memo.get(id(obj))
+    if entry is None or entry[0]() is not obj:
+        entry = memo[id(obj)] = (weakref.ref(obj), compute(obj))
+    return entry[1]
+
+
+def _array_digest(arr):
+    """Return the digest of a numpy array, hashing its buffer directly."""
+    import numpy as np
+    hasher = hashlib.sha1('ndarray{}{}'.format(arr.dtype.str,
+                                               arr.shape).encode())
+    hasher.update(memoryview(np.ascontiguousarray(arr)).cast('B'))
+    return hasher.digest()
+
+
+def _pandas_digest(obj):
+    """Return the digest of a DataFrame or Series, hashing its values."""
+    import pandas as pd
+    hasher = hashlib.sha1(type(obj).__name__.encode())
+    columns = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+    dtypes = obj.dtypes if isinstance(obj, pd.DataFrame) else [obj.dtype]
+    hasher.update(repr((list(columns), [str(d) for d in dtypes])).encode())
+    hasher.update(pd.util.hash_pandas_object(obj, index=True).values)
+    return hasher.digest()
+
+
+def digest(obj, memo=None):
+    """Return a hex digest of obj that is stable across sessions.
+
+    Containers are hashed item by item, numpy arrays by their raw buffer,
+    and pandas objects by their row hashes, so that equal arguments always
+    give the same digest without converting them to strings.
+
+    Args:
+        obj (object): The object to hash.
+        memo (dict): Digests of the arrays seen so far, by object. Pass
+            the same dict when hashing many parameter sets that share the
+            same (large) arrays, so that each array is hashed only once.
+
+    Returns:
+        str: A hexadecimal digest.
+
+    """
+    hasher = hashlib.sha1()
+    _update(hasher, obj, {} if memo is None else memo)
+    return hasher.hexdigest()
@@ -8,8 +8,14 @@ Reading and writing functionality for decu.
 
 import os
 import json
+import pickle
+import weakref
+import tempfile
+from functools import partial
+from .config import config, pattern
+from .store import get_store
 
-__all__ = ['write', 'read']
+__all__ = ['write', 'read', 'read_many', 'register', 'open_memmap']
 
 write_funcs = {
     int: lambda fn, res: _simple_write(fn, res, fmt=':d'),
@@ -22,9 +28,15 @@ read_funcs = {
     'int': lambda fn: _simple_read(fn, int),
     'txt': lambda fn: _simple_read(fn, str),
     'json': lambda fn: _json_read(fn),
-    'float': lambda fn: _simple_read(fn, float)
+    'float': lambda fn: _simple_read(fn, float),
+    'pickle': lambda fn: _pickle_read(fn),
+    'sqlite': lambda fn: get_store(fn).load()
 }
 
+# Readers that return a read-only memory map of the file instead of loading
+# it, keyed by extension. See read.
+mmap_read_funcs = {}
+
 extensions = {
     int: 'int',
     float: 'float',
@@ -33,9 +45,68 @@ extensions = {
 }
 
 
+# Every format each type can be written in, keyed by the pair (type,
+# extension). The formats keyed by object are available for every type.
+# write_funcs and extensions hold the default format of each type.
+formats = {
+    (object, 'pickle'): lambda fn, res: _pickle_write(fn, res)
+}
+
+
+def register(_type, ext, writer=None, reader=None, default=True):
+    """Register a format to write results of a type, or to read files.
+
+    Results of each type are written in their default format, unless the
+    config chooses another of the formats registered for the type, as
+    ${name}_format = ext in section io, where name is the name of the type
+    in lowercase. Files are read by their extension, whatever the config.
+
+    Args:
+        _type (type): The type of the results written in this format.
+        ext (str): The extension of the files of this format, which is
+            also the name of the format in the config.
+        writer (function): Called as writer(filename, result) to write a
+            result of type _type. If None, only register reader.
+        reader (function): Called as reader(filename) to read a file with
+            extension ext. If None, only register writer.
+        default (bool): Whether the format becomes the default of _type.
+            If False, it does only if _type had no format yet.
+
+    """
+    if writer is not None:
+        formats[(_type, ext)] = writer
+        if default or _type not in extensions:
+            extensions[_type] = ext
+            write_funcs[_type] = writer
+    if reader is not None:
+        read_funcs[ext] = reader
+
+
+def _format(_type):
+    """Return the extension and the writer of the results of _type."""
+    _register_type(_type)
+    ext = extensions.get(_type, None)
+    chosen = None
+    if _type is not None:
+        chosen = config['io'].get('{}_format'.format(_type.__name__))
+    if not chosen or chosen == ext:
+        chosen, writer = ext, write_funcs.get(_type)
+    else:
+        writer = formats.get((_type, chosen)) or \
+            formats.get((object, chosen))
+    if writer is None:
+        from .core import DecuException
+        if chosen is None:
+            raise DecuException('there is no format for results of type {}. '
+                                'See decu.io.register.'.format(_type))
+        raise DecuException('there is no format {} for results of type {}. '
+                            'See decu.io.register.'.format(chosen, _type))
+    return chosen, writer
+
+
 def make_fullname(basename, _type=None):
     """Return the basename plus an appropriate extension for the type."""
-    return '{}.{}'.format(basename, extensions.get(_type, None))
+    return '{}.{}'.format(basename, _format(_type)[0])
 
 
 def _simple_write(filename, obj, fmt=None):
@@ -63,54 +134,301 @@ def _json_read(filename):
         return json.load(file)
 
 
+def _pickle_write(filename, res):
+    """Write any picklable object."""
+    with open(filename, 'wb') as file:
+        pickle.dump(res, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _pickle_read(filename):
+    """Read a pickle."""
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
 def write(result, basename):
-    """Write result to disk."""
-    filename = make_fullname(basename, type(result))
-    write_funcs[type(result)](filename, result)
+    """Write result to disk, and return the name of the written file."""
+    ext, writer = _format(type(result))
+    filename = '{}.{}'.format(basename, ext)
+    writer(filename, result)
+    return filename
+
+
+def split_address(infile):
+    """Return the store and the run of 'store.sqlite#run', as a pair.
 
+    For any other file, return the pair (infile, None). See decu.store.
 
-def read(infile):
-    """Read result from disk."""
+    """
+    filename, sep, run = infile.rpartition('#')
+    if sep and filename.endswith('.sqlite'):
+        return filename, run
+    return infile, None
+
+
+def read(infile, mmap=None, run=None):
+    """Read result from disk.
+
+    Args:
+        infile (str): The file to read. Results in a store are addressed
+            as 'store.sqlite#run'. Reading a store without giving a run
+            returns a dict of the results of all its runs.
+        mmap (bool): Whether to return a read-only memory map of the file,
+            instead of loading it into memory, for the formats that support
+            it (npy). Other formats are always loaded. If None, use the
+            mmap option of section io in the config.
+        run (int): The run to read from the store infile.
+
+    """
+    if run is None:
+        infile, run = split_address(infile)
+    if run is not None:
+        return get_store(infile).get(run)
     _, ext = os.path.splitext(infile)
     ext = ext.strip('.')
+    if ext not in read_funcs:
+        _register(registrar_extensions.get(ext))
+    if mmap is None:
+        mmap = config['io'].getboolean('mmap')
+    if mmap and ext in mmap_read_funcs:
+        return mmap_read_funcs[ext](infile)
     return read_funcs[ext](infile)
 
 
-try:
+def _run_id(path):
+    """Return the run identifier in the name of a result file, or its name.
+
+    The name is matched against result_file in section Script.
+
+    """
+    _, run = split_address(path)
+    if run is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+        match = pattern(config['Script']['result_file']).fullmatch(name)
+        run = name if match is None else match.group('run')
+    return int(run) if run.isdigit() else run
+
+
+def _stack(results, paths):
+    """Return results stacked in one array, or concatenated by run id."""
+    import numpy as np
+    first = next(results)
+    if isinstance(first, np.ndarray):
+        stacked = np.empty((len(paths),) + first.shape, first.dtype)
+        stacked[0] = first
+        for index, result in enumerate(results, 1):
+            if result.shape != first.shape:
+                from .core import DecuException
+                raise DecuException('cannot stack {} of shape {} with arrays '
+                                    'of shape {}'.format(paths[index],
+                                                         result.shape,
+                                                         first.shape))
+            stacked[index] = result
+        return stacked
+    if type(first).__module__.partition('.')[0] == 'pandas':
+        import pandas as pd
+        return pd.concat([first] + list(results),
+                         keys=[_run_id(path) for path in paths],
+                         names=['run'])
+    from .core import DecuException
+    raise DecuException('can only stack arrays, DataFrames and Series, '
+                        'not {}'.format(type(first).__name__))
+
+
+def read_many(paths, workers=None, stack=False, backend='thread',
+              mmap=None):
+    """Read many results at the same time.
+
+    Args:
+        paths (list): The files to read, or a glob pattern, such as
+            'results/*--experiment--*'. The files matched by a pattern are
+            read in sorted order.
+        workers (int): Number of files read at the same time. If None, use
+            the workers option of section parallel in the config.
+        stack (bool): Whether to stack the results in one array, or, for
+            DataFrames and Series, to concatenate them with the run
+            identifier of each file (see result_file in section Script) as
+            the outer level of the index. Arrays must all have the same
+            shape, and are copied into an array allocated once.
+        backend (str): One of the keys of decu.parallel.backends. Threads
+            are best for most formats. Processes may be faster for formats
+            whose readers hold the GIL, such as csv.
+        mmap (bool): See read.
+
+    Returns:
+        list: The results, in the order of paths, or a single stacked array
+        or DataFrame if stack is True. If there are no paths, an empty
+        list.
+
+    """
+    from glob import glob
+    from . import parallel
+    if isinstance(paths, str):
+        paths = sorted(glob(paths))
+    paths = list(paths)
+    if not paths:
+        return []
+    workers = min(workers or parallel.num_workers(), len(paths))
+    pool = parallel.backends[backend](workers, None)
+    try:
+        results = pool.imap(partial(read, mmap=mmap), paths)
+        return _stack(results, paths) if stack else list(results)
+    finally:
+        pool.terminate()
+
+
+# Files created by open_memmap and not yet written, mapped to a weak
+# reference to their memory map.
+streaming = {}
+
+
+def open_memmap(shape, dtype=float, directory=None):
+    """Return a writable memory map of a new npy file, to fill as a result.
+
+    Experiments that produce arrays larger than memory can fill the array
+    returned by this function and return it as their result. Writing it
+    then moves the file into place instead of copying the data. The array
+    remains usable afterwards, backed by the result file.
+
+    Args:
+        shape (tuple): The shape of the array.
+        dtype (data-type): The type of its elements.
+        directory (str): Where to create the file until it is written. It
+            must be in the same file system as the results. If None, use
+            the results_dir of section Script in the config.
+
+    """
+    from numpy.lib.format import open_memmap as _open_memmap
+    directory = directory or config['Script']['results_dir']
+    os.makedirs(directory, exist_ok=True)
+    fd, filename = tempfile.mkstemp(suffix='.npy.part', dir=directory)
+    os.close(fd)
+    array = _open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+    streaming[os.path.abspath(filename)] = weakref.ref(array)
+    return array
+
+
+def _write_npy(filename, res):
+    """Write an array, moving the file of arrays made by open_memmap."""
+    import numpy as np
+    source = getattr(res, 'filename', None)
+    ref = streaming.get(source) if source is not None else None
+    if ref is not None and ref() is res:
+        res.flush()
+        os.replace(source, filename)
+        del streaming[source]
+    else:
+        np.save(filename, res)
+
+
+def _register_networkx():
     import networkx as nx
-    extensions[nx.Graph] = 'gml'
-    write_funcs[nx.Graph] = lambda fn, res: nx.write_gml(res, fn)
-    read_funcs['gml'] = lambda fn: nx.read_gml(fn, destringizer=int)
+    register(nx.Graph, 'gml', lambda fn, res: nx.write_gml(res, fn),
+             lambda fn: nx.read_gml(fn, destringizer=int), default=False)
+
 
-except ImportError:
-    pass
+def _register_pandas():
+    import pandas as pd
+    for _type in [pd.DataFrame, pd.Series]:
+        register(_type, 'csv', lambda fn, res: res.to_csv(fn), default=False)
+        register(_type, 'parquet', _write_parquet, default=False)
+        register(_type, 'feather', _write_feather, default=False)
+    read_funcs['csv'] = _read_csv
+    read_funcs['parquet'] = lambda fn: _squeeze(pd.read_parquet(fn))
+    read_funcs['feather'] = _read_feather
 
 
-try:
+def _read_csv(filename):
+    """Read a csv and return a DataFrame or Series."""
     import pandas as pd
-    extensions[pd.DataFrame] = 'csv'
-    extensions[pd.Series] = 'csv'
-    write_funcs[pd.DataFrame] = lambda fn, res: res.to_csv(fn)
-    write_funcs[pd.Series] = lambda fn, res: res.to_csv(fn)
-    read_funcs['csv'] = lambda fn: _read_csv(fn)
+    loaded = pd.read_csv(filename, index_col=0)
+    if len(loaded.columns) == 1:
+        return pd.read_csv(filename, index_col=0, header=None)[1]
+    else:
+        return loaded
+
+
+def _frame(res):
+    """Return res as a DataFrame with string column names."""
+    frame = res.to_frame() if res.ndim == 1 else res
+    return frame.rename(columns=str)
+
+
+def _squeeze(frame):
+    """Return the only column of frame as a Series, or frame itself."""
+    return frame.iloc[:, 0] if len(frame.columns) == 1 else frame
+
 
-    def _read_csv(filename):
-        """Read a csv and return a DataFrame or Series."""
-        loaded = pd.read_csv(filename, index_col=0)
-        if len(loaded.columns) == 1:
-            return pd.read_csv(filename, index_col=0, header=None)[1]
-        else:
-            return loaded
+def _write_parquet(filename, res):
+    """Write a DataFrame or Series to Parquet. Needs pyarrow."""
+    _frame(res).to_parquet(filename)
 
-except ImportError:
-    pass
 
+def _write_feather(filename, res):
+    """Write a DataFrame or Series to Feather. Needs pyarrow."""
+    # Feather does not store the index, so store it as the first column.
+    _frame(res).rename_axis('__index__').reset_index().to_feather(filename)
 
-try:
+
+def _read_feather(filename):
+    """Read a Feather file written by _write_feather."""
+    import pandas as pd
+    frame = pd.read_feather(filename).set_index('__index__')
+    return _squeeze(frame.rename_axis(None))
+
+
+def _register_numpy():
     import numpy as np
-    extensions[np.ndarray] = 'npy'
-    write_funcs[np.ndarray] = lambda fn, res: np.save(fn, res)
+    for _type in [np.ndarray, np.memmap]:
+        register(_type, 'npy', _write_npy, default=False)
+        register(_type, 'npz', lambda fn, res: np.savez_compressed(fn, res),
+                 default=False)
     read_funcs['npy'] = lambda fn: np.load(fn)
+    read_funcs['npz'] = _read_npz
+    mmap_read_funcs['npy'] = lambda fn: np.load(fn, mmap_mode='r')
+
+
+def _read_npz(filename):
+    """Read the array of a file written with np.savez_compressed."""
+    import numpy as np
+    with np.load(filename) as archive:
+        return archive['arr_0']
+
+
+# Writers and readers for the types of optional libraries are registered
+# the first time they are needed, so that importing decu does not import
+# these libraries. Each library is found by the top-level module of the
+# type being written, or by the extension of the file being read.
+registrars = {
+    'networkx': _register_networkx,
+    'pandas': _register_pandas,
+    'numpy': _register_numpy
+}
+
+registrar_extensions = {
+    'gml': 'networkx',
+    'csv': 'pandas',
+    'parquet': 'pandas',
+    'feather': 'pandas',
+    'npy': 'numpy',
+    'npz': 'numpy'
+}
+
+registered = set()
+
+
+def _register(library):
+    """Register the writers and readers of library, if not done yet."""
+    if library in registered or library not in registrars:
+        return
+    registered.add(library)
+    try:
+        registrars[library]()
+    except ImportError:
+        pass
+
 
-except ImportError:
-    pass
+def _register_type(_type):
+    """Register the writers and readers of the library of _type."""
+    if _type is not None:
+        _register(getattr(_type, '__module__', '').partition('.')[0])
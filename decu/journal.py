@@ -0,0 +1,108 @@
+"""
+journal.py
+----------
+
+Append-only records of the runs of an experiment: journals of finished
+runs, used to resume interrupted sweeps, and histories of elapsed times,
+used to predict how long each run will take.
+
+"""
+
+import os
+import json
+from .io import read, split_address
+from .hashing import digest
+
+__all__ = ['Journal', 'TimingHistory']
+
+
+class JsonLines():
+    """File of JSON objects, one per line, keyed by their 'key' field.
+
+    Lines are only ever appended, and each one is flushed as soon as it is
+    written, so the file survives the process being killed at any point.
+    When a key appears more than once, the last line wins.
+
+    Args:
+        filename (str): The file. It is created if necessary.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            self._load()
+
+    def _load(self):
+        """Read the entries already in the file."""
+        with open(self.filename) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The line being written when the process was killed.
+                    continue
+                self.entries[entry['key']] = entry
+
+    @staticmethod
+    def key(exp_name, params, memo=None):
+        """Return the key of the parameter set params of exp_name.
+
+        See decu.hashing.digest for the meaning of memo.
+
+        """
+        return digest((exp_name, tuple(params)), memo)
+
+    def _append(self, entry):
+        """Add entry to the file."""
+        self.entries[entry['key']] = entry
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        with open(self.filename, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+
+class Journal(JsonLines):
+    """Append-only record of the finished runs of an experiment.
+
+    Each line of the journal file holds the key of a parameter set, plus
+    the run identifier and the result file produced by the experiment
+    called with that parameter set. See JsonLines.
+
+    """
+    def get(self, key):
+        """Return the entry recorded under key, or None.
+
+        Entries whose result file no longer exists are ignored.
+
+        """
+        entry = self.entries.get(key)
+        if entry is None or (entry['file'] is not None and not os.path.exists(
+                split_address(entry['file'])[0])):
+            return None
+        return entry
+
+    def load(self, entry):
+        """Return the result recorded in entry."""
+        return None if entry['file'] is None else read(entry['file'])
+
+    def record(self, key, run, outfile):
+        """Append the run and result file of the parameter set key."""
+        self._append({'key': key, 'run': run, 'file': outfile})
+
+
+class TimingHistory(JsonLines):
+    """Append-only record of how long each run of an experiment took.
+
+    Each line of the history file holds the key of a parameter set and
+    the time, in seconds, that the last run with that parameter set took.
+    See JsonLines.
+
+    """
+    def predict(self, key):
+        """Return the expected time of a run with key, or None if unknown."""
+        entry = self.entries.get(key)
+        return None if entry is None else entry['elapsed']
+
+    def record(self, key, elapsed):
+        """Append the elapsed time of a run of the parameter set key."""
+        self._append({'key': key, 'elapsed': elapsed})
@@ -0,0 +1,74 @@
+"""
+lazy.py
+-------
+
+Results that are read only when they are first used.
+
+`decu inspect --lazy` exposes the files it is given through these classes,
+so that opening a session does not read any of them, however many they
+are. Files are read with decu.io.read, as memory maps when possible.
+
+"""
+
+from collections.abc import Sequence
+from .io import read, read_many
+
+__all__ = ['LazyResults', 'LazyNamespace']
+
+
+class LazyResults(Sequence):
+    """Sequence of results, each read from its file when first accessed.
+
+    Each result is read only once, and kept for later accesses.
+
+    Args:
+        paths (list): The result files.
+        mmap (bool): Whether to read the files that support it as
+            read-only memory maps. See decu.io.read.
+
+    """
+    def __init__(self, paths, mmap=True):
+        self.paths = list(paths)
+        self.mmap = mmap
+        self.loaded = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        if index not in self.loaded:
+            self.loaded[index] = read(self.paths[index], mmap=self.mmap)
+        return self.loaded[index]
+
+    def __repr__(self):
+        return '<LazyResults of {} files, {} read>'.format(
+            len(self.paths), len(self.loaded))
+
+    def stack(self, **kwargs):
+        """Return every result stacked together. See decu.io.read_many."""
+        return read_many(self.paths, stack=True, mmap=self.mmap, **kwargs)
+
+
+class LazyNamespace(dict):
+    """Namespace whose lazy variables are computed when first looked up.
+
+    When used as the namespace of exec, or of an interactive session, the
+    code run only computes the lazy variables that it uses.
+
+    Args:
+        lazy (dict): The function that computes each lazy variable, called
+            without arguments.
+
+    """
+    def __init__(self, lazy, **variables):
+        super().__init__(**variables)
+        self.lazy = lazy
+
+    def __missing__(self, name):
+        if name not in self.lazy:
+            raise KeyError(name)
+        value = self[name] = self.lazy.pop(name)()
+        return value
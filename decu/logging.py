@@ -5,10 +5,27 @@ logging.py
 Logging system setup for decu, specially, make multiprocessing and logging
 play nicely together.
 
+Each logfile is written by a single process: the one that set it up first,
+usually the one running decu exec. Worker processes do not write to the
+logfiles themselves. Instead, they format their records and send them in
+batches through a queue to a listener thread in the writing process, which
+writes each batch at once. A worker sends its batch when flush_records
+records are waiting, when a record of level flush_level or higher is
+logged, every flush_interval seconds (see section logging in decu.cfg), and
+at the end of each run. The records of each worker, and thus of each run,
+keep their order. Records of the writing process itself are written right
+away.
+
+A worker killed in the middle of sending a batch, as when a pool is
+terminated, leaves the queue unusable. Such pools start their next workers
+with a new queue and listener instead. See reset_queue.
+
 """
 
 import os
+import atexit
 import logging
+import threading
 from .config import config
 
 __all__ = ['DecuLogger']
@@ -22,6 +39,254 @@ __all__ = ['DecuLogger']
 # Formatters, et al) all live inside the global loggers dictionary, where
 # the keys are the logfiles. In this way we can safely pickle Scripts.
 loggers = {}
+loggers_lock = threading.Lock()
+
+# The FileHandler of each logfile, in the writing process. In worker
+# processes, the handler that sends the records of each logfile to the
+# writing process.
+file_handlers = {}
+batch_handlers = {}
+handlers_lock = threading.Lock()
+
+# The queue that carries the records of the workers to the listener, the
+# process that listens to it, and the process whose batches are sent on time.
+records = None
+listener_pid = None
+ticking_pid = None
+flush_events = {}
+
+
+def _formatter():
+    cfg = config['logging']
+    return logging.Formatter(cfg['log_fmt'], datefmt=cfg['time_fmt'])
+
+
+class _BatchHandler(logging.Handler):
+    """Handler that sends formatted records in batches, through a queue.
+
+    A batch is sent when it holds capacity records, when a record of level
+    flush_level or higher is added to it, and when the handler is flushed.
+
+    Args:
+        queue (multiprocessing.SimpleQueue): Where to send the batches.
+        logfile (str): The logfile the records are for.
+        capacity (int): Maximum number of records in a batch.
+        flush_level (int): Level of the records that are sent right away.
+
+    """
+    def __init__(self, queue, logfile, capacity, flush_level):
+        super().__init__(logging.INFO)
+        self.setFormatter(_formatter())
+        self.queue = queue
+        self.logfile = logfile
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.batch = []
+
+    def emit(self, record):
+        # Called by handle, with the lock of the handler held.
+        try:
+            self.batch.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.batch) >= self.capacity or \
+           record.levelno >= self.flush_level:
+            self._send()
+
+    def _send(self):
+        if self.batch:
+            self.queue.put((self.logfile, self.batch))
+            self.batch = []
+
+    def flush(self):
+        with self.lock:
+            self._send()
+
+
+def _batch_handler(logfile):
+    """Return the handler that sends the records of logfile, in a worker."""
+    global ticking_pid
+    with handlers_lock:
+        if logfile not in batch_handlers:
+            cfg = config['logging']
+            batch_handlers[logfile] = _BatchHandler(
+                records, logfile, int(cfg['flush_records']),
+                logging.getLevelName(cfg['flush_level']))
+            if ticking_pid != os.getpid():
+                ticking_pid = os.getpid()
+                threading.Thread(target=_tick, daemon=True, args=(
+                    float(cfg['flush_interval']),)).start()
+        return batch_handlers[logfile]
+
+
+def _file_handler(logfile):
+    """Return the FileHandler of logfile, creating it if necessary."""
+    with handlers_lock:
+        if logfile not in file_handlers:
+            handler = logging.FileHandler(logfile)
+            handler.setLevel(logging.INFO)
+            handler.setFormatter(_formatter())
+            file_handlers[logfile] = handler
+        return file_handlers[logfile]
+
+
+def _write(logfile, batch):
+    """Write a batch of formatted records to logfile, at once."""
+    handler = _file_handler(logfile)
+    with handler.lock:
+        handler.stream.write(''.join(
+            line + handler.terminator for line in batch))
+        handler.flush()
+
+
+def _listen(queue):
+    """Write the batches of records of the workers, until None arrives or
+    the queue is closed."""
+    while True:
+        try:
+            item = queue.get()
+        except (EOFError, OSError):
+            break
+        if item is None:
+            break
+        if isinstance(item, int):
+            # Every batch sent before this flush request has been written.
+            event = flush_events.pop(item, None)
+            if event is not None:
+                event.set()
+            continue
+        _write(*item)
+
+
+def _send_batches():
+    """Send the records held by the handlers of this worker process."""
+    with handlers_lock:
+        handlers = list(batch_handlers.values())
+    for handler in handlers:
+        handler.flush()
+
+
+def _tick(interval):
+    """Send the batches of this worker process every interval seconds."""
+    while True:
+        threading.Event().wait(interval)
+        _send_batches()
+
+
+def get_queue():
+    """Return the queue for the records of workers, listening to it.
+
+    Worker processes started by this process must send their records here.
+    See decu.parallel.
+
+    """
+    global records, listener_pid
+    if records is None:
+        from multiprocessing import SimpleQueue
+        # SimpleQueue sends each batch before put returns, so the records
+        # of a run reach the listener before the result of the run does.
+        # See DecuLogger.flush.
+        records = SimpleQueue()
+        listener_pid = os.getpid()
+        threading.Thread(target=_listen, args=(records,), daemon=True).start()
+    return records
+
+
+def reset_queue():
+    """Stop listening to the queue of the workers, and start a new one the
+    next time get_queue is called.
+
+    Call this after killing workers that were sending records, which may
+    have died holding the lock of the queue or halfway through a batch.
+
+    """
+    global records
+    if records is None or listener_pid != os.getpid():
+        return
+    old, records = records, None
+    # Without writers left, the listener stops at the end of the records
+    # sent so far, or in the middle of the batch that will never arrive.
+    old._writer.close()
+    for token in list(flush_events):
+        flush_events.pop(token).set()
+
+
+def init_worker(queue):
+    """Send the records of this worker process to queue.
+
+    Used as the initializer of worker processes, which do not inherit the
+    queue when they are not forked.
+
+    """
+    global records
+    records = queue
+
+
+def _forked():
+    """Forget the logging setup inherited by a new child process."""
+    loggers.clear()
+    file_handlers.clear()
+    batch_handlers.clear()
+    flush_events.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forked)
+else:
+    # Only the workers of multiprocessing forget the setup then.
+    from multiprocessing.util import register_after_fork
+    register_after_fork(_forked, lambda forked: forked())
+
+
+def _request(queue, token):
+    """Ask the listener of queue to set the flush event of token."""
+    try:
+        queue.put(token)
+    except OSError:
+        # The queue was closed by reset_queue, which set the event.
+        pass
+
+
+def flush():
+    """Write every record sent to the logfiles so far.
+
+    In a worker process, send the records held back instead. Records that
+    workers are still holding back are not written: call this after the
+    workers are done. Waits for at most flush_timeout seconds (see section
+    logging in decu.cfg) for the records to be written.
+
+    Returns:
+        bool: Whether the records were written in time.
+
+    """
+    if records is not None and listener_pid != os.getpid():
+        _send_batches()
+        return True
+    if records is not None:
+        event = threading.Event()
+        token = id(event)
+        flush_events[token] = event
+        # A worker that died while sending holds the lock of the queue for
+        # good, so the request is sent from another thread.
+        threading.Thread(target=_request, args=(records, token),
+                         daemon=True).start()
+        if not event.wait(float(config['logging']['flush_timeout'])):
+            flush_events.pop(token, None)
+            return False
+    for handler in list(file_handlers.values()):
+        handler.flush()
+    return True
+
+
+def _stop():
+    """Write the records left, and stop listening, at exit."""
+    if records is not None and listener_pid == os.getpid():
+        if flush():
+            records.put(None)
+
+
+atexit.register(_stop)
 
 
 class DecuLogger():
@@ -36,30 +301,74 @@ class DecuLogger():
                 'log_file', time=start_time, module_name=module))
         os.makedirs(os.path.dirname(logfile), exist_ok=True)
         self.logfile = logfile
+        self._logger()
+
+    def _logger(self):
+        """Return the Logger of this logfile, setting it up if needed.
+
+        Worker processes that were started before this DecuLogger was
+        created (see decu.parallel) do not inherit its Logger, so they
+        set up their own the first time they use it.
+
+        """
+        if self.logfile in loggers:
+            return loggers[self.logfile]
+        with loggers_lock:
+            if self.logfile not in loggers:
+                loggers[self.logfile] = self._setup()
+        return loggers[self.logfile]
 
-        logger = logging.getLogger(logfile)
+    def _setup(self):
+        """Return a new Logger that writes to the logfile.
+
+        In worker processes, the Logger sends its records to the writing
+        process instead. See the docstring of this module.
+
+        """
+        logger = logging.getLogger(self.logfile)
         logger.setLevel(logging.INFO)
-        handler = logging.FileHandler(logfile)
-        handler.setLevel(logging.INFO)
-        formatter = logging.Formatter(self.log_fmt, datefmt=self.time_fmt)
-        handler.setFormatter(formatter)
+        for handler in logger.handlers[:]:
+            # Inherited through fork.
+            logger.removeHandler(handler)
+        if records is not None and listener_pid != os.getpid():
+            handler = _batch_handler(self.logfile)
+        else:
+            handler = _file_handler(self.logfile)
         logger.addHandler(handler)
-        loggers[logfile] = logger
+        return logger
+
+    def flush(self):
+        """Write the records held back, or send them from a worker process.
+
+        Called by @experiment after each run, so that the records of a run
+        reach the writing process before its result does.
+
+        """
+        for handler in self._logger().handlers:
+            handler.flush()
+
+    def isEnabledFor(self, level):
+        """Whether records of this level would be written.
+
+        Callers can skip building expensive messages when it is False.
+
+        """
+        return self._logger().isEnabledFor(level)
 
     def log(self, level, msg):
-        loggers[self.logfile].log(level, msg)
+        self._logger().log(level, msg)
 
     def debug(self, msg):
-        loggers[self.logfile].debug(msg)
+        self._logger().debug(msg)
 
     def info(self, msg):
-        loggers[self.logfile].info(msg)
+        self._logger().info(msg)
 
     def warning(self, msg):
-        loggers[self.logfile].warning(msg)
+        self._logger().warning(msg)
 
     def error(self, msg):
-        loggers[self.logfile].error(msg)
+        self._logger().error(msg)
 
     def critical(self, msg):
-        loggers[self.logfile].critical(msg)
+        self._logger().critical(msg)
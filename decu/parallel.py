@@ -0,0 +1,529 @@
+"""
+parallel.py
+-----------
+
+Execution backends and worker pools shared by all the parallel runs of a
+decu process.
+
+Each backend is a callable that takes a number of workers and returns an
+object with the interface of multiprocessing.Pool. Starting a pool can be
+expensive, so run_parallel and its variants do not start a new one each
+time they are called. Instead, the pool of each backend is started the
+first time it is needed, reused by every later call, and shut down when
+decu exec finishes each script (or when the interpreter exits).
+
+Worker processes keep the config and sys.path of the moment they were
+started, so the pools of the copying_backends are started again when
+either has changed since.
+
+"""
+
+import os
+import sys
+import queue
+import atexit
+import shutil
+import threading
+from time import monotonic
+from itertools import starmap, count
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from .config import config
+
+__all__ = ['SerialPool', 'TimedOut', 'backends', 'get_pool', 'supervise',
+           'claim', 'shutdown']
+
+
+class SerialPool():
+    """Pool look-alike that runs every task in the calling thread.
+
+    Useful for debugging, since exceptions raised by the experiments
+    propagate with their original traceback, and debuggers work as usual.
+
+    """
+    def __init__(self, processes=None, maxtasksperchild=None):
+        pass
+
+    def map(self, func, iterable, chunksize=None):
+        return list(map(func, iterable))
+
+    def starmap(self, func, iterable, chunksize=None):
+        return list(starmap(func, iterable))
+
+    def imap(self, func, iterable, chunksize=1):
+        return map(func, iterable)
+
+    imap_unordered = imap
+
+    def apply_async(self, func, args=(), kwds={}, callback=None,
+                    error_callback=None):
+        try:
+            result = _SerialResult(func(*args, **kwds), True)
+        except Exception as exc:
+            result = _SerialResult(exc, False)
+            if error_callback is None:
+                raise
+            error_callback(exc)
+        else:
+            if callback is not None:
+                callback(result.value)
+        return result
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class _SerialResult():
+    """The interface of multiprocessing.pool.AsyncResult, already done."""
+
+    def __init__(self, value, ok):
+        self.value, self.ok = value, ok
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self.ok
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        if not self.ok:
+            raise self.value
+        return self.value
+
+
+def _coordinator(workers, max_tasks):
+    """Return a Coordinator for the workers of a cluster."""
+    from .cluster import Coordinator
+    return Coordinator(config['cluster']['address'])
+
+
+# Backends that run each task in a separate process. Arguments sent to
+# these backends are copied, so large arrays are better published once.
+# See decu.core.run_parallel.
+copying_backends = {'process'}
+
+
+def _init_worker(records, failures):
+    from . import logging, writer
+    logging.init_worker(records)
+    writer.init_worker(failures)
+
+
+def _process_pool(workers, max_tasks):
+    """Return a Pool whose workers send their log records, and the number
+    of results they fail to write, to this process."""
+    from .logging import get_queue
+    from .writer import get_failures
+    return Pool(workers, maxtasksperchild=max_tasks,
+                initializer=_init_worker,
+                initargs=(get_queue(), get_failures()))
+
+
+backends = {
+    'process': _process_pool,
+    'thread': lambda workers, max_tasks: ThreadPool(workers),
+    'serial': lambda workers, max_tasks: SerialPool(),
+    'cluster': _coordinator
+}
+
+pools = {}
+pools_pid = None
+
+# The config and sys.path the workers of each pool of the copying_backends
+# were started with.
+pool_states = {}
+
+
+def backend_name(backend=None):
+    """Return backend, or the default backend from the config."""
+    return backend or config['parallel']['backend']
+
+
+def num_workers():
+    """Return the number of workers set in the config, or the CPU count.
+
+    The DECU_WORKERS environment variable, set by `decu exec -j`, takes
+    precedence over the config.
+
+    """
+    workers = os.environ.get('DECU_WORKERS') or \
+        config['parallel']['workers']
+    return int(workers) if workers else os.cpu_count()
+
+
+def get_pool(backend=None):
+    """Return the pool of the backend, starting it if necessary.
+
+    Args:
+        backend (str): One of the keys of decu.parallel.backends. If None,
+            use the backend option of section parallel in the config.
+
+    """
+    global pools_pid
+    name = backend_name(backend)
+    if pools_pid != os.getpid():
+        # Pools inherited through fork belong to the parent process.
+        pools.clear()
+        pool_states.clear()
+        pools_pid = os.getpid()
+    state = _state() if name in copying_backends else None
+    if name in pools and pool_states.get(name) != state:
+        _stop(name)
+    if name not in pools:
+        max_tasks = config['parallel']['max_tasks_per_child']
+        pools[name] = backends[name](
+            num_workers(), int(max_tasks) if max_tasks else None)
+        pool_states[name] = state
+    return pools[name]
+
+
+def _state():
+    """Return what the workers of a copying backend copy when started."""
+    return tuple(sys.path), tuple(
+        (section, tuple(config.items(section, raw=True)))
+        for section in config.sections())
+
+
+def _stop(name):
+    """Wait for the pool of backend name to finish its tasks and stop it."""
+    pool = pools.pop(name)
+    pool_states.pop(name, None)
+    pool.close()
+    pool.join()
+
+
+def num_slots(backend=None):
+    """Return how many tasks the backend runs at the same time.
+
+    For the cluster backend, this is the number of workers connected to the
+    coordinator, or 1 if there are none yet, so it changes as workers come
+    and go.
+
+    """
+    name = backend_name(backend)
+    if name == 'serial':
+        return 1
+    if name == 'cluster':
+        pool = pools.get(name) if pools_pid == os.getpid() else None
+        return max(1, pool.workers if pool is not None else 0)
+    return num_workers()
+
+
+def max_pending(backend=None):
+    """Return how many tasks to hand to the backend ahead of the results."""
+    pending = config['parallel']['max_pending']
+    return int(pending) if pending else 2 * num_slots(backend)
+
+
+def restart(backend=None):
+    """Stop the pool of backend right away, and return a fresh one.
+
+    Only the pools of the copying_backends can be stopped in the middle of
+    a task. For the other backends, return None.
+
+    """
+    name = backend_name(backend)
+    if name not in copying_backends:
+        return None
+    pool = pools.pop(name, None)
+    pool_states.pop(name, None)
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+        from .logging import reset_queue
+        reset_queue()
+    return get_pool(name)
+
+
+class TimedOut():
+    """Result of a task abandoned by supervise.
+
+    Attributes:
+        elapsed (float): Seconds the task had been running when it was
+            abandoned, or None if it never started.
+
+    """
+    def __init__(self, elapsed=None):
+        self.elapsed = elapsed
+
+
+def _put(done, attempt, ok, value):
+    """Pool callback that reports the outcome of an attempt to supervise."""
+    done.put((attempt, ok, value))
+
+
+# The claim of the task run by each thread under supervise, if any.
+current = threading.local()
+
+# The directories of claims made by supervise whose tasks may still be
+# running. Abandoned copies of tasks may claim theirs after supervise
+# returns, so these are only removed once every pool is shut down.
+claim_dirs = []
+
+
+def _take(claim):
+    """Create the file claim, and return whether it did not exist yet."""
+    try:
+        os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    except FileNotFoundError:
+        # The directory of claims cannot be reached from here.
+        return True
+    return True
+
+
+def claim():
+    """Claim the outcome of the task this thread runs under supervise.
+
+    Every copy of a task run by supervise, and supervise itself when it
+    gives up on the task, try to claim its outcome, and only the first one
+    succeeds. Experiments claim theirs once they have their result, and
+    only write it if they succeed. See decu.core.experiment.
+
+    Returns:
+        bool: Whether the outcome is this thread's. Always True outside of
+        supervise.
+
+    """
+    path = getattr(current, 'claim', None)
+    if path is None:
+        return True
+    current.won = _take(path)
+    return current.won
+
+
+def _run_claimed(func, claim_file, arg):
+    """Call func(arg) with claim_file as the claim of this thread.
+
+    Return the pair (won, func(arg)), where won is whether this call
+    claimed the outcome of its task, before returning or through claim. If
+    claim_file is None, the outcome is not claimed, and won is True.
+
+    """
+    current.claim, current.won = claim_file, None
+    try:
+        value = func(arg)
+        won = current.won
+        if won is None:
+            won = claim_file is None or _take(claim_file)
+        return won, value
+    finally:
+        current.claim = current.won = None
+
+
+def supervise(pool, func, tasks, slots, timeout=None, deadline=None,
+              factor=None, speculate=False, notify=None, restart=None,
+              poll=0.05, claims=None):
+    """Run func over tasks in pool, keeping an eye on each of them.
+
+    Unlike the map methods of the pool, which wait for as long as it takes,
+    supervise keeps at most slots tasks running at the same time, and gives
+    up on those that run for too long.
+
+    A task that has been running for more than factor times the median time
+    of the tasks finished so far is a straggler. When speculate is True and
+    some worker is idle, a duplicate of the straggler is started on it, and
+    whichever copy claims the outcome of the task first wins. The other one
+    is abandoned. A task that is given up on is abandoned only if its
+    outcome can still be claimed; otherwise, its result is on its way and
+    is waited for. See claim.
+
+    Args:
+        pool (Pool): Where to run the tasks. Must have apply_async.
+        func (function): Called as func(arg) for each task.
+        tasks (iterable): The pairs (index, arg). Consumed lazily.
+        slots (int): Number of tasks running at the same time, or a
+            function that returns it, called whenever it is needed, for
+            backends whose number of workers changes.
+        timeout (float): Seconds after which a task is abandoned.
+        deadline (float): Seconds after which every unfinished task is
+            abandoned, including those not started yet.
+        factor (float): How much longer than the median a task must take to
+            be a straggler. If None, do not look for stragglers.
+        speculate (bool): Whether to start duplicates of the stragglers.
+        notify (function): Called as notify(event, index, arg, elapsed),
+            where event is 'timeout', 'straggler', 'duplicate' or
+            'deadline'. For 'deadline', index is the number of tasks
+            abandoned and arg is None.
+        restart (function): Called without arguments when every slot is
+            taken by an abandoned task that may never finish, and at the end
+            if any abandoned task is still running. Returns a fresh pool,
+            or None if the pool cannot be restarted.
+        poll (float): Seconds between checks of the running tasks.
+        claims (str): Directory, reachable by every worker, in which to
+            make a temporary directory where the copies of each task claim
+            its outcome. If None, outcomes are not claimed, so that
+            duplicates, and tasks given up on that still finish, keep
+            their results as well.
+
+    Yields:
+        tuple: The pair (index, func(arg)), or (index, TimedOut) if the task
+        was abandoned, for each task.
+
+    """
+    from statistics import median
+    notify = notify or (lambda *args: None)
+    done = queue.Queue()
+    tasks = iter(tasks)
+    attempts = {}       # attempt -> (index, arg, start)
+    running = {}        # index -> attempts of the task not yet abandoned
+    abandoned = set()   # attempts whose outcome is no longer wanted
+    flagged = set()     # indices already reported as stragglers
+    durations = []
+    ids = count()
+    end = None if deadline is None else monotonic() + deadline
+    exhausted = False
+    lost = 0            # workers taken by abandoned tasks for good
+
+    def capacity():
+        return (slots() if callable(slots) else slots) + lost
+
+    if claims is not None:
+        from tempfile import mkdtemp
+        os.makedirs(claims, exist_ok=True)
+        claims = mkdtemp(prefix='claims-', dir=claims)
+        claim_dirs.append(claims)
+
+    def claim_file(index):
+        return None if claims is None else os.path.join(claims, str(index))
+
+    def submit(index, arg):
+        attempt = next(ids)
+        attempts[attempt] = (index, arg, monotonic())
+        running.setdefault(index, []).append(attempt)
+        pool.apply_async(_run_claimed, (func, claim_file(index), arg),
+                         callback=partial(_put, done, attempt, True),
+                         error_callback=partial(_put, done, attempt, False))
+
+    def started(index):
+        return min(attempts[attempt][2] for attempt in running[index])
+
+    def give_up(index, now):
+        """Abandon the task index, unless some copy claimed it already."""
+        if claims is not None and not _take(claim_file(index)):
+            return None
+        elapsed = now - started(index)
+        abandoned.update(running.pop(index))
+        return elapsed
+
+    try:
+        while True:
+            # Abandoned attempts keep their worker busy until they finish.
+            if abandoned and len(abandoned) >= capacity() and \
+               len(abandoned) == len(attempts):
+                fresh = restart() if restart is not None else None
+                if fresh is not None:
+                    pool = fresh
+                    for attempt in abandoned:
+                        del attempts[attempt]
+                    abandoned.clear()
+                else:
+                    # The workers cannot be recovered: count them as lost.
+                    lost += 1
+
+            while not exhausted and len(attempts) < capacity():
+                try:
+                    index, arg = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                else:
+                    submit(index, arg)
+            if exhausted and not running:
+                return
+
+            try:
+                attempt, ok, value = done.get(timeout=poll)
+            except queue.Empty:
+                attempt = None
+            now = monotonic()
+
+            if attempt in attempts:
+                index, _, start = attempts.pop(attempt)
+                won, value = value if ok else (True, value)
+                if attempt in abandoned:
+                    abandoned.discard(attempt)
+                elif not won:
+                    # Another copy claimed the task, its result will come.
+                    running[index].remove(attempt)
+                else:
+                    running[index].remove(attempt)
+                    abandoned.update(running.pop(index))
+                    if not ok:
+                        raise value
+                    durations.append(now - start)
+                    yield index, value
+
+            if end is not None and now > end:
+                given_up = 0
+                for index in list(running):
+                    elapsed = give_up(index, now)
+                    if elapsed is not None:
+                        yield index, TimedOut(elapsed)
+                        given_up += 1
+                for index, _ in tasks:
+                    yield index, TimedOut()
+                    given_up += 1
+                exhausted = True
+                end = None
+                notify('deadline', given_up, None, deadline)
+                continue
+
+            for index in list(running):
+                elapsed = now - started(index)
+                arg = attempts[running[index][0]][1]
+                if timeout is not None and elapsed > timeout:
+                    if give_up(index, now) is not None:
+                        notify('timeout', index, arg, elapsed)
+                        yield index, TimedOut(elapsed)
+                elif factor is not None and durations and \
+                        elapsed > factor * median(durations):
+                    if index not in flagged:
+                        flagged.add(index)
+                        notify('straggler', index, arg, elapsed)
+                    if speculate and len(running[index]) == 1 and \
+                       len(attempts) < capacity():
+                        submit(index, arg)
+                        notify('duplicate', index, arg, elapsed)
+    finally:
+        stopped = False
+        if abandoned and restart is not None:
+            # Do not leave hung tasks behind in a pool that is reused.
+            stopped = restart() is not None
+        if claims is not None and (stopped or not attempts):
+            # No copy of any task is left to claim it.
+            claim_dirs.remove(claims)
+            shutil.rmtree(claims, ignore_errors=True)
+
+
+def shutdown(names=None):
+    """Wait for the pools to finish their pending tasks and stop them.
+
+    Args:
+        names (iterable): The backends whose pools to stop. If None, stop
+            every pool.
+
+    """
+    if pools_pid != os.getpid():
+        # Pools inherited through fork belong to the parent process.
+        pools.clear()
+        pool_states.clear()
+        return
+    for name in [name for name in pools if names is None or name in names]:
+        _stop(name)
+    if not pools:
+        while claim_dirs:
+            shutil.rmtree(claim_dirs.pop(), ignore_errors=True)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,123 @@
+"""
+runs.py
+-------
+
+Allocation of run identifiers for @experiment-decorated methods.
+
+"""
+
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['RunAllocator', 'next_run', 'next_runs']
+
+
+# RunAllocator objects of this process, keyed by their counter file.
+allocators = {}
+
+
+class RunAllocator():
+    """Hand out unique run identifiers for one experiment.
+
+    The highest identifier reserved so far is kept in a counter file. Each
+    process reserves identifiers from the file in blocks of block_size, and
+    hands them out without any further inter-process communication. The
+    file is locked while a block is being reserved, so that processes (or
+    hosts sharing the file system) never reserve the same block. As a
+    consequence, identifiers are unique across concurrent invocations, but
+    they are not necessarily consecutive.
+
+    Args:
+        filename (str): The counter file.
+        block_size (int): How many identifiers to reserve at a time.
+
+    """
+    def __init__(self, filename, block_size):
+        self.filename = filename
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next_id = self.end_id = 0
+        if not hasattr(os, 'register_at_fork'):
+            from multiprocessing.util import register_after_fork
+            register_after_fork(self, RunAllocator.forget)
+
+    def _take(self, size):
+        """Take size identifiers from the counter file, and return the
+        first one."""
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            start = int(os.read(fd, 32) or 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, str(start + size).encode())
+        finally:
+            os.close(fd)
+        return start
+
+    def reserve(self):
+        """Reserve the next block of identifiers from the counter file."""
+        start = self._take(self.block_size)
+        self.next_id, self.end_id = start, start + self.block_size
+
+    def next(self):
+        """Return a run identifier that has not been handed out before."""
+        with self.lock:
+            if self.next_id >= self.end_id:
+                self.reserve()
+            run = self.next_id
+            self.next_id += 1
+            return run
+
+    def next_range(self, count):
+        """Return a range of count consecutive run identifiers that have not
+        been handed out before.
+
+        They come from the current block if it has enough of them left, and
+        otherwise from a block of their own.
+
+        """
+        with self.lock:
+            if self.end_id - self.next_id >= count:
+                start = self.next_id
+                self.next_id += count
+            else:
+                start = self._take(count)
+            return range(start, start + count)
+
+    def forget(self):
+        """Drop the current block, e.g., after it was inherited by fork."""
+        self.lock = threading.Lock()
+        self.next_id = self.end_id = 0
+
+
+def _after_fork():
+    """The blocks reserved by the parent process are not ours to use."""
+    for alloc in allocators.values():
+        alloc.forget()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _allocator(filename, block_size):
+    if filename not in allocators:
+        allocators[filename] = RunAllocator(filename, block_size)
+    return allocators[filename]
+
+
+def next_run(filename, block_size):
+    """Return the next run identifier from the counter file filename."""
+    return _allocator(filename, block_size).next()
+
+
+def next_runs(filename, block_size, count):
+    """Return a range of count consecutive run identifiers from filename."""
+    return _allocator(filename, block_size).next_range(count)
@@ -0,0 +1,99 @@
+"""
+shared.py
+---------
+
+Helpers shared by the modules of decu that keep files, connections or
+threads open in each process, such as the stores of decu.store, the
+catalogs of decu.catalog and the background writer of decu.writer.
+
+"""
+
+import os
+import sqlite3
+from time import sleep, monotonic
+from multiprocessing.util import Finalize
+
+__all__ = ['PerProcess', 'plain', 'connect']
+
+
+class PerProcess():
+    """The objects of some kind that belong to this process, by key.
+
+    Each object is made the first time it is asked for. Objects inherited
+    from the parent process through fork may hold its connections or
+    threads, so a child process makes its own instead. The objects are
+    closed when the process exits, worker processes included, which do
+    not run atexit handlers, only finalizers.
+
+    Args:
+        make (function): Called as make(key) to make the object of key.
+        close (function): Called as close(obj) on each object at exit. If
+            None, the objects are left as they are.
+        priority (int): Objects with a higher priority are closed first.
+
+    """
+    def __init__(self, make, close=None, priority=5):
+        self.make = make
+        self.close_one = close
+        self.priority = priority
+        self.objects = {}
+        self.pid = None
+
+    def get(self, key=None):
+        """Return the object of key, making it if necessary."""
+        if self.pid != os.getpid():
+            self.objects.clear()
+            self.pid = os.getpid()
+            if self.close_one is not None:
+                Finalize(None, self.close, exitpriority=self.priority)
+        if key not in self.objects:
+            self.objects[key] = self.make(key)
+        return self.objects[key]
+
+    def find(self, key=None):
+        """Return the object of key, or None if this process has not made
+        it."""
+        if self.pid != os.getpid():
+            return None
+        return self.objects.get(key)
+
+    def close(self):
+        """Close every object of this process."""
+        if self.pid == os.getpid() and self.close_one is not None:
+            for obj in list(self.objects.values()):
+                self.close_one(obj)
+
+
+def plain(value):
+    """Return value as JSON can hold it, for the default of json.dumps.
+
+    numpy scalars and arrays become Python scalars and lists, and anything
+    else a string.
+
+    """
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+def connect(filename, setup, timeout=60):
+    """Return a WAL connection to the SQLite file filename, after running
+    the SQL script setup on it.
+
+    Processes that open a new file at the same time may find it locked
+    while setting it up, even with a busy timeout, so the setup is retried
+    for up to timeout seconds.
+
+    """
+    deadline = monotonic() + timeout
+    while True:
+        connection = sqlite3.connect(filename, timeout=timeout,
+                                     check_same_thread=False)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(setup)
+            return connection
+        except sqlite3.OperationalError as exc:
+            connection.close()
+            if 'locked' not in str(exc) or monotonic() > deadline:
+                raise
+            sleep(0.05)
@@ -0,0 +1,131 @@
+"""
+store.py
+--------
+
+Consolidated storage of the results of many runs in a single file.
+
+By default, every run of an experiment writes its own result file. With
+store = sqlite in section io of decu.cfg, the runs of each experiment in
+each invocation of a script go instead to one SQLite file in results_dir,
+named after the store_file option of section Script. Each row holds the
+run identifier, the parameters, the elapsed time and the pickled result of
+one run. A single result is read back with
+
+    decu.io.read('path/to/store.sqlite#run')
+
+or decu.io.read('path/to/store.sqlite', run=run), and all of them at once
+with decu.io.read('path/to/store.sqlite').
+
+"""
+
+import json
+import pickle
+import threading
+from .shared import PerProcess, plain, connect
+
+__all__ = ['ResultStore', 'get_store', 'address']
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS runs (
+    run TEXT PRIMARY KEY,
+    params TEXT,
+    elapsed REAL,
+    result BLOB
+)'''
+
+
+def address(filename, run):
+    """Return the name of the result of run in the store filename."""
+    return '{}#{}'.format(filename, run)
+
+
+class ResultStore():
+    """SQLite file of results, addressed by their run identifier.
+
+    Several threads and processes can add results to the same store at the
+    same time. Results are kept in the order they were added.
+
+    Args:
+        filename (str): The file of the store. It is created if necessary.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        """Return the connection to the file, opening it if necessary."""
+        if self.connection is None:
+            self.connection = connect(self.filename, SCHEMA)
+        return self.connection
+
+    def _query(self, sql, args=()):
+        """Return all the rows returned by sql."""
+        with self.lock:
+            return self._connect().execute(sql, args).fetchall()
+
+    def put(self, run, params, elapsed, result):
+        """Add the result of run, and return its address.
+
+        Args:
+            run (int): The run identifier.
+            params (dict): The parameters of the run. numpy values are
+                stored as Python ones, and those that cannot be stored as
+                JSON as strings.
+            elapsed (float): Seconds the run took, or None.
+            result (object): The result. Must be picklable.
+
+        Returns:
+            str: The address of the result, to give to decu.io.read.
+
+        """
+        row = (str(run), json.dumps(params, default=plain), elapsed,
+               pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)', row)
+        return address(self.filename, run)
+
+    def get(self, run):
+        """Return the result of run. Raise KeyError if there is none."""
+        rows = self._query('SELECT result FROM runs WHERE run = ?',
+                           (str(run),))
+        if not rows:
+            raise KeyError('no run {} in {}'.format(run, self.filename))
+        return pickle.loads(rows[0][0])
+
+    def runs(self):
+        """Return the run identifiers in the store, in order."""
+        return [run for run, in self._query(
+            'SELECT run FROM runs ORDER BY rowid')]
+
+    def info(self, run):
+        """Return the parameters and elapsed time of run, as a pair."""
+        rows = self._query('SELECT params, elapsed FROM runs WHERE run = ?',
+                           (str(run),))
+        if not rows:
+            raise KeyError('no run {} in {}'.format(run, self.filename))
+        return json.loads(rows[0][0]), rows[0][1]
+
+    def load(self):
+        """Return a dict of every run identifier and its result, in order."""
+        return {run: pickle.loads(result) for run, result in self._query(
+            'SELECT run, result FROM runs ORDER BY rowid')}
+
+    def close(self):
+        """Close the connection to the file, if open."""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+# ResultStore objects of this process, keyed by their file.
+stores = PerProcess(ResultStore, ResultStore.close)
+
+
+def get_store(filename):
+    """Return the ResultStore of this process for filename."""
+    return stores.get(filename)
@@ -0,0 +1,140 @@
+"""
+sweep.py
+--------
+
+Lazy parameter sweeps for run_parallel.
+
+A sweep is an iterable of parameter sets, like the params argument of
+run_parallel, that builds each parameter set only when it is needed. Its
+length is known in advance, so that the size of a sweep can be reported
+without materializing it. For example,
+
+    params = grid(data=[data], exponent=range(10), bias=range(1000))
+    run_parallel(script.experiment, params)
+
+calls script.experiment(data, exponent, bias) with every combination of
+exponent and bias, while holding only a few of the 10000 parameter sets in
+memory at any time. The order of the keyword arguments is the order of the
+parameters in each set.
+
+"""
+
+from itertools import product
+from functools import reduce
+from operator import mul
+from random import Random
+from .core import DecuException
+
+__all__ = ['Sweep', 'grid', 'zip_axes', 'random']
+
+
+class Sweep():
+    """Iterable of parameter sets of known length.
+
+    Each iteration over a sweep generates the same parameter sets, in the
+    same order.
+
+    Args:
+        names (tuple): The name of each parameter, in order.
+        size (int): The number of parameter sets.
+        generate (function): Called without arguments, returns a new
+            iterator over the parameter sets.
+
+    """
+    def __init__(self, names, size, generate):
+        self.names = tuple(names)
+        self.size = size
+        self.generate = generate
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return self.generate()
+
+    def __repr__(self):
+        return '<Sweep of {} over {}>'.format(self.size, ', '.join(self.names))
+
+
+def _axes(axes):
+    """Return the names and the values of axes, which must be sized."""
+    for name, values in axes.items():
+        if not hasattr(values, '__len__'):
+            raise DecuException('axis {} of a sweep must have a length, '
+                                'e.g., be a list or a range'.format(name))
+    return tuple(axes), tuple(axes.values())
+
+
+def grid(**axes):
+    """Return the sweep over every combination of the values of the axes.
+
+    Args:
+        axes (dict): The values of each parameter. Each value must be a
+            sequence, such as a list, a range or a 1-dimensional array.
+
+    Returns:
+        Sweep: The cartesian product of the axes. The last axis varies the
+        fastest.
+
+    """
+    names, values = _axes(axes)
+    size = reduce(mul, map(len, values), 1)
+    return Sweep(names, size, lambda: product(*values))
+
+
+def zip_axes(**axes):
+    """Return the sweep over the i-th value of every axis, for each i.
+
+    Args:
+        axes (dict): The values of each parameter. All values must be
+            sequences of the same length.
+
+    Returns:
+        Sweep: The axes zipped together.
+
+    """
+    names, values = _axes(axes)
+    sizes = set(map(len, values))
+    if len(sizes) > 1:
+        raise DecuException('the axes of zip_axes must have the same length')
+    return Sweep(names, sizes.pop() if sizes else 0, lambda: zip(*values))
+
+
+def _sampler(dist):
+    """Return the function that draws a value from dist with an rng."""
+    if callable(dist):
+        return dist
+    if hasattr(dist, '__len__'):
+        return lambda rng: rng.choice(dist)
+    raise DecuException('distributions of random must be callables or '
+                        'sequences, not {!r}'.format(dist))
+
+
+def random(n, seed=None, **dists):
+    """Return the sweep over n parameter sets drawn at random.
+
+    Args:
+        n (int): The number of parameter sets.
+        seed (int): Seed of the random number generator. If None, pick one
+            at random. Either way, every iteration over the returned sweep
+            yields the same parameter sets.
+        dists (dict): The distribution of each parameter. Each one is either
+            a callable that takes a random.Random object and returns a
+            value, e.g., `lambda rng: rng.uniform(0, 1)`, or a sequence of
+            values to choose from uniformly.
+
+    Returns:
+        Sweep: The random parameter sets.
+
+    """
+    names = tuple(dists)
+    samplers = [_sampler(dist) for dist in dists.values()]
+    if seed is None:
+        seed = Random().getrandbits(64)
+
+    def generate():
+        rng = Random(seed)
+        for _ in range(n):
+            yield tuple(sample(rng) for sample in samplers)
+
+    return Sweep(names, n, generate)
@@ -0,0 +1,181 @@
+"""
+writer.py
+---------
+
+Background writing of experiment results.
+
+When the background option of section io in decu.cfg is set, experiments
+hand their results to the BackgroundWriter of their process and return
+right away, instead of waiting for the result to be written to disk. The
+writer holds at most max_pending_writes results at a time: experiments
+that produce results faster than they can be written wait for room in the
+queue, so memory stays bounded.
+
+Queued results are written before decu exec finishes, before worker
+processes exit, and when the interpreter exits. Since the result is
+written after the experiment returns, experiments must not modify a
+result after returning it. A result that fails to be written leaves no
+file behind, and the results that the workers of a process fail to write
+are counted in that process. See worker_failures.
+
+"""
+
+import os
+import queue
+import atexit
+import threading
+from multiprocessing import Value
+from .io import write, make_fullname
+from .config import config
+from .shared import PerProcess
+
+__all__ = ['BackgroundWriter', 'get_writer', 'flush', 'worker_failures']
+
+
+class BackgroundWriter():
+    """Bounded queue of results, written to disk by a pool of threads.
+
+    Args:
+        threads (int): Number of writer threads.
+        max_pending (int): Maximum number of results waiting to be written.
+            Submitting a result blocks while the queue is full.
+
+    """
+    def __init__(self, threads, max_pending):
+        self.queue = queue.Queue(max_pending)
+        self.errors = []
+        self.lock = threading.Lock()
+        for _ in range(threads):
+            threading.Thread(target=self._drain, daemon=True).start()
+
+    def submit(self, result, basename, done=None):
+        """Queue result to be written as with decu.io.write.
+
+        Args:
+            result (object): The result to write.
+            basename (str): The name of the file, without extension.
+            done (function): Called by a writer thread as done(filename,
+                error) after the write, where filename is the name of the
+                written file, or None if writing raised the exception
+                error.
+
+        """
+        self.queue.put((result, basename, done))
+
+    def _drain(self):
+        """Write the queued results, forever."""
+        while True:
+            result, basename, done = self.queue.get()
+            try:
+                try:
+                    filename, error = write(result, basename), None
+                except Exception as exc:
+                    filename, error = None, exc
+                    self._record(exc)
+                    _remove_partial(result, basename)
+                if done is not None:
+                    done(filename, error)
+            except Exception as exc:
+                self._record(exc)
+            finally:
+                self.queue.task_done()
+
+    def _record(self, error):
+        with self.lock:
+            self.errors.append(error)
+
+    def flush(self):
+        """Wait until every queued result is written.
+
+        Returns:
+            list: The exceptions raised while writing since the last flush.
+
+        """
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+
+def _remove_partial(result, basename):
+    """Delete what a failed write of result left on disk, if anything."""
+    try:
+        filename = make_fullname(basename, type(result))
+    except Exception:
+        # There is no format for result, so nothing was written.
+        return
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def _make_writer(key):
+    cfg = config['io']
+    return BackgroundWriter(int(cfg['writer_threads']),
+                            int(cfg['max_pending_writes']))
+
+
+# The BackgroundWriter of this process. Pending results are written before
+# the stores and catalogs they go to are closed.
+writers = PerProcess(_make_writer, lambda writer: flush(), priority=10)
+
+# How many results the workers of this process failed to write, shared
+# with them, and the one of the process that started this worker process.
+counters = PerProcess(lambda key: Value('i', 0))
+parent_failures = None
+
+
+def get_writer():
+    """Return the BackgroundWriter of this process, starting it if needed."""
+    return writers.get()
+
+
+def flush():
+    """Wait for the writer of this process, if any, to write everything.
+
+    Returns:
+        list: The exceptions raised while writing since the last flush.
+
+    """
+    writer = writers.find()
+    if writer is None:
+        return []
+    errors = writer.flush()
+    if errors and parent_failures is not None:
+        with parent_failures.get_lock():
+            parent_failures.value += len(errors)
+    return errors
+
+
+def get_failures():
+    """Return the counter of failed writes for the workers of this process.
+
+    Worker processes started by this process must count their failures
+    here. See decu.parallel.
+
+    """
+    return counters.get()
+
+
+def init_worker(counter):
+    """Count the failed writes of this worker process in counter."""
+    global parent_failures
+    parent_failures = counter
+
+
+def worker_failures():
+    """Return how many results the workers of this process failed to write
+    since the last call.
+
+    Workers write their pending results before they exit, so call this
+    once they have been shut down. See decu.parallel.shutdown.
+
+    """
+    failures = counters.find()
+    if failures is None:
+        return 0
+    with failures.get_lock():
+        count, failures.value = failures.value, 0
+    return count
+
+
+atexit.register(flush)
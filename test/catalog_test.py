@@ -0,0 +1,101 @@
+"""
+catalog_test.py
+---------------
+
+Tests for the catalog of results and figures.
+
+"""
+
+import os
+import pytest
+from os.path import join, dirname
+import util
+import numpy as np
+import matplotlib.pyplot as plt
+from decu import experiment, figure, config
+from decu.catalog import get_catalog, reindex
+
+
+class CatalogScript(util.TestScript):
+    @experiment(data_param='data')
+    def exp(self, data, param, other=0):
+        return data * param + other
+
+    @figure()
+    def plot(self, scale):
+        plt.figure()
+        plt.plot(range(10), [scale * x for x in range(10)])
+
+
+@pytest.fixture(autouse=True)
+def catalog_on():
+    """Record the files written by the tests in the catalog."""
+    previous = config['io']['catalog']
+    config['io']['catalog'] = 'yes'
+    yield
+    config['io']['catalog'] = previous
+
+
+def catalog_of(script):
+    return get_catalog(join(script.state_dir,
+                            config['Script']['catalog_file']))
+
+
+def test_catalog(tmpdir):
+    """Every result and figure written should be found in the catalog."""
+    script = CatalogScript(tmpdir)
+    data = np.arange(10)
+    for param in np.arange(3):
+        script.exp(data, param, other=param % 2)
+    script.plot(2)
+
+    catalog = catalog_of(script)
+    results = catalog.find(name='exp')
+    assert [entry['run'] for entry in results] == ['0', '1', '2']
+    assert all(os.path.exists(entry['path']) for entry in results)
+    assert results[0]['type'] == 'npy'
+    assert results[0]['size'] == os.path.getsize(results[0]['path'])
+    assert results[0]['module'] == script.module
+    assert results[0]['elapsed'] >= 0
+
+    found = catalog.find(name='exp', param=2)
+    assert len(found) == 1 and found[0]['params'] == {'param': 2, 'other': 0}
+    assert len(catalog.find(other=1)) == 1
+    assert catalog.find(name='exp', param=5) == []
+    figures = catalog.find(kind='figure')
+    assert len(figures) == 1 and figures[0]['params'] == {'scale': 2}
+
+
+def test_catalog_off(tmpdir):
+    """Nothing should be recorded unless the catalog option is set."""
+    config['io']['catalog'] = 'no'
+    script = CatalogScript(tmpdir)
+    script.exp(np.arange(10), 1)
+    assert not os.path.exists(join(script.state_dir,
+                                   config['Script']['catalog_file']))
+
+
+def test_reindex(tmpdir):
+    """reindex should rebuild the catalog from the files and logs."""
+    script = CatalogScript(tmpdir)
+    data = np.arange(10)
+    for param in range(3):
+        script.exp(data, param)
+    script.plot(1)
+    catalog = catalog_of(script)
+    before = catalog.find()
+
+    catalog.clear()
+    assert catalog.find() == []
+    count = reindex(catalog, script.results_dir, script.figures_dir,
+                    dirname(script.log.logfile))
+    after = catalog.find()
+    assert count == len(after) == 4
+    key = lambda entry: entry['path']
+    for old, new in zip(sorted(before, key=key), sorted(after, key=key)):
+        if old['kind'] == 'result':
+            assert new['params'] == old['params']
+            assert abs(new['elapsed'] - old['elapsed']) < 1e-4
+        for column in ['kind', 'time', 'module', 'name', 'run', 'size',
+                       'type']:
+            assert new[column] == old[column]
@@ -0,0 +1,131 @@
+"""
+cluster_test.py
+---------------
+
+Test running experiments on a coordinator with workers on localhost.
+
+"""
+
+import os
+import signal
+import pytest
+from multiprocessing import Process
+from decu import config, experiment, run_parallel, parallel
+from decu.cluster import work
+import util
+
+
+# These classes are outside of the test functions because they need to be
+# pickled to be sent to the workers.
+class MyTestCluster(util.TestScript):
+    @experiment(data_param='data')
+    def exp(self, data, param):
+        return data**param
+
+
+class MyTestDeadWorker(util.TestScript):
+    @experiment(data_param='marker')
+    def exp(self, marker, param, how):
+        if param == 3 and not os.path.exists(marker):
+            open(marker, 'w+').close()
+            if how == 'exit':
+                os._exit(1)
+            os.kill(os.getpid(), signal.SIGSTOP)
+        return param
+
+
+class MyTestSlowCluster(util.TestScript):
+    @experiment()
+    def exp(self, param):
+        from time import sleep
+        sleep(0.5)
+        return param
+
+
+@pytest.fixture
+def cluster_config():
+    """Set the options of section cluster for a test, and restore them."""
+    options = {'address': 'localhost:0', 'authkey': 'test',
+               'heartbeat': '0.2', 'heartbeat_timeout': '2'}
+    previous = {name: config['cluster'][name] for name in options}
+    for name, value in options.items():
+        config.set('cluster', name, value)
+    yield
+    for name, value in previous.items():
+        config.set('cluster', name, value)
+
+
+@pytest.fixture
+def cluster(cluster_config):
+    """Start a coordinator on a free port and three workers."""
+    address = parallel.get_pool('cluster').address
+    workers = [Process(target=work, args=(address,)) for _ in range(3)]
+    for proc in workers:
+        proc.start()
+    yield workers
+    parallel.shutdown()
+    for proc in workers:
+        if proc.is_alive():
+            os.kill(proc.pid, signal.SIGKILL)
+        proc.join()
+
+
+def test_results(tmpdir, cluster):
+    """Results from the cluster should come back in order."""
+    script = MyTestCluster(tmpdir)
+    params = [(2, p) for p in range(20)]
+    assert run_parallel(script.exp, params, backend='cluster') == \
+        [2**p for p in range(20)]
+    assert len(os.listdir(script.results_dir)) == 20
+
+
+def test_sweep_uses_workers(tmpdir, cluster):
+    """Lazy sweeps should keep every connected worker busy, however many
+    workers the coordinator has locally."""
+    from time import sleep, monotonic
+    script = MyTestSlowCluster(tmpdir)
+    coordinator = parallel.get_pool('cluster')
+    while coordinator.workers < 3:
+        sleep(0.05)
+    workers = config['parallel']['workers']
+    config['parallel']['workers'] = '1'
+    try:
+        start = monotonic()
+        results = run_parallel(script.exp, ((p,) for p in range(9)),
+                               backend='cluster')
+        elapsed = monotonic() - start
+    finally:
+        config['parallel']['workers'] = workers
+    assert results == list(range(9))
+    # Three rounds of three tasks, instead of five rounds of two.
+    assert elapsed < 2.1
+
+
+@pytest.mark.parametrize('how', ['exit', 'stop'])
+def test_dead_worker(tmpdir, cluster, how):
+    """Tasks of dead or unresponsive workers should be requeued."""
+    script = MyTestDeadWorker(tmpdir)
+    marker = str(tmpdir.join('marker'))
+    params = [(marker, p, how) for p in range(6)]
+    assert run_parallel(script.exp, params, backend='cluster') == \
+        list(range(6))
+    assert os.path.exists(marker)
+
+
+def test_no_authkey(cluster_config, monkeypatch):
+    """Neither the coordinator nor the workers should start without a
+    secret key."""
+    from subprocess import run
+    from decu import DecuException
+    from decu.cluster import Coordinator
+    monkeypatch.delenv('DECU_AUTHKEY', raising=False)
+    config.set('cluster', 'authkey', '')
+    with pytest.raises(DecuException):
+        Coordinator('localhost:0')
+    with pytest.raises(DecuException):
+        work('localhost:1', retry=0)
+    env = {key: value for key, value in os.environ.items()
+           if key != 'DECU_AUTHKEY'}
+    process = run(['decu', 'worker', '--connect', 'localhost:1'], env=env,
+                  cwd=os.path.dirname(__file__) or '.')
+    assert process.returncode != 0
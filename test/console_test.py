@@ -120,3 +120,58 @@ def test_inspect_c_flag():
 
     os.remove(decu.io.make_fullname('array', type(arr)))
     os.remove(decu.io.make_fullname('array2', type(arr)))
+
+
+def test_inspect_lazy(tmpdir):
+    """`decu inspect --lazy` should read only the files that are used."""
+    import numpy as np
+    arrays = [np.random.random(size=10) for _ in range(3)]
+    files = [decu.io.write(arr, str(tmpdir.join('array{}'.format(index))))
+             for index, arr in enumerate(arrays)]
+    extra = decu.io.write({'a': 1}, str(tmpdir.join('extra')))
+    out = str(tmpdir.join('out'))
+
+    command = ('decu.io.write({{"n": len(result), "read": len(result.loaded), '
+               '"sum": float(result[1].sum()), "a": extra["a"]}}, "{}")')
+    exit_code = check_call(['decu', 'inspect', '--lazy', '-c',
+                            command.format(out)] + files +
+                           ['--extra', extra])
+    assert exit_code == 0
+    found = decu.io.read(out + '.json')
+    assert found == {'n': 3, 'read': 0, 'sum': arrays[1].sum(), 'a': 1}
+
+    # Variables that are not used are never read.
+    assert main.inspect(files[:1], command='pass', lazy=True,
+                        missing='no_such_file.npy') == 0
+
+
+SCRIPT_WITH_WORKERS = '''
+import decu
+
+
+class {name}(decu.Script):
+    @decu.experiment()
+    def exp(self, param):
+        return param * {factor}
+
+    def main(self):
+        results = decu.run_parallel(self.exp, [(1,), (2,)],
+                                    backend='process')
+        assert results == [{factor}, {factor2}], results
+'''
+
+
+def test_exec_scripts_in_different_dirs(tmpdir):
+    """The workers of each script should be able to import it, even when
+    an earlier script in another directory already used workers."""
+    from subprocess import run
+    files = []
+    for name, factor in [('script_a', 2), ('script_b', 3)]:
+        directory = tmpdir.mkdir(name[-1]).mkdir('src')
+        filename = directory.join(name + '.py')
+        filename.write(SCRIPT_WITH_WORKERS.format(
+            name=name.title().replace('_', ''), factor=factor,
+            factor2=2 * factor))
+        files.append(str(filename))
+    process = run(['decu', 'exec'] + files, cwd=str(tmpdir), timeout=120)
+    assert process.returncode == 0
@@ -10,7 +10,7 @@ from os import listdir
 from os.path import basename
 import util
 import numpy as np
-from decu import experiment, config
+from decu import experiment, config, run_parallel
 from decu.io import make_fullname
 
 
@@ -83,3 +83,202 @@ def test_no_result(tmpdir):
     msg = config['experiment'].subs('no_result_msg', exp_name='exp', run=0)
     assert line == '%(levelname)s: %(message)s' % \
         {'levelname': 'WARNING', 'message': msg}
+
+
+def test_async(tmpdir):
+    """Asynchronous experiments should run concurrently up to a limit."""
+    import asyncio
+    from decu import gather_experiments
+    running = []
+
+    class TestAsync(util.TestScript):
+        @experiment(data_param='data')
+        async def exp(self, data, param):
+            running.append(1)
+            assert len(running) <= 2
+            await asyncio.sleep(0.01)
+            running.pop()
+            return data * param
+
+    script = TestAsync(tmpdir)
+    params = [(3, p) for p in range(6)]
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(
+            gather_experiments(script.exp, params, limit=2))
+    finally:
+        loop.close()
+    assert results == [3 * p for p in range(6)]
+    assert len(listdir(script.results_dir)) == 6
+    with open(script.log.logfile) as file:
+        assert sum('Finished exp' in line for line in file) == 6
+
+
+def test_cache(tmpdir):
+    """Experiments with cache=True should not run twice on the same input."""
+    calls = []
+
+    class TestCache(util.TestScript):
+        @experiment(data_param='data', cache=True)
+        def exp(self, data, param):
+            calls.append(param)
+            return np.power(data, param)
+
+    script = TestCache(tmpdir)
+    script.cache_dir = str(tmpdir.join('cache'))
+    data = np.arange(100)
+    first = script.exp(data, 2)
+    second = script.exp(data, 2)
+    script.exp(data + 1, 2)
+    assert calls == [2, 2]
+    assert (first == second).all()
+    assert len(listdir(script.results_dir)) == 3
+    assert TestCache.exp.cache_hits == 1
+    assert TestCache.exp.cache_misses == 2
+
+
+def test_cache_eviction(tmpdir):
+    """The cache should evict the least recently used results."""
+    from decu.cache import ResultCache
+    cache = ResultCache(str(tmpdir.join('cache')), 250)
+    for key in 'abc':
+        filename = str(tmpdir.join(key + '.txt'))
+        with open(filename, 'w+') as file:
+            file.write('x' * 100)
+        cache.put(key, filename)
+    assert sorted(listdir(cache.cache_dir)) == ['b', 'b.entry', 'c',
+                                                'c.entry']
+    out = str(tmpdir.join('out'))
+    assert cache.get('a', out) is None
+    assert cache.get('b', out) == out + '.txt'
+    # Another process sees the same results, and evicts c now.
+    other = ResultCache(cache.cache_dir, 250)
+    filename = str(tmpdir.join('d.txt'))
+    with open(filename, 'w+') as file:
+        file.write('x' * 100)
+    other.put('d', filename)
+    assert sorted(listdir(cache.cache_dir)) == ['b', 'b.entry', 'd',
+                                                'd.entry']
+
+
+def test_batch(tmpdir):
+    """Batch experiments should keep track of each run in the batch."""
+    class TestBatch(util.TestScript):
+        @experiment(data_param='data', batch=True)
+        def exp(self, data, param, param2):
+            return np.power(data, param[:, None]) + param2[:, None]
+
+    script = TestBatch(tmpdir)
+    data = np.arange(5)
+    result = script.exp(data, np.arange(3), param2=np.arange(3, 6))
+    assert result.shape == (3, 5)
+    assert script.exp.run == [0, 1, 2]
+    files = sorted(listdir(script.results_dir))
+    assert len(files) == 3
+    assert np.array_equal(decu_read(script.results_dir, files[2]),
+                          data**2 + 5)
+    with open(script.log.logfile) as file:
+        log = file.read()
+    assert 'a batch of 3 runs' in log
+    assert sum('Wrote results of exp--' in line
+               for line in log.splitlines()) == 3
+
+    option = config['experiment']['batch_output']
+    config['experiment']['batch_output'] = 'one'
+    try:
+        script.exp(data, np.arange(4), np.arange(4))
+    finally:
+        config['experiment']['batch_output'] = option
+    files = sorted(set(listdir(script.results_dir)) - set(files))
+    assert len(files) == 1 and '--3-6.' in files[0]
+    assert decu_read(script.results_dir, files[0]).shape == (4, 5)
+
+
+def test_batch_scalars(tmpdir):
+    """Batch experiments that return one number per run should write each
+    of them as a number."""
+    class TestBatchScalars(util.TestScript):
+        @experiment(data_param='data', batch=True)
+        def exp(self, data, param):
+            return data.sum() * param
+
+    script = TestBatchScalars(tmpdir)
+    result = script.exp(np.arange(5), np.array([1.0, 2.0, 3.0]))
+    assert list(result) == [10.0, 20.0, 30.0]
+    files = sorted(listdir(script.results_dir))
+    assert [name.rsplit('.', 1)[1] for name in files] == ['float'] * 3
+    assert decu_read(script.results_dir, files[2]) == 30.0
+
+
+def decu_read(directory, filename):
+    from os.path import join
+    from decu.io import read
+    return read(join(directory, filename))
+
+
+def test_logged_parameters(tmpdir):
+    """Positional arguments should be logged under their own names."""
+    class TestParameters(util.TestScript):
+        @experiment(data_param='data')
+        def exp(self, data, param, param2=0):
+            return None
+
+    script = TestParameters(tmpdir)
+    script.exp(range(3), 4, param2=5)
+    msg = config['experiment'].subs('start_msg', exp_name='exp', run=0,
+                                    params={'param': 4, 'param2': 5})
+    with open(script.log.logfile) as file:
+        assert any(line.strip().endswith(msg) for line in file)
+
+
+def test_background_write(tmpdir):
+    """Results written in the background should be on disk after a flush."""
+    import decu.writer
+
+    class TestBackground(util.TestScript):
+        @experiment(data_param='data')
+        def exp(self, data, param):
+            return {'value': param} if param >= 0 else {'value': object()}
+
+    script = TestBackground(tmpdir)
+    config['io']['background'] = 'yes'
+    try:
+        for param in [-1, 0, 1, 2]:
+            script.exp(None, param)
+        errors = decu.writer.flush()
+    finally:
+        config['io']['background'] = 'no'
+    assert len(errors) == 1 and isinstance(errors[0], TypeError)
+    # The failed write leaves no file behind.
+    files = sorted(listdir(script.results_dir))
+    assert [decu_read(script.results_dir, f)['value']
+            for f in files] == [0, 1, 2]
+    with open(script.log.logfile) as file:
+        log = file.read()
+    assert sum('Wrote results of exp--' in line
+               for line in log.splitlines()) == 3
+    assert 'Could not write results of exp--0' in log
+
+
+class BackgroundScript(util.TestScript):
+    @experiment(data_param='data')
+    def exp(self, data, param):
+        return {'value': param} if param >= 0 else {'value': object()}
+
+
+def test_background_write_workers(tmpdir):
+    """Results that workers fail to write should be counted in the process
+    that started them."""
+    import decu.writer
+    from decu import parallel
+    script = BackgroundScript(tmpdir)
+    config['io']['background'] = 'yes'
+    try:
+        run_parallel(script.exp, [(None, p) for p in [-1, 0, -2, 1]],
+                     backend='process')
+        parallel.shutdown()
+    finally:
+        config['io']['background'] = 'no'
+    assert decu.writer.worker_failures() == 2
+    assert decu.writer.worker_failures() == 0
+    assert len(listdir(script.results_dir)) == 2
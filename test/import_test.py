@@ -0,0 +1,46 @@
+"""
+import_test.py
+--------------
+
+Test that importing decu stays fast.
+
+"""
+
+import sys
+import subprocess
+
+
+def _modules_after(code):
+    code += '\nimport sys\nprint(" ".join(sys.modules))'
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return set(output.decode().split())
+
+
+def test_no_heavy_imports():
+    """`import decu` should not import optional libraries."""
+    modules = _modules_after('import decu')
+    for name in ['matplotlib', 'pandas', 'numpy', 'networkx']:
+        assert name not in modules
+
+
+def test_lazy_registry(tmpdir):
+    """Writing a type of an optional library should register it then."""
+    basename = str(tmpdir.join('array'))
+    modules = _modules_after(
+        'import decu, numpy\n'
+        'filename = decu.io.write(numpy.arange(3), {!r})\n'
+        'assert decu.io.read(filename).tolist() == [0, 1, 2]'.format(
+            basename))
+    assert 'numpy' in modules and 'pandas' not in modules
+
+
+def test_headless_backend():
+    """Without a display, scripts that import pyplot themselves should get
+    the Agg backend."""
+    import os
+    env = {key: value for key, value in os.environ.items()
+           if key not in ('DISPLAY', 'MPLBACKEND')}
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import decu\nimport matplotlib.pyplot as plt\n'
+         'print(plt.get_backend())'], env=env)
+    assert output.decode().strip().lower() == 'agg'
@@ -8,7 +8,8 @@ Tests for the decu.io module.
 
 import os
 from numpy.random import random, randint, choice
-from decu.io import write, read, make_fullname
+from decu.io import write, read, read_many, make_fullname
+import pytest
 from pytest import importorskip
 
 
@@ -92,3 +93,136 @@ def test_dataframe(tmpdir):
     size = 100
     test(pd.DataFrame({str(idx): randint(1, 10*size, size=size)
                        for idx in range(size)}))
+
+
+def test_mmap(tmpdir):
+    """Arrays should be readable as read-only memory maps."""
+    np = importorskip('numpy')
+    array = random(size=(10, 20))
+    fullname = write(array, tmpdir.join('array'))
+    loaded = read(fullname, mmap=True)
+    assert isinstance(loaded, np.memmap)
+    assert not loaded.flags.writeable
+    assert (loaded == array).all()
+    assert type(read(fullname, mmap=False)) is np.ndarray
+
+
+def test_open_memmap(tmpdir):
+    """Arrays made by open_memmap should be moved into place when written."""
+    np = importorskip('numpy')
+    from decu.io import open_memmap
+    array = open_memmap((10, 20), 'int32', str(tmpdir))
+    array[:] = np.arange(20)
+    fullname = write(array, tmpdir.join('array'))
+    assert tmpdir.listdir() == [fullname]
+    loaded = read(fullname)
+    assert loaded.dtype == np.int32 and (loaded == np.arange(20)).all()
+
+    # Views of the array are copied, and leave the original alone.
+    view = open_memmap((10, 20), directory=str(tmpdir))
+    write(view[:5], tmpdir.join('view'))
+    assert read(str(tmpdir.join('view.npy'))).shape == (5, 20)
+    assert len(tmpdir.listdir()) == 3
+
+
+def test_formats(tmpdir):
+    """The config should choose the format of each type."""
+    importorskip('numpy')
+    from decu import config
+    array = random(size=(10, 20))
+    for fmt in ['npz', 'pickle']:
+        config['io']['ndarray_format'] = fmt
+        try:
+            fullname = write(array, tmpdir.join('array'))
+        finally:
+            config['io']['ndarray_format'] = 'npy'
+        assert fullname.endswith('.' + fmt)
+        assert (read(fullname) == array).all()
+
+
+def test_binary_frames(tmpdir):
+    """Pandas objects should survive the binary formats."""
+    pd = importorskip('pandas')
+    importorskip('pyarrow')
+    from decu import config
+    frame = pd.DataFrame({'a': randint(10, size=10), 'b': random(10)},
+                         index=list('abcdefghij'))
+    for fmt in ['parquet', 'feather', 'pickle']:
+        config['io']['dataframe_format'] = fmt
+        config['io']['series_format'] = fmt
+        try:
+            loaded = read(write(frame, tmpdir.join('frame')))
+            series = read(write(frame['b'], tmpdir.join('series')))
+        finally:
+            config['io']['dataframe_format'] = 'csv'
+            config['io']['series_format'] = 'csv'
+        assert loaded.equals(frame)
+        assert (series.values == frame['b'].values).all()
+        assert list(series.index) == list(frame.index)
+
+
+def test_register(tmpdir):
+    """Formats registered by the user should be used for their type."""
+    from decu.io import register
+
+    class Point():
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    def write_point(filename, point):
+        with open(filename, 'w') as file:
+            file.write('{} {}'.format(point.x, point.y))
+
+    def read_point(filename):
+        with open(filename) as file:
+            return Point(*map(int, file.read().split()))
+
+    register(Point, 'point', write_point, read_point)
+    fullname = write(Point(1, 2), tmpdir.join('origin'))
+    assert fullname.endswith('.point')
+    loaded = read(fullname)
+    assert (loaded.x, loaded.y) == (1, 2)
+
+
+def test_unknown_type(tmpdir):
+    """Results of a type without a format should not be written."""
+    from decu import DecuException
+
+    class Unknown():
+        pass
+
+    for call in [lambda: write(Unknown(), tmpdir.join('unknown')),
+                 lambda: make_fullname(tmpdir.join('unknown'), Unknown)]:
+        with pytest.raises(DecuException) as info:
+            call()
+        assert 'Unknown' in str(info.value)
+    assert tmpdir.listdir() == []
+
+
+def test_read_many(tmpdir):
+    """read_many should return the results in order, stacked if asked."""
+    np = importorskip('numpy')
+    arrays = [random(size=(3, 4)) for _ in range(12)]
+    paths = [write(array, tmpdir.join('array{:02d}'.format(index)))
+             for index, array in enumerate(arrays)]
+    for backend in ['thread', 'process', 'serial']:
+        loaded = read_many(paths[::-1], workers=4, backend=backend)
+        assert all((a == b).all() for a, b in zip(loaded, arrays[::-1]))
+    stacked = read_many(str(tmpdir.join('array*.npy')), stack=True)
+    assert stacked.shape == (12, 3, 4)
+    assert (stacked == np.array(arrays)).all()
+    assert read_many(str(tmpdir.join('nothing*'))) == []
+
+
+def test_read_many_frames(tmpdir):
+    """Frames should be concatenated with the run id of each file."""
+    pd = importorskip('pandas')
+    from decu import config
+    frames = {run: pd.DataFrame({'a': randint(10, size=5), 'b': random(5)})
+              for run in [3, 7, 12]}
+    paths = [write(frame, tmpdir.join(config['Script'].subs(
+        'result_file', time='now', module_name='mod', exp_name='exp',
+        run=run))) for run, frame in frames.items()]
+    loaded = read_many(paths, stack=True)
+    assert list(loaded.index.get_level_values('run').unique()) == [3, 7, 12]
+    assert (loaded.loc[7]['a'].values == frames[7]['a'].values).all()
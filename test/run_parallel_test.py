@@ -6,7 +6,10 @@ Test the run_parallel function.
 
 """
 
-from decu import run_parallel
+import os
+import pytest
+import numpy as np
+from decu import experiment, run_parallel, run_parallel_iter, DecuException
 import util
 
 
@@ -39,3 +42,334 @@ def test_multiple_params(tmpdir):
     params = [(data, p, b) for p, b in zip(range(10), range(10, 20))]
     results = run_parallel(script.experiment, params)
     assert results == [script.experiment(*p) for p in params]
+
+
+def test_iter_unordered(tmpdir):
+    """run_parallel_iter should yield every (params, result) pair."""
+    script = MyTestResultOrder(tmpdir)
+    params = [(10, p) for p in range(10)]
+    pairs = list(run_parallel_iter(script.experiment, params))
+    assert sorted(pairs) == [(p, script.experiment(*p)) for p in params]
+
+
+def test_iter_ordered_generator(tmpdir):
+    """run_parallel_iter should accept a generator and keep its order."""
+    script = MyTestResultOrder(tmpdir)
+    params = ((10, p) for p in range(10))
+    pairs = list(run_parallel_iter(script.experiment, params, ordered=True))
+    assert pairs == [((10, p), 10**p) for p in range(10)]
+
+
+class MyTestSharedData(util.TestScript):
+    @experiment(data_param='data')
+    def experiment(self, data, exponent):
+        return int(isinstance(data, np.memmap)) + 10 * exponent
+
+
+def test_shared_data(tmpdir):
+    """A large data_param should reach the workers as a memory map."""
+    script = MyTestSharedData(tmpdir)
+    data = np.ones(2**18)
+    params = [(data, p) for p in range(5)]
+    assert run_parallel(script.experiment, params) == \
+        [1 + 10 * p for p in range(5)]
+    assert run_parallel(script.experiment, params, shared=False) == \
+        [10 * p for p in range(5)]
+
+
+def test_iter_shared_data(tmpdir):
+    """run_parallel_iter should yield the original shared data back."""
+    script = MyTestSharedData(tmpdir)
+    data = np.ones(2**18)
+    params = ((data, p) for p in range(5))
+    pairs = list(run_parallel_iter(script.experiment, params, ordered=True))
+    assert all(p[0] is data for p, _ in pairs)
+    assert [res for _, res in pairs] == [1 + 10 * p for p in range(5)]
+
+
+def test_pool_reused(tmpdir):
+    """Consecutive calls to run_parallel should share one pool."""
+    from decu import parallel
+    script = MyTestResultOrder(tmpdir)
+    params = [(10, p) for p in range(4)]
+    run_parallel(script.experiment, params)
+    pool = parallel.get_pool()
+    assert run_parallel(script.experiment, params) == \
+        [script.experiment(*p) for p in params]
+    assert parallel.get_pool() is pool
+    parallel.shutdown()
+    assert not parallel.pools
+
+
+def test_backends(tmpdir):
+    """Every backend should return the same results, in order."""
+    script = MyTestSharedData(tmpdir)
+    data = np.ones(2**18)
+    params = [(data, p) for p in range(5)]
+    expected = [10 * p for p in range(5)]
+    for backend in ['thread', 'serial']:
+        assert run_parallel(script.experiment, params,
+                            backend=backend) == expected
+        pairs = run_parallel_iter(script.experiment, params, ordered=True,
+                                  backend=backend)
+        assert [res for _, res in pairs] == expected
+    runs = [int(f.split('--')[-1].split('.')[0])
+            for f in os.listdir(script.results_dir)]
+    assert len(runs) == len(set(runs)) == 20
+
+
+def test_unknown_backend(tmpdir):
+    """run_parallel should refuse unknown backends."""
+    script = MyTestResultOrder(tmpdir)
+    with pytest.raises(DecuException):
+        run_parallel(script.experiment, [(10, 1)], backend='foo')
+
+
+class MyTestJournal(util.TestScript):
+    @experiment(data_param='data')
+    def experiment(self, data, exponent):
+        if exponent == 3 and self.fail:
+            raise RuntimeError('interrupted')
+        return data**exponent
+
+
+def test_journal(tmpdir):
+    """A sweep run with a journal should resume where it was interrupted."""
+    script = MyTestJournal(tmpdir)
+    params = [(2, p) for p in range(6)]
+    script.fail = True
+    with pytest.raises(RuntimeError):
+        for _ in run_parallel_iter(script.experiment, params, ordered=True,
+                                   journal=True, backend='serial'):
+            pass
+    assert len(os.listdir(script.results_dir)) == 3
+
+    script.fail = False
+    assert run_parallel(script.experiment, params, journal=True) == \
+        [2**p for p in range(6)]
+    assert len(os.listdir(script.results_dir)) == 6
+    assert run_parallel(script.experiment, params, journal=True) == \
+        [2**p for p in range(6)]
+    assert len(os.listdir(script.results_dir)) == 6
+
+
+class MyTestJournalSum(util.TestScript):
+    @experiment(data_param='data')
+    def experiment(self, data, offset):
+        return float(data.sum()) + offset
+
+
+def test_journal_fresh_arrays(tmpdir):
+    """A journal should tell apart arrays built one after the other, even
+    when they reuse the memory of those before them."""
+    script = MyTestJournalSum(tmpdir)
+
+    def params(count):
+        for i in range(count):
+            yield np.full(1000, float(i)), 0
+
+    run_parallel(script.experiment, params(3), journal=True)
+    results = run_parallel(script.experiment, params(6), journal=True)
+    assert results == [1000.0 * i for i in range(6)]
+
+
+class MyTestSchedule(util.TestScript):
+    @experiment()
+    def experiment(self, wait):
+        from time import sleep
+        self.calls.append(wait)
+        sleep(wait)
+        return wait
+
+
+def test_schedule_longest(tmpdir):
+    """schedule='longest' should run the slowest parameter sets first."""
+    script = MyTestSchedule(tmpdir)
+    # Far enough apart that the overhead of a run does not change the order.
+    params = [(w,) for w in [0.05, 0.2, 0.0, 0.1]]
+    for calls in [[0.05, 0.2, 0.0, 0.1], [0.2, 0.1, 0.05, 0.0]]:
+        script.calls = []
+        results = run_parallel(script.experiment, params, backend='serial',
+                               schedule='longest')
+        assert results == [w for w, in params]
+        assert script.calls == calls
+
+
+class MyTestTimeout(util.TestScript):
+    @experiment()
+    def experiment(self, wait):
+        from time import sleep
+        sleep(wait)
+        return wait
+
+
+def test_timeout(tmpdir):
+    """Runs that take too long should be given up on, and logged."""
+    script = MyTestTimeout(tmpdir)
+    params = [(0.0,), (60,), (0.01,)]
+    results = run_parallel(script.experiment, params, timeout=1)
+    assert results == [0.0, None, 0.01]
+    with open(script.log.logfile) as file:
+        assert sum('Gave up on experiment' in line for line in file) == 1
+    # The hung worker should not be left behind, nor its claims.
+    assert run_parallel(script.experiment, [(0.0,)]) == [0.0]
+    assert not [name for name in os.listdir(script.state_dir)
+                if name.startswith('claims-')]
+
+
+def test_timeout_threads(tmpdir):
+    """Runs given up on that cannot be stopped should not write their
+    results when they finish."""
+    from decu import parallel
+    script = MyTestTimeout(tmpdir)
+    try:
+        results = run_parallel(script.experiment, [(0.0,), (1.5,)],
+                               timeout=0.5, backend='thread')
+    finally:
+        # Wait for the run given up on.
+        parallel.shutdown()
+    assert results == [0.0, None]
+    assert len(os.listdir(script.results_dir)) == 1
+    with open(script.log.logfile) as file:
+        log = file.read()
+    assert log.count('Finished experiment--') == 1
+    assert log.count('Discarded the result of experiment--') == 1
+
+
+def test_deadline(tmpdir):
+    """Runs unfinished by the deadline should be given up on."""
+    script = MyTestTimeout(tmpdir)
+    params = [(0.0,), (60,), (60,), (60,)]
+    results = run_parallel(script.experiment, params, deadline=1)
+    assert results == [0.0, None, None, None]
+    with open(script.log.logfile) as file:
+        assert any('gave up on 3 runs' in line for line in file)
+
+
+class MyTestSpeculate(util.TestScript):
+    @experiment()
+    def experiment(self, param):
+        from time import sleep
+        self.calls.append(param)
+        # The first call with param 0 is a straggler, its duplicate is not.
+        sleep(1 if self.calls.count(param) == 1 and param == 0 else 0.01)
+        return param
+
+
+def test_speculate(tmpdir):
+    """Stragglers should be duplicated, and the first copy to finish win."""
+    from decu import config, parallel
+    script = MyTestSpeculate(tmpdir)
+    script.calls = []
+    parallel.shutdown()
+    workers = config['parallel']['workers']
+    config['parallel']['workers'] = '2'
+    try:
+        results = run_parallel(script.experiment, [(p,) for p in range(4)],
+                               backend='thread', speculate=True)
+    finally:
+        config['parallel']['workers'] = workers
+        parallel.shutdown()
+    assert results == list(range(4))
+    assert script.calls.count(0) == 2
+    # Only the copy that finished first wrote its result.
+    assert len(os.listdir(script.results_dir)) == 4
+    with open(script.log.logfile) as file:
+        log = file.read()
+    assert 'Straggler: experiment' in log
+    assert 'Started a duplicate of experiment' in log
+    assert log.count('Finished experiment--') == 4
+    assert log.count('Discarded the result of experiment--') == 1
+
+
+class MyTestBatch(util.TestScript):
+    @experiment(data_param='data', batch=True)
+    def experiment(self, data, exponent):
+        self.sizes.append(len(exponent))
+        return np.power(data, exponent[:, None])
+
+
+def test_batch(tmpdir):
+    """Batch experiments should be called once per batch, not per run."""
+    from decu import config, parallel
+    script = MyTestBatch(tmpdir)
+    script.sizes = []
+    data = np.arange(3)
+    params = [(data, p) for p in range(10)]
+    size = config['parallel']['batch_size']
+    config['parallel']['batch_size'] = '4'
+    try:
+        results = run_parallel(script.experiment, params, backend='thread')
+        pairs = list(run_parallel_iter(script.experiment, iter(params),
+                                       backend='serial'))
+    finally:
+        config['parallel']['batch_size'] = size
+    assert [r.tolist() for r in results] == [(data**p).tolist()
+                                             for p in range(10)]
+    assert [p for p, _ in pairs] == params
+    # Lists are split so that every worker gets a batch.
+    size = max(1, min(4, -(-10 // parallel.num_slots('thread'))))
+    expected = [size] * (10 // size) + [10 % size] * (10 % size > 0)
+    assert sorted(script.sizes) == sorted(expected + [4, 4, 2])
+    assert len(os.listdir(script.results_dir)) == 20
+    with pytest.raises(DecuException):
+        run_parallel(script.experiment, params, journal=True)
+
+
+class MyTestLogging(util.TestScript):
+    @experiment()
+    def experiment(self, steps):
+        from logging import FileHandler
+        run = self.experiment.run
+        for step in range(steps):
+            self.log.info('Step {} of run {}.'.format(step, run))
+        # Workers do not write to the logfile themselves.
+        handler = self.log._logger().handlers[0]
+        return int(not isinstance(handler, FileHandler))
+
+
+def test_worker_logging(tmpdir):
+    """Records of the workers should all be written, in order, by the time
+    run_parallel returns."""
+    import re
+    script = MyTestLogging(tmpdir)
+    queued = run_parallel(script.experiment, [(50,)] * 4, backend='process')
+    assert queued == [1] * 4
+    steps = {}
+    with open(script.log.logfile) as file:
+        for line in file:
+            match = re.search(r'Step (\d+) of run (\d+)\.$', line)
+            if match is not None:
+                step, run = map(int, match.groups())
+                steps.setdefault(run, []).append(step)
+    # Run ids depend on the number of workers.
+    assert len(steps) == 4
+    assert all(found == list(range(50)) for found in steps.values())
+
+
+def test_timeout_logging(tmpdir):
+    """Workers killed while logging should not stop the records of later
+    runs from being written."""
+    script = MyTestLogging(tmpdir)
+    results = run_parallel(script.experiment, [(10**7,)] * 4 + [(3,)],
+                           backend='process', timeout=0.3)
+    assert results == [None] * 4 + [1]
+    with open(script.log.logfile) as file:
+        log = file.read()
+    assert log.count('Finished experiment--') == 1
+    assert log.rindex('Step 2 of run') > log.rindex('Gave up on experiment')
+
+
+def test_config_reaches_workers(tmpdir):
+    """Workers should see changes made to the config after they started."""
+    from decu import config
+    script = MyTestLogging(tmpdir)
+    run_parallel(script.experiment, [(1,)], backend='process')
+    config['io']['store'] = 'sqlite'
+    try:
+        run_parallel(script.experiment, [(1,)], backend='process')
+    finally:
+        config['io']['store'] = 'files'
+    names = os.listdir(script.results_dir)
+    assert len([name for name in names if name.endswith('.sqlite')]) == 1
+    assert len([name for name in names if name.endswith('.int')]) == 1
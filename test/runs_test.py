@@ -0,0 +1,45 @@
+"""
+runs_test.py
+------------
+
+Test the allocation of run identifiers.
+
+"""
+
+from multiprocessing import Pool
+from decu.runs import RunAllocator, next_run
+
+
+def _take_runs(filename):
+    return [next_run(filename, 4) for _ in range(50)]
+
+
+def test_consecutive(tmpdir):
+    """A single allocator should hand out consecutive identifiers."""
+    alloc = RunAllocator(str(tmpdir.join('counter')), 4)
+    assert [alloc.next() for _ in range(10)] == list(range(10))
+
+
+def test_range(tmpdir):
+    """Ranges should be consecutive, even when the block has too few
+    identifiers left."""
+    alloc = RunAllocator(str(tmpdir.join('counter')), 4)
+    assert [alloc.next() for _ in range(3)] == [0, 1, 2]
+    assert list(alloc.next_range(5)) == [4, 5, 6, 7, 8]
+    assert list(alloc.next_range(1)) == [3]
+    assert alloc.next() == 9
+
+
+def test_persistent(tmpdir):
+    """A new allocator should not reuse identifiers from an old one."""
+    filename = str(tmpdir.join('counter'))
+    first = [RunAllocator(filename, 4).next() for _ in range(3)]
+    assert first == [0, 4, 8]
+
+
+def test_unique_across_processes(tmpdir):
+    """Concurrent processes should never get the same identifier."""
+    filename = str(tmpdir.join('counter'))
+    with Pool(4) as pool:
+        runs = sum(pool.map(_take_runs, [filename] * 8), [])
+    assert len(runs) == len(set(runs)) == 400
@@ -48,3 +48,15 @@ def test_exec_multiple_args():
     differ = SequenceMatcher(a=logs[0], b=logs[1])
 
     assert differ.ratio() > 0.93
+
+
+def test_exec_concurrently(capsys):
+    """`decu exec -j 2` should run each script in its own process."""
+    cfg = decu.config['Script']
+    files = [os.path.join(cfg['scripts_dir'], name)
+             for name in ['script1.py', 'script2.py']]
+    assert main.exec_script(files, jobs=2) == 0
+    assert len(os.listdir(decu.config['logging']['logs_dir'])) == 2
+    assert len(os.listdir(cfg['results_dir'])) == 2
+    summary = capsys.readouterr().out
+    assert all(file in summary for file in files)
@@ -0,0 +1,80 @@
+"""
+store_test.py
+-------------
+
+Tests for the consolidated result store.
+
+"""
+
+from os import listdir
+from os.path import join
+import util
+import numpy as np
+from decu import experiment, config, run_parallel
+from decu.io import read
+
+
+class StoreScript(util.TestScript):
+    @experiment(data_param='data')
+    def exp(self, data, param):
+        return data * param
+
+
+def sqlite_store(function):
+    """Run function with the store option of section io set to sqlite."""
+    config['io']['store'] = 'sqlite'
+    try:
+        return function()
+    finally:
+        config['io']['store'] = 'files'
+
+
+def test_store(tmpdir):
+    """Every run of an experiment should go to the same store."""
+    script = StoreScript(tmpdir)
+    data = np.arange(10)
+    sqlite_store(lambda: [script.exp(data, param) for param in range(5)])
+    stores = [name for name in listdir(script.results_dir)
+              if name.endswith('.sqlite')]
+    assert stores == [name for name in listdir(script.results_dir)
+                      if not name.endswith(('-wal', '-shm'))]
+    assert len(stores) == 1
+    filename = join(script.results_dir, stores[0])
+
+    assert (read(filename + '#3') == data * 3).all()
+    assert (read(filename, run=4) == data * 4).all()
+    results = read(filename)
+    assert list(results) == ['0', '1', '2', '3', '4']
+    store = script.result_store('exp')
+    params, elapsed = store.info(2)
+    assert params == {'param': 2} and elapsed >= 0
+    with open(script.log.logfile) as file:
+        assert sum(filename + '#' in line for line in file) == 5
+
+
+def test_store_parallel(tmpdir):
+    """Worker processes should add their results to the same store."""
+    script = StoreScript(tmpdir)
+    data = np.arange(10)
+    params = [(data, param) for param in np.arange(20)]
+    sqlite_store(lambda: run_parallel(script.exp, params, backend='process'))
+    store = script.result_store('exp')
+    results = store.load()
+    # Run ids depend on the number of workers.
+    found = sorted(store.info(run)[0]['param'] for run in results)
+    assert found == list(range(20))
+    for run, result in results.items():
+        assert (result == data * store.info(run)[0]['param']).all()
+
+
+def test_store_journal(tmpdir):
+    """Journals should find the results of finished runs in the store."""
+    script = StoreScript(tmpdir)
+    data = np.arange(10)
+    params = [(data, param) for param in range(5)]
+    run = lambda: run_parallel(script.exp, params, journal=True,
+                               backend='serial')
+    first = sqlite_store(run)
+    second = sqlite_store(run)
+    assert len(script.result_store('exp').runs()) == 5
+    assert all((a == b).all() for a, b in zip(first, second))
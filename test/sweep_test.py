@@ -0,0 +1,83 @@
+"""
+sweep_test.py
+-------------
+
+Test the lazy parameter sweeps.
+
+"""
+
+import os
+import pytest
+from decu import experiment, run_parallel, DecuException
+from decu.sweep import grid, zip_axes, random
+import util
+
+
+def test_grid():
+    """grid should yield every combination, the last axis fastest."""
+    params = grid(a=[1, 2], b=range(3))
+    assert len(params) == 6
+    assert params.names == ('a', 'b')
+    assert list(params) == [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)]
+    assert list(params) == list(params)
+
+
+def test_zip_axes():
+    """zip_axes should pair the values and refuse uneven axes."""
+    params = zip_axes(a=[1, 2, 3], b='xyz')
+    assert len(params) == 3
+    assert list(params) == [(1, 'x'), (2, 'y'), (3, 'z')]
+    with pytest.raises(DecuException):
+        zip_axes(a=[1, 2], b=[1])
+    with pytest.raises(DecuException):
+        grid(a=(x for x in range(3)))
+
+
+def test_random():
+    """random should draw the same parameter sets on each iteration."""
+    params = random(100, seed=3, x=lambda rng: rng.uniform(0, 1),
+                    y=['a', 'b'])
+    assert len(params) == 100
+    sets = list(params)
+    assert sets == list(params)
+    assert all(0 <= x <= 1 and y in 'ab' for x, y in sets)
+    assert sets == list(random(100, seed=3, x=lambda rng: rng.uniform(0, 1),
+                               y=['a', 'b']))
+    unseeded = random(5, x=lambda rng: rng.random())
+    assert list(unseeded) == list(unseeded)
+
+
+class MyTestSweep(util.TestScript):
+    @experiment()
+    def experiment(self, a, b):
+        self.ahead.append(len(self.taken) - len(self.ahead))
+        return a * b
+
+
+def test_backpressure(tmpdir):
+    """run_parallel should take only a few parameter sets ahead."""
+    from decu import parallel
+    script = MyTestSweep(tmpdir)
+    script.taken, script.ahead = [], []
+
+    def params():
+        for param_set in grid(a=range(10), b=range(10)):
+            script.taken.append(param_set)
+            yield param_set
+
+    results = run_parallel(script.experiment, params(), backend='thread')
+    assert results == [a * b for a in range(10) for b in range(10)]
+    assert max(script.ahead) <= parallel.max_pending('thread')
+    # Runs that cannot be given up on do not claim their outcome.
+    assert not [name for name in os.listdir(script.state_dir)
+                if name.startswith('claims-')]
+
+
+def test_sweep_logged(tmpdir):
+    """The size of a sweep should be logged."""
+    script = MyTestSweep(tmpdir)
+    script.taken, script.ahead = [], []
+    results = run_parallel(script.experiment, grid(a=[2], b=range(3)))
+    assert results == [0, 2, 4]
+    with open(script.log.logfile) as file:
+        assert any('over 3 parameter sets of a, b' in line for line in file)
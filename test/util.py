@@ -19,6 +19,7 @@ class TestScript(decu.Script):
         self.results_dir = str(tmpdir.mkdir(cfg['results_dir']))
         self.scripts_dir = str(tmpdir.mkdir(cfg['scripts_dir']))
         self.gendata_dir = str(tmpdir.mkdir(cfg['gendata_dir']))
+        self.state_dir = str(tmpdir.mkdir(cfg['state_dir']))
         super().__init__(str(tmpdir))
 
 